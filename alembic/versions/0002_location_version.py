@@ -0,0 +1,27 @@
+"""sample location version
+
+Revision ID: 0002_location_version
+Revises: 0001_initial
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002_location_version"
+down_revision = "0001_initial"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "sample_locations",
+        sa.Column("version", sa.Integer, nullable=False, server_default="1"),
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("sample_locations") as batch_op:
+        batch_op.drop_column("version")
@@ -0,0 +1,44 @@
+"""box layouts
+
+Revision ID: 0003_box_layouts
+Revises: 0002_location_version
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003_box_layouts"
+down_revision = "0002_location_version"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "box_layouts",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("name", sa.String(length=100), nullable=False, unique=True),
+        sa.Column("rows", sa.Integer, nullable=False),
+        sa.Column("cols", sa.Integer, nullable=False),
+        sa.Column(
+            "label_scheme",
+            sa.Enum("alpha_numeric", "numeric", name="labelscheme"),
+            nullable=False,
+        ),
+        sa.CheckConstraint("rows > 0 AND cols > 0", name="ck_layout_dimensions"),
+    )
+    with op.batch_alter_table("storage_nodes") as batch_op:
+        batch_op.add_column(sa.Column("layout_id", sa.Integer, nullable=True))
+        batch_op.create_foreign_key(
+            "fk_storage_nodes_layout_id", "box_layouts", ["layout_id"], ["id"]
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("storage_nodes") as batch_op:
+        batch_op.drop_constraint("fk_storage_nodes_layout_id", type_="foreignkey")
+        batch_op.drop_column("layout_id")
+    op.drop_table("box_layouts")
+    op.execute("DROP TYPE IF EXISTS labelscheme")
@@ -0,0 +1,31 @@
+"""sample lineage
+
+Revision ID: 0004_sample_lineage
+Revises: 0003_box_layouts
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_sample_lineage"
+down_revision = "0003_box_layouts"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("samples") as batch_op:
+        batch_op.add_column(sa.Column("parent_id", sa.Integer, nullable=True))
+        batch_op.create_foreign_key(
+            "fk_samples_parent_id", "samples", ["parent_id"], ["id"]
+        )
+        batch_op.create_index("ix_samples_parent_id", ["parent_id"])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("samples") as batch_op:
+        batch_op.drop_index("ix_samples_parent_id")
+        batch_op.drop_constraint("fk_samples_parent_id", type_="foreignkey")
+        batch_op.drop_column("parent_id")
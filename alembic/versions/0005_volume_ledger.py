@@ -0,0 +1,82 @@
+"""volume ledger and rollups
+
+Revision ID: 0005_volume_ledger
+Revises: 0004_sample_lineage
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005_volume_ledger"
+down_revision = "0004_sample_lineage"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("ALTER TYPE eventtype ADD VALUE IF NOT EXISTS 'volume_change'")
+    op.create_table(
+        "volume_transactions",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("sample_id", sa.Integer, sa.ForeignKey("samples.id"), nullable=False),
+        sa.Column("delta", sa.Float, nullable=False),
+        sa.Column("volume_after", sa.Float, nullable=False),
+        sa.Column("volume_units", sa.String(length=20)),
+        sa.Column("reason", sa.String(length=50), nullable=False),
+        sa.Column("note", sa.Text),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id")),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index(
+        "ix_volume_transactions_sample_id", "volume_transactions", ["sample_id"]
+    )
+    op.create_table(
+        "volume_rollups",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("sample_type_id", sa.Integer, nullable=False),
+        sa.Column("freezer_id", sa.Integer, nullable=False),
+        sa.Column("volume_units", sa.String(length=20), nullable=False),
+        sa.Column("total_volume", sa.Float, nullable=False),
+        sa.Column("sample_count", sa.Integer, nullable=False),
+        sa.UniqueConstraint(
+            "sample_type_id", "freezer_id", "volume_units", name="uq_volume_rollup_key"
+        ),
+    )
+    # Existing volumes become the opening balance of each sample's ledger.
+    op.execute(
+        """
+        INSERT INTO volume_transactions
+            (sample_id, delta, volume_after, volume_units, reason, created_at)
+        SELECT id, volume, volume, volume_units, 'initial', updated_at
+        FROM samples WHERE volume IS NOT NULL
+        """
+    )
+    op.execute(
+        """
+        WITH RECURSIVE freezer_nodes(node_id, freezer_id) AS (
+            SELECT id, id FROM storage_nodes WHERE node_type = 'freezer'
+            UNION ALL
+            SELECT n.id, f.freezer_id
+            FROM storage_nodes n JOIN freezer_nodes f ON n.parent_id = f.node_id
+        )
+        INSERT INTO volume_rollups
+            (sample_type_id, freezer_id, volume_units, total_volume, sample_count)
+        SELECT COALESCE(s.sample_type_id, 0), COALESCE(f.freezer_id, 0),
+               COALESCE(s.volume_units, ''), SUM(s.volume), COUNT(*)
+        FROM samples s
+        LEFT JOIN sample_locations l ON l.sample_id = s.id
+        LEFT JOIN storage_positions p ON p.id = l.position_id
+        LEFT JOIN freezer_nodes f ON f.node_id = p.box_id
+        WHERE s.volume IS NOT NULL
+        GROUP BY 1, 2, 3
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("volume_rollups")
+    op.drop_index("ix_volume_transactions_sample_id", table_name="volume_transactions")
+    op.drop_table("volume_transactions")
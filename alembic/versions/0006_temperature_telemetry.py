@@ -0,0 +1,54 @@
+"""freezer temperature telemetry
+
+Revision ID: 0006_temperature_telemetry
+Revises: 0005_volume_ledger
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006_temperature_telemetry"
+down_revision = "0005_volume_ledger"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "temperature_readings",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "freezer_id", sa.Integer, sa.ForeignKey("storage_nodes.id"), nullable=False
+        ),
+        sa.Column("recorded_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("temperature", sa.Float, nullable=False),
+    )
+    op.create_index(
+        "ix_temperature_readings_freezer_time",
+        "temperature_readings",
+        ["freezer_id", "recorded_at"],
+    )
+    op.create_table(
+        "temperature_rollups",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "freezer_id", sa.Integer, sa.ForeignKey("storage_nodes.id"), nullable=False
+        ),
+        sa.Column("resolution", sa.Integer, nullable=False),
+        sa.Column("bucket_start", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("min_temperature", sa.Float, nullable=False),
+        sa.Column("max_temperature", sa.Float, nullable=False),
+        sa.Column("sum_temperature", sa.Float, nullable=False),
+        sa.Column("reading_count", sa.Integer, nullable=False),
+        sa.UniqueConstraint(
+            "freezer_id", "resolution", "bucket_start", name="uq_temperature_rollup_bucket"
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("temperature_rollups")
+    op.drop_index("ix_temperature_readings_freezer_time", table_name="temperature_readings")
+    op.drop_table("temperature_readings")
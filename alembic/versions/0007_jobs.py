@@ -0,0 +1,47 @@
+"""background jobs
+
+Revision ID: 0007_jobs
+Revises: 0006_temperature_telemetry
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007_jobs"
+down_revision = "0006_temperature_telemetry"
+branch_labels = None
+depends_on = None
+
+job_status = sa.Enum(
+    "queued", "running", "succeeded", "failed", "cancelled", name="jobstatus"
+)
+
+
+def upgrade() -> None:
+    op.create_table(
+        "jobs",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("kind", sa.String(length=50), nullable=False),
+        sa.Column("status", job_status, nullable=False),
+        sa.Column("params_json", sa.Text),
+        sa.Column("progress", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("total", sa.Integer),
+        sa.Column("message", sa.String(length=255)),
+        sa.Column("result_json", sa.Text),
+        sa.Column("result_path", sa.String(length=500)),
+        sa.Column("error", sa.Text),
+        sa.Column("cancel_requested", sa.Boolean, nullable=False, server_default=sa.false()),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id")),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("started_at", sa.DateTime(timezone=True)),
+        sa.Column("finished_at", sa.DateTime(timezone=True)),
+    )
+    op.create_index("ix_jobs_status", "jobs", ["status"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_jobs_status", table_name="jobs")
+    op.drop_table("jobs")
+    job_status.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,46 @@
+"""compacted change feed
+
+Revision ID: 0008_change_log
+Revises: 0007_jobs
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008_change_log"
+down_revision = "0007_jobs"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "change_log",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("entity", sa.String(length=20), nullable=False),
+        sa.Column("entity_id", sa.Integer, nullable=False),
+        sa.Column("seq", sa.Integer, nullable=False, unique=True),
+        sa.Column("changed_at", sa.DateTime(timezone=True), nullable=False),
+        sa.UniqueConstraint("entity", "entity_id", name="uq_change_log_entity"),
+    )
+    # Existing rows form the initial snapshot: samples first, then locations.
+    op.execute(
+        """
+        INSERT INTO change_log (entity, entity_id, seq, changed_at)
+        SELECT 'sample', id, id, updated_at FROM samples
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO change_log (entity, entity_id, seq, changed_at)
+        SELECT 'location', sample_id,
+               (SELECT COALESCE(MAX(id), 0) FROM samples) + id, placed_at
+        FROM sample_locations
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("change_log")
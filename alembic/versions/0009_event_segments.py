@@ -0,0 +1,39 @@
+"""event archive segments
+
+Revision ID: 0009_event_segments
+Revises: 0008_change_log
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009_event_segments"
+down_revision = "0008_change_log"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "event_segments",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("path", sa.String(length=500), nullable=False, unique=True),
+        sa.Column("codec", sa.String(length=10), nullable=False),
+        sa.Column("event_count", sa.Integer, nullable=False),
+        sa.Column("min_event_id", sa.Integer, nullable=False),
+        sa.Column("max_event_id", sa.Integer, nullable=False),
+        sa.Column("min_created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("max_created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("sha256", sa.String(length=64), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index("ix_event_segments_min_event_id", "event_segments", ["min_event_id"])
+    op.create_index("ix_event_segments_max_event_id", "event_segments", ["max_event_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_event_segments_max_event_id", table_name="event_segments")
+    op.drop_index("ix_event_segments_min_event_id", table_name="event_segments")
+    op.drop_table("event_segments")
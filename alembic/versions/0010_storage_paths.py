@@ -0,0 +1,49 @@
+"""materialized storage paths
+
+Revision ID: 0010_storage_paths
+Revises: 0009_event_segments
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0010_storage_paths"
+down_revision = "0009_event_segments"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("ALTER TYPE eventtype ADD VALUE IF NOT EXISTS 'relocate_storage'")
+    with op.batch_alter_table("storage_nodes") as batch:
+        batch.add_column(sa.Column("path", sa.String(length=255)))
+        batch.add_column(sa.Column("freezer_id", sa.Integer))
+        batch.create_index("ix_storage_nodes_path", ["path"])
+        batch.create_index("ix_storage_nodes_freezer_id", ["freezer_id"])
+    op.execute(
+        """
+        WITH RECURSIVE tree(id, path, freezer_id) AS (
+            SELECT id, '/' || id || '/',
+                   CASE WHEN node_type = 'freezer' THEN id END
+            FROM storage_nodes WHERE parent_id IS NULL
+            UNION ALL
+            SELECT n.id, t.path || n.id || '/',
+                   CASE WHEN n.node_type = 'freezer' THEN n.id ELSE t.freezer_id END
+            FROM storage_nodes n JOIN tree t ON n.parent_id = t.id
+        )
+        UPDATE storage_nodes SET
+            path = (SELECT path FROM tree WHERE tree.id = storage_nodes.id),
+            freezer_id = (SELECT freezer_id FROM tree WHERE tree.id = storage_nodes.id)
+        """
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("storage_nodes") as batch:
+        batch.drop_index("ix_storage_nodes_freezer_id")
+        batch.drop_index("ix_storage_nodes_path")
+        batch.drop_column("freezer_id")
+        batch.drop_column("path")
@@ -0,0 +1,31 @@
+"""sample id sequences
+
+Revision ID: 0011_id_sequences
+Revises: 0010_storage_paths
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0011_id_sequences"
+down_revision = "0010_storage_paths"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "id_sequences",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("name", sa.String(length=50), nullable=False, unique=True),
+        sa.Column("prefix", sa.String(length=20), nullable=False),
+        sa.Column("format", sa.String(length=100), nullable=False),
+        sa.Column("next_value", sa.Integer, nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("id_sequences")
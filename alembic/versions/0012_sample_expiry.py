@@ -0,0 +1,31 @@
+"""sample expiry and retention dates
+
+Revision ID: 0012_sample_expiry
+Revises: 0011_id_sequences
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0012_sample_expiry"
+down_revision = "0011_id_sequences"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("samples") as batch:
+        batch.add_column(sa.Column("expires_at", sa.DateTime(timezone=True)))
+        batch.add_column(sa.Column("retain_until", sa.DateTime(timezone=True)))
+        batch.create_index("ix_samples_status_expires_at", ["status", "expires_at"])
+        batch.create_index("ix_samples_status_retain_until", ["status", "retain_until"])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("samples") as batch:
+        batch.drop_index("ix_samples_status_retain_until")
+        batch.drop_index("ix_samples_status_expires_at")
+        batch.drop_column("retain_until")
+        batch.drop_column("expires_at")
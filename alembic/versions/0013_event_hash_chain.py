@@ -0,0 +1,113 @@
+"""hash-chained events and audit checkpoints
+
+Revision ID: 0013_event_hash_chain
+Revises: 0012_sample_expiry
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from datetime import timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0013_event_hash_chain"
+down_revision = "0012_sample_expiry"
+branch_labels = None
+depends_on = None
+
+GENESIS_HASH = "0" * 64
+FIELDS = (
+    "id",
+    "event_type",
+    "user_id",
+    "sample_id",
+    "from_position_id",
+    "to_position_id",
+    "payload_json",
+    "created_at",
+)
+
+events = sa.table(
+    "events",
+    sa.column("id", sa.Integer),
+    sa.column("event_type", sa.String),
+    sa.column("user_id", sa.Integer),
+    sa.column("sample_id", sa.Integer),
+    sa.column("from_position_id", sa.Integer),
+    sa.column("to_position_id", sa.Integer),
+    sa.column("payload_json", sa.Text),
+    sa.column("created_at", sa.DateTime),
+    sa.column("prev_hash", sa.String),
+    sa.column("hash", sa.String),
+)
+
+
+def _hash(prev_hash: str, row) -> str:
+    # Frozen copy of app.models.event_hash.
+    values = []
+    for field in FIELDS:
+        value = row[field]
+        if field == "created_at":
+            if value.tzinfo is not None:
+                value = value.astimezone(timezone.utc).replace(tzinfo=None)
+            value = value.isoformat()
+        values.append(value)
+    data = json.dumps(values, separators=(",", ":")).encode()
+    return hashlib.sha256(prev_hash.encode() + data).hexdigest()
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("events") as batch:
+        batch.add_column(sa.Column("prev_hash", sa.String(length=64)))
+        batch.add_column(sa.Column("hash", sa.String(length=64)))
+    op.create_table(
+        "event_chain_head",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("event_id", sa.Integer, nullable=False),
+        sa.Column("hash", sa.String(length=64), nullable=False),
+    )
+    op.create_table(
+        "audit_checkpoints",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("event_id", sa.Integer, nullable=False, index=True),
+        sa.Column("hash", sa.String(length=64), nullable=False),
+        sa.Column("events_verified", sa.Integer, nullable=False),
+        sa.Column("full", sa.Boolean, nullable=False),
+        sa.Column("signature", sa.String(length=64), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+    )
+    # Chain the events still in the table. Events already archived predate
+    # the chain and stay unhashed in their segments.
+    bind = op.get_bind()
+    prev_hash, last_id = GENESIS_HASH, 0
+    result = bind.execute(
+        sa.select(*(events.c[field] for field in FIELDS)).order_by(events.c.id)
+    ).mappings()
+    rows = [dict(row) for row in result]
+    updates = []
+    for row in rows:
+        row_hash = _hash(prev_hash, row)
+        updates.append({"event_id": row["id"], "prev_hash": prev_hash, "hash": row_hash})
+        prev_hash, last_id = row_hash, row["id"]
+    if updates:
+        bind.execute(
+            events.update()
+            .where(events.c.id == sa.bindparam("event_id"))
+            .values(prev_hash=sa.bindparam("prev_hash"), hash=sa.bindparam("hash")),
+            updates,
+        )
+    bind.execute(
+        sa.text("INSERT INTO event_chain_head (id, event_id, hash) VALUES (1, :event_id, :hash)"),
+        {"event_id": last_id, "hash": prev_hash},
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("audit_checkpoints")
+    op.drop_table("event_chain_head")
+    with op.batch_alter_table("events") as batch:
+        batch.drop_column("hash")
+        batch.drop_column("prev_hash")
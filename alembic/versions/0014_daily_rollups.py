@@ -0,0 +1,47 @@
+"""daily occupancy and activity rollups
+
+Revision ID: 0014_daily_rollups
+Revises: 0013_event_hash_chain
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0014_daily_rollups"
+down_revision = "0013_event_hash_chain"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "daily_activity",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("day", sa.Date, nullable=False),
+        sa.Column("freezer_id", sa.Integer, nullable=False),
+        sa.Column("box_id", sa.Integer, nullable=False),
+        sa.Column("user_id", sa.Integer, nullable=False),
+        sa.Column("event_type", sa.String(length=30), nullable=False),
+        sa.Column("count", sa.Integer, nullable=False),
+        sa.UniqueConstraint(
+            "day", "freezer_id", "box_id", "user_id", "event_type", name="uq_daily_activity_key"
+        ),
+    )
+    op.create_table(
+        "daily_occupancy",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("node_id", sa.Integer, nullable=False),
+        sa.Column("day", sa.Date, nullable=False),
+        sa.Column("occupied", sa.Integer, nullable=False),
+        sa.Column("placed", sa.Integer, nullable=False),
+        sa.Column("removed", sa.Integer, nullable=False),
+        sa.UniqueConstraint("node_id", "day", name="uq_daily_occupancy_node_day"),
+    )
+    # Existing history is filled in by the backfill_rollups job.
+
+
+def downgrade() -> None:
+    op.drop_table("daily_occupancy")
+    op.drop_table("daily_activity")
@@ -0,0 +1,43 @@
+"""per-type sample attributes
+
+Revision ID: 0015_sample_attributes
+Revises: 0014_daily_rollups
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0015_sample_attributes"
+down_revision = "0014_daily_rollups"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("sample_types") as batch:
+        batch.add_column(sa.Column("attribute_schema_json", sa.Text))
+    with op.batch_alter_table("samples") as batch:
+        batch.add_column(sa.Column("attributes_json", sa.Text))
+    op.create_table(
+        "sample_attributes",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("sample_id", sa.Integer, sa.ForeignKey("samples.id"), nullable=False),
+        sa.Column("name", sa.String(length=50), nullable=False),
+        sa.Column("num_value", sa.Float),
+        sa.Column("text_value", sa.String(length=255)),
+        sa.UniqueConstraint("sample_id", "name", name="uq_sample_attribute"),
+    )
+    op.create_index("ix_sample_attributes_num", "sample_attributes", ["name", "num_value"])
+    op.create_index("ix_sample_attributes_text", "sample_attributes", ["name", "text_value"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_sample_attributes_text", table_name="sample_attributes")
+    op.drop_index("ix_sample_attributes_num", table_name="sample_attributes")
+    op.drop_table("sample_attributes")
+    with op.batch_alter_table("samples") as batch:
+        batch.drop_column("attributes_json")
+    with op.batch_alter_table("sample_types") as batch:
+        batch.drop_column("attribute_schema_json")
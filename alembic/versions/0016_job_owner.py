@@ -0,0 +1,27 @@
+"""job owner and heartbeat
+
+Revision ID: 0016_job_owner
+Revises: 0015_sample_attributes
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0016_job_owner"
+down_revision = "0015_sample_attributes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("jobs") as batch:
+        batch.add_column(sa.Column("owner", sa.String(length=100)))
+        batch.add_column(sa.Column("heartbeat_at", sa.DateTime(timezone=True)))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("jobs") as batch:
+        batch.drop_column("heartbeat_at")
+        batch.drop_column("owner")
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import time
+from collections import deque
+from typing import Optional
+
+from starlette.responses import JSONResponse
+
+ENABLED = os.environ.get("FREEZER_ADMISSION", "1").lower() in {"1", "true", "yes"}
+TOTAL_LIMIT = int(os.environ.get("FREEZER_ADMISSION_TOTAL", "16"))
+CRITICAL_LIMIT = int(os.environ.get("FREEZER_ADMISSION_CRITICAL", "16"))
+HEAVY_LIMIT = int(os.environ.get("FREEZER_ADMISSION_HEAVY", "2"))
+HEAVY_QUEUE = int(os.environ.get("FREEZER_ADMISSION_HEAVY_QUEUE", "8"))
+HEAVY_WAIT = float(os.environ.get("FREEZER_ADMISSION_HEAVY_WAIT", "5"))
+RETRY_AFTER = 5
+WAIT_SAMPLES = 1000
+
+# Bench work: placing, moving and looking up a scanned sample or box.
+CRITICAL_ROUTES = (
+    ("POST", r"/samples/\d+/(place|move)"),
+    ("POST", r"/boxes/\d+/place"),
+    ("POST", r"/storage/moves"),
+    ("GET", r"/samples/\d+"),
+    ("GET", r"/boxes/\d+"),
+)
+# Pages and queries that scan many rows.
+HEAVY_ROUTES = (
+    ("GET", r"/dashboard"),
+    ("GET", r"/samples"),
+    ("GET", r"/samples/facets"),
+    ("GET", r"/reports(/.*)?"),
+    ("GET", r"/events"),
+    ("GET", r"/activity"),
+    ("GET", r"/volumes"),
+    ("GET", r"/expirations"),
+    ("GET", r"/storage/\d+/(grids|occupancy|consolidation|evacuation)"),
+    ("GET", r"/jobs/\d+/result"),
+    ("POST", r"/labels"),
+)
+
+
+class Lane:
+    """One class of requests with its own concurrency limit and queue.
+
+    ``max_queue`` and ``max_wait`` bound how many requests may wait and for
+    how long; requests beyond either are shed. ``None`` means unbounded.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        routes: tuple,
+        limit: int,
+        max_queue: Optional[int] = None,
+        max_wait: Optional[float] = None,
+    ) -> None:
+        self.name = name
+        self.routes = [(method, re.compile(pattern + "$")) for method, pattern in routes]
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiters: deque[tuple[asyncio.Future, float]] = deque()
+        self.admitted = 0
+        self.shed = 0
+        self.peak_queue = 0
+        self.waits: deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    def matches(self, method: str, path: str) -> bool:
+        return any(method == wanted and pattern.match(path) for wanted, pattern in self.routes)
+
+    def stats(self) -> dict:
+        waits = sorted(self.waits)
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "peak_queue": self.peak_queue,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "wait_ms": {
+                "p50": _percentile(waits, 0.5),
+                "p99": _percentile(waits, 0.99),
+                "max": round(waits[-1] * 1000, 1) if waits else None,
+            },
+        }
+
+
+class AdmissionController:
+    """Admits requests lane by lane in priority order.
+
+    Lanes share ``total`` slots on top of their own limits. A freed slot
+    goes to the first lane in ``lanes`` with someone waiting, and a lane is
+    never admitted ahead of waiters in a lane before it. All state is
+    touched from the event loop only, so no locking is needed.
+    """
+
+    def __init__(self, lanes: list[Lane], total: int = TOTAL_LIMIT) -> None:
+        self.lanes = lanes
+        self.total = total
+        self.active = 0
+
+    def lane_for(self, method: str, path: str) -> Optional[Lane]:
+        for lane in self.lanes:
+            if lane.matches(method, path):
+                return lane
+        return None
+
+    async def acquire(self, lane: Lane) -> bool:
+        began = time.perf_counter()
+        if self._may_admit(lane):
+            self._admit(lane, began)
+            return True
+        if lane.max_queue is not None and len(lane.waiters) >= lane.max_queue:
+            lane.shed += 1
+            return False
+        future = asyncio.get_running_loop().create_future()
+        lane.waiters.append((future, began))
+        lane.peak_queue = max(lane.peak_queue, len(lane.waiters))
+        try:
+            await asyncio.wait({future}, timeout=lane.max_wait)
+        except asyncio.CancelledError:
+            self._abandon(lane, future)
+            raise
+        if future.done():
+            return True
+        self._abandon(lane, future)
+        lane.shed += 1
+        return False
+
+    def release(self, lane: Lane) -> None:
+        lane.active -= 1
+        self.active -= 1
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": ENABLED,
+            "total_limit": self.total,
+            "active": self.active,
+            "lanes": {lane.name: lane.stats() for lane in self.lanes},
+        }
+
+    def _may_admit(self, lane: Lane) -> bool:
+        for other in self.lanes:
+            if other is lane:
+                break
+            if other.waiters:
+                return False
+        return not lane.waiters and lane.active < lane.limit and self.active < self.total
+
+    def _admit(self, lane: Lane, began: float) -> None:
+        lane.active += 1
+        self.active += 1
+        lane.admitted += 1
+        lane.waits.append(time.perf_counter() - began)
+
+    def _dispatch(self) -> None:
+        for lane in self.lanes:
+            while lane.waiters and lane.active < lane.limit and self.active < self.total:
+                future, began = lane.waiters.popleft()
+                if future.done():
+                    continue
+                future.set_result(None)
+                self._admit(lane, began)
+            if lane.waiters:
+                return
+
+    def _abandon(self, lane: Lane, future: asyncio.Future) -> None:
+        if future.done() and not future.cancelled():
+            # Granted just as the wait ended; hand the slot on.
+            self.release(lane)
+            return
+        future.cancel()
+        lane.waiters = deque(entry for entry in lane.waiters if entry[0] is not future)
+
+
+class AdmissionMiddleware:
+    """ASGI middleware that runs classified requests through the controller.
+
+    Requests that match no lane pass straight through.
+    """
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None) -> None:
+        self.app = app
+        self.controller = controller or _controller
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+        lane = self.controller.lane_for(scope["method"], scope["path"])
+        if lane is None:
+            await self.app(scope, receive, send)
+            return
+        if not await self.controller.acquire(lane):
+            response = JSONResponse(
+                {"detail": "Server busy, try again shortly"},
+                status_code=503,
+                headers={"Retry-After": str(RETRY_AFTER)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(lane)
+
+
+def _percentile(values: list[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(len(values) * fraction))] * 1000, 1)
+
+
+_controller = AdmissionController(
+    [
+        Lane("critical", CRITICAL_ROUTES, CRITICAL_LIMIT),
+        Lane("heavy", HEAVY_ROUTES, HEAVY_LIMIT, max_queue=HEAVY_QUEUE, max_wait=HEAVY_WAIT),
+    ]
+)
+
+
+def stats() -> dict:
+    return _controller.stats()
@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import zlib
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Callable, Iterator, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from app import models
+
+try:  # optional dependency
+    import zstandard
+except ImportError:  # pragma: no cover - exercised when zstandard is absent
+    zstandard = None
+
+ARCHIVE_DIR = os.environ.get("FREEZER_ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_MONTHS = int(os.environ.get("FREEZER_ARCHIVE_AFTER_MONTHS", "12"))
+SEGMENT_ROWS = int(os.environ.get("FREEZER_ARCHIVE_SEGMENT_ROWS", "100000"))
+BLOCK_ROWS = 4096
+CODEC = "zstd" if zstandard is not None else "zlib"
+
+MAGIC = b"FZEVSEG1"
+_TRAILER = struct.Struct("<Q8s")
+
+EVENT_FIELDS = [column.name for column in models.Event.__table__.columns]
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class ArchivedEvent:
+    """Read-only stand-in for an ``models.Event`` row stored in a segment."""
+
+    sample: Optional[models.Sample] = None
+
+    def __init__(self, row: dict) -> None:
+        self.__dict__.update(row)
+        self.event_type = models.EventType(row["event_type"])
+        self.created_at = datetime.fromisoformat(row["created_at"])
+
+    @property
+    def payload(self) -> dict:
+        return json.loads(self.payload_json) if self.payload_json else {}
+
+
+class SegmentReader:
+    """Memory-maps one segment file and decodes blocks on demand.
+
+    Layout: ``MAGIC | block... | footer JSON | footer length | MAGIC``. Each
+    block is one compressed JSON object of column arrays; the footer lists
+    every block's offset, id and time range and the sample ids it holds, so
+    lookups only decompress blocks that can match.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self._map)
+        footer_length, magic = _TRAILER.unpack_from(self._map, size - _TRAILER.size)
+        if self._map[: len(MAGIC)] != MAGIC or magic != MAGIC:
+            raise ArchiveError(f"{path} is not an event segment")
+        footer_end = size - _TRAILER.size
+        footer = json.loads(self._map[footer_end - footer_length : footer_end])
+        self.codec = footer["codec"]
+        self.fields = footer["fields"]
+        self.count = footer["count"]
+        self.blocks = footer["blocks"]
+        self.prev_hash = footer.get("prev_hash")
+        self.last_hash = footer.get("last_hash")
+        self._samples = [set(block["sample_ids"]) for block in self.blocks]
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+    def block_rows(self, index: int) -> list[dict]:
+        block = self.blocks[index]
+        data = _decompress(self.codec, self._map[block["offset"] : block["offset"] + block["length"]])
+        columns = json.loads(data)
+        return [dict(zip(self.fields, values)) for values in zip(*(columns[field] for field in self.fields))]
+
+    def rows(self, sample_id: Optional[int] = None, newest_first: bool = True) -> Iterator[dict]:
+        order = range(len(self.blocks))
+        for index in reversed(order) if newest_first else order:
+            if sample_id is not None and sample_id not in self._samples[index]:
+                continue
+            rows = self.block_rows(index)
+            for row in reversed(rows) if newest_first else rows:
+                if sample_id is None or row["sample_id"] == sample_id:
+                    yield row
+
+
+def default_cutoff(now: Optional[datetime] = None) -> datetime:
+    return (now or datetime.utcnow()) - timedelta(days=30 * ARCHIVE_AFTER_MONTHS)
+
+
+def archive_events(
+    db: Session,
+    cutoff: Optional[datetime] = None,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None,
+) -> dict:
+    """Move events created before ``cutoff`` into segment files.
+
+    Each segment is written, fsynced and read back before the catalog row is
+    added and the archived events are deleted in one transaction, so an event
+    is always in exactly one of the table or a catalogued segment. The newest
+    event is never archived: SQLite would otherwise hand its id out again.
+    """
+    cutoff = cutoff or default_cutoff()
+    event = models.Event
+    newest = db.scalar(select(func.max(event.id)))
+    if newest is None:
+        return {"segments": 0, "events": 0}
+    eligible = (event.created_at < cutoff, event.id < newest)
+    total = db.scalar(select(func.count(event.id)).where(*eligible))
+    archived = segments = 0
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    while True:
+        rows = [
+            _encode_row(row)
+            for row in db.execute(
+                select(event.__table__).where(*eligible).order_by(event.id).limit(SEGMENT_ROWS)
+            ).mappings()
+        ]
+        if not rows:
+            break
+        first, last = rows[0]["id"], rows[-1]["id"]
+        path = os.path.join(ARCHIVE_DIR, f"events-{first:012d}-{last:012d}.seg")
+        digest = write_segment(path, rows, CODEC)
+        try:
+            reader = SegmentReader(path)
+            try:
+                stored = [row["id"] for row in reader.rows(newest_first=False)]
+            finally:
+                reader.close()
+            if stored != [row["id"] for row in rows]:
+                raise ArchiveError(f"{path} failed read-back verification")
+            broken = chain_problems(rows)
+            if broken:
+                raise ArchiveError(f"Event {broken[0]['event_id']} fails hash-chain verification")
+            db.add(
+                models.EventSegment(
+                    path=path,
+                    codec=CODEC,
+                    event_count=len(rows),
+                    min_event_id=first,
+                    max_event_id=last,
+                    min_created_at=datetime.fromisoformat(rows[0]["created_at"]),
+                    max_created_at=max(datetime.fromisoformat(row["created_at"]) for row in rows),
+                    sha256=digest,
+                    created_at=datetime.utcnow(),
+                )
+            )
+            deleted = db.execute(
+                delete(event.__table__).where(event.id.between(first, last), *eligible)
+            ).rowcount
+            if deleted != len(rows):
+                raise ArchiveError("Events changed while archiving; nothing was removed")
+            db.commit()
+        except Exception:
+            db.rollback()
+            os.remove(path)
+            raise
+        archived += len(rows)
+        segments += 1
+        if progress is not None:
+            progress(archived, total)
+    return {"segments": segments, "events": archived}
+
+
+def write_segment(path: str, rows: list[dict], codec: str = CODEC) -> str:
+    blocks = []
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as handle:
+        handle.write(MAGIC)
+        for start in range(0, len(rows), BLOCK_ROWS):
+            chunk = rows[start : start + BLOCK_ROWS]
+            columns = {field: [row[field] for row in chunk] for field in EVENT_FIELDS}
+            data = _compress(codec, json.dumps(columns, separators=(",", ":")).encode())
+            blocks.append(
+                {
+                    "offset": handle.tell(),
+                    "length": len(data),
+                    "count": len(chunk),
+                    "min_id": chunk[0]["id"],
+                    "max_id": chunk[-1]["id"],
+                    "min_time": min(row["created_at"] for row in chunk),
+                    "max_time": max(row["created_at"] for row in chunk),
+                    "sample_ids": sorted({row["sample_id"] for row in chunk if row["sample_id"] is not None}),
+                }
+            )
+            handle.write(data)
+        footer = json.dumps(
+            {
+                "version": 2,
+                "codec": codec,
+                "fields": EVENT_FIELDS,
+                "count": len(rows),
+                "blocks": blocks,
+                "prev_hash": rows[0].get("prev_hash") if rows else None,
+                "last_hash": rows[-1].get("hash") if rows else None,
+            }
+        ).encode()
+        handle.write(footer)
+        handle.write(_TRAILER.pack(len(footer), MAGIC))
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temporary, path)
+    return _sha256(path)
+
+
+def chain_problems(rows: list[dict], prev_hash: Optional[str] = None) -> list[dict]:
+    """Check consecutive event rows against their chain hashes.
+
+    Unhashed rows (archived before events were chained) are skipped. When
+    ``prev_hash`` is given the first hashed row must link to it.
+    """
+    problems = []
+    for row in rows:
+        if row.get("hash") is None:
+            continue
+        if prev_hash is not None and row["prev_hash"] != prev_hash:
+            problems.append({"event_id": row["id"], "problem": "broken link"})
+        elif models.event_hash(row["prev_hash"], row) != row["hash"]:
+            problems.append({"event_id": row["id"], "problem": "hash mismatch"})
+        prev_hash = row["hash"]
+    return problems
+
+
+def archived_event_rows(
+    db: Session,
+    sample_id: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> list[dict]:
+    """Archived events, newest first, optionally for one sample."""
+    rows: list[dict] = []
+    if limit is not None and limit <= 0:
+        return rows
+    paths = db.execute(
+        select(models.EventSegment.path).order_by(models.EventSegment.max_event_id.desc())
+    ).scalars()
+    for path in paths:
+        for row in _reader(path).rows(sample_id):
+            rows.append(row)
+            if limit is not None and len(rows) >= limit:
+                return rows
+    return rows
+
+
+def verify_segments(db: Session) -> list[dict]:
+    results = []
+    for segment in db.execute(select(models.EventSegment).order_by(models.EventSegment.min_event_id)).scalars():
+        problem = None
+        if not os.path.exists(segment.path):
+            problem = "missing"
+        elif _sha256(segment.path) != segment.sha256:
+            problem = "checksum mismatch"
+        results.append({"id": segment.id, "path": segment.path, "events": segment.event_count, "problem": problem})
+    return results
+
+
+@lru_cache(maxsize=64)
+def _reader(path: str) -> SegmentReader:
+    # Segments are immutable once catalogued, so mappings can stay open.
+    return SegmentReader(path)
+
+
+def _encode_row(row) -> dict:
+    encoded = dict(row)
+    encoded["event_type"] = models.EventType(encoded["event_type"]).value
+    encoded["created_at"] = encoded["created_at"].isoformat()
+    return encoded
+
+
+def _compress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=9).compress(data)
+    return zlib.compress(data, 9)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise ArchiveError("zstandard is required to read this segment")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
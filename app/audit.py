@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import hashlib
+import hmac
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+from app import archive, models
+
+# Without a key nothing is signed: a default key would let anyone who can
+# write the database forge checkpoints.
+AUDIT_KEY = os.environ.get("FREEZER_AUDIT_KEY", "").encode() or None
+WORKERS = int(os.environ.get("FREEZER_AUDIT_WORKERS", str(os.cpu_count() or 1)))
+RANGE_ROWS = int(os.environ.get("FREEZER_AUDIT_RANGE_ROWS", "50000"))
+MAX_PROBLEMS = 100
+
+EVENT_TABLE = models.Event.__table__
+NO_KEY_WARNING = "FREEZER_AUDIT_KEY is not set; checkpoints are not recorded or trusted"
+
+logger = logging.getLogger(__name__)
+
+
+def sign_checkpoint(checkpoint: models.AuditCheckpoint) -> str:
+    message = (
+        f"{checkpoint.event_id}:{checkpoint.hash}:{checkpoint.events_verified}:"
+        f"{int(checkpoint.full)}:{checkpoint.created_at.isoformat()}"
+    )
+    if AUDIT_KEY is None:
+        raise RuntimeError(NO_KEY_WARNING)
+    return hmac.new(AUDIT_KEY, message.encode(), hashlib.sha256).hexdigest()
+
+
+def checkpoint_valid(checkpoint: models.AuditCheckpoint) -> Optional[bool]:
+    """``None`` when there is no key to check the signature with."""
+    if AUDIT_KEY is None:
+        return None
+    return hmac.compare_digest(sign_checkpoint(checkpoint), checkpoint.signature)
+
+
+def list_checkpoints(db: Session, limit: int = 50) -> list[dict]:
+    checkpoints = db.execute(
+        select(models.AuditCheckpoint).order_by(models.AuditCheckpoint.id.desc()).limit(limit)
+    ).scalars()
+    return [
+        {
+            "id": checkpoint.id,
+            "event_id": checkpoint.event_id,
+            "hash": checkpoint.hash,
+            "events_verified": checkpoint.events_verified,
+            "full": checkpoint.full,
+            "created_at": checkpoint.created_at,
+            "signature_valid": checkpoint_valid(checkpoint),
+        }
+        for checkpoint in checkpoints
+    ]
+
+
+def verify_events(
+    db: Session,
+    full: bool = False,
+    workers: int = WORKERS,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None,
+) -> dict:
+    """Check the event hash chain and record a signed checkpoint if it holds.
+
+    By default only events after the newest checkpoint are re-hashed. With
+    ``full`` (or when there is no checkpoint yet) every event is checked,
+    with archive segments and id ranges of the table spread over
+    ``workers`` processes. Without ``FREEZER_AUDIT_KEY`` every run is full
+    and no checkpoint is recorded.
+    """
+    began = time.perf_counter()
+    checkpoint = None
+    if AUDIT_KEY is None:
+        logger.warning(NO_KEY_WARNING)
+        full = True
+    if not full:
+        checkpoint = db.execute(
+            select(models.AuditCheckpoint).order_by(models.AuditCheckpoint.id.desc()).limit(1)
+        ).scalar()
+        full = checkpoint is None
+    if full:
+        result = _verify_all(db, workers, progress)
+    else:
+        result = _verify_since(db, checkpoint, progress)
+    head = db.get(models.EventChainHead, 1)
+    if head is not None and not result["problems"] and (head.event_id, head.hash) != (
+        result["last_event_id"],
+        result["last_hash"],
+    ):
+        result["problems"].append({"event_id": head.event_id, "problem": "chain head mismatch"})
+    result["ok"] = not result["problems"]
+    result["full"] = full
+    if AUDIT_KEY is None:
+        result["checkpoint_id"] = None
+        result["warning"] = NO_KEY_WARNING
+    elif result["ok"] and result["last_event_id"] and (full or result["events"]):
+        recorded = models.AuditCheckpoint(
+            event_id=result["last_event_id"],
+            hash=result["last_hash"],
+            events_verified=result["events"],
+            full=full,
+            created_at=datetime.utcnow(),
+        )
+        recorded.signature = sign_checkpoint(recorded)
+        db.add(recorded)
+        db.commit()
+        result["checkpoint_id"] = recorded.id
+    result["problems"] = result["problems"][:MAX_PROBLEMS]
+    result["seconds"] = round(time.perf_counter() - began, 3)
+    return result
+
+
+def _verify_since(
+    db: Session,
+    checkpoint: models.AuditCheckpoint,
+    progress: Optional[Callable[[int, Optional[int]], None]],
+) -> dict:
+    result = {"events": 0, "unchained": 0, "last_event_id": checkpoint.event_id, "last_hash": checkpoint.hash}
+    if not checkpoint_valid(checkpoint):
+        result["problems"] = [{"event_id": checkpoint.event_id, "problem": "checkpoint signature invalid"}]
+        return result
+    problems = []
+    anchor = db.execute(select(EVENT_TABLE).where(EVENT_TABLE.c.id == checkpoint.event_id)).mappings().first()
+    if anchor is not None and models.event_hash(anchor["prev_hash"], anchor) != checkpoint.hash:
+        problems.append({"event_id": checkpoint.event_id, "problem": "checkpoint hash mismatch"})
+    total = db.scalar(select(func.count(models.Event.id)).where(models.Event.id > checkpoint.event_id))
+    prev_hash = checkpoint.hash
+    batch: list[dict] = []
+    for row in _rows_after(db, checkpoint.event_id):
+        batch.append(row)
+        if len(batch) >= 10000:
+            prev_hash = _check_batch(batch, prev_hash, problems, result)
+            batch = []
+            if progress is not None:
+                progress(result["events"], total)
+    _check_batch(batch, prev_hash, problems, result)
+    result["problems"] = problems
+    return result
+
+
+def _check_batch(batch: list[dict], prev_hash: str, problems: list[dict], result: dict) -> str:
+    if not batch:
+        return prev_hash
+    problems.extend(archive.chain_problems(batch, prev_hash))
+    result["events"] += len(batch)
+    result["last_event_id"] = batch[-1]["id"]
+    result["last_hash"] = batch[-1]["hash"]
+    return batch[-1]["hash"]
+
+
+def _rows_after(db: Session, event_id: int) -> Iterator[dict]:
+    segments = db.execute(
+        select(models.EventSegment.path)
+        .where(models.EventSegment.max_event_id > event_id)
+        .order_by(models.EventSegment.min_event_id)
+    ).scalars()
+    for path in segments:
+        reader = archive.SegmentReader(path)
+        try:
+            for index, block in enumerate(reader.blocks):
+                if block["max_id"] > event_id:
+                    yield from (row for row in reader.block_rows(index) if row["id"] > event_id)
+        finally:
+            reader.close()
+    for row in db.execute(
+        select(EVENT_TABLE).where(EVENT_TABLE.c.id > event_id).order_by(EVENT_TABLE.c.id)
+    ).mappings():
+        yield dict(row)
+
+
+def _verify_all(
+    db: Session,
+    workers: int,
+    progress: Optional[Callable[[int, Optional[int]], None]],
+) -> dict:
+    url = db.get_bind().url.render_as_string(hide_password=False)
+    units: list[tuple] = [
+        ("segment", path)
+        for path in db.execute(
+            select(models.EventSegment.path).order_by(models.EventSegment.min_event_id)
+        ).scalars()
+    ]
+    low, high = db.execute(select(func.min(models.Event.id), func.max(models.Event.id))).one()
+    if low is not None:
+        units.extend(("range", url, start, start + RANGE_ROWS - 1) for start in range(low, high + 1, RANGE_ROWS))
+    total = db.scalar(select(func.count(models.Event.id))) + sum(
+        db.execute(select(models.EventSegment.event_count)).scalars()
+    )
+    if workers > 1 and len(units) > 1:
+        # Spawned rather than forked: the server process runs other threads.
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(workers, len(units)), mp_context=context) as pool:
+            parts = _collect(pool.map(verify_unit, units), total, progress)
+    else:
+        parts = _collect(map(verify_unit, units), total, progress)
+    result = {"events": 0, "unchained": 0, "last_event_id": 0, "last_hash": models.GENESIS_HASH}
+    problems: list[dict] = []
+    for part in parts:
+        result["events"] += part["events"]
+        result["unchained"] += part["unchained"]
+        problems.extend(part["problems"])
+        if part["last_hash"] is None:
+            continue
+        if part["prev_hash"] != result["last_hash"]:
+            problems.append({"event_id": part["first_event_id"], "problem": "broken link"})
+        result["last_event_id"] = part["last_event_id"]
+        result["last_hash"] = part["last_hash"]
+    for checkpoint in db.execute(select(models.AuditCheckpoint)).scalars():
+        if checkpoint_valid(checkpoint) is False:
+            problems.append({"event_id": checkpoint.event_id, "problem": "checkpoint signature invalid"})
+    result["problems"] = problems
+    return result
+
+
+def _collect(parts, total: int, progress) -> list[dict]:
+    collected = []
+    done = 0
+    for part in parts:
+        collected.append(part)
+        done += part["events"] + part["unchained"]
+        if progress is not None:
+            progress(done, total)
+    return collected
+
+
+def verify_unit(unit: tuple) -> dict:
+    """Verify one archive segment or one id range of the table.
+
+    Runs in a worker process. The link into the unit's first hashed row is
+    returned rather than checked; the caller stitches units together.
+    """
+    if unit[0] == "segment":
+        reader = archive.SegmentReader(unit[1])
+        try:
+            rows = list(reader.rows(newest_first=False))
+        finally:
+            reader.close()
+    else:
+        _, url, low, high = unit
+        engine = create_engine(url)
+        try:
+            with engine.connect() as connection:
+                rows = [
+                    dict(row)
+                    for row in connection.execute(
+                        select(EVENT_TABLE).where(EVENT_TABLE.c.id.between(low, high)).order_by(EVENT_TABLE.c.id)
+                    ).mappings()
+                ]
+        finally:
+            engine.dispose()
+    chained = [row for row in rows if row.get("hash") is not None]
+    return {
+        "events": len(chained),
+        "unchained": len(rows) - len(chained),
+        "first_event_id": chained[0]["id"] if chained else None,
+        "last_event_id": chained[-1]["id"] if chained else None,
+        "prev_hash": chained[0]["prev_hash"] if chained else None,
+        "last_hash": chained[-1]["hash"] if chained else None,
+        "problems": archive.chain_problems(chained)[:MAX_PROBLEMS],
+    }
@@ -0,0 +1,374 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Callable, Optional
+
+from app.db import engine as live_engine
+
+BACKUP_DIR = os.environ.get("FREEZER_BACKUP_DIR", "backups")
+PAGES_PER_STEP = int(os.environ.get("FREEZER_BACKUP_PAGES", "256"))
+STEP_PAUSE = float(os.environ.get("FREEZER_BACKUP_PAUSE_MS", "5")) / 1000
+FULL_EVERY = int(os.environ.get("FREEZER_BACKUP_FULL_EVERY", "24"))
+MAX_RESTARTS = 20
+HASH_SIZE = 16
+READ_PAGES = 256
+
+MANIFEST = "manifest.json"
+PAGE_HASHES = "pages.hash"
+INCREMENT_MAGIC = b"FZINC1\n"
+
+Progress = Callable[[int, Optional[int]], None]
+
+_backup_lock = threading.Lock()
+
+
+class BackupError(Exception):
+    pass
+
+
+def online_copy(
+    source: str,
+    target: sqlite3.Connection,
+    pages: int = PAGES_PER_STEP,
+    progress: Optional[Progress] = None,
+) -> None:
+    """Copy ``source`` into ``target`` with the online backup API.
+
+    The copy runs ``pages`` at a time with a short pause in between, so
+    writers only ever wait for one step. In WAL mode a read transaction is
+    held for the whole copy: it pins one consistent snapshot without
+    blocking writers. Otherwise every write restarts the copy, and it gives
+    up after ``MAX_RESTARTS``.
+    """
+    connection = sqlite3.connect(source, isolation_level=None, timeout=30)
+    restarts = 0
+    last_remaining: Optional[int] = None
+
+    def step(status: int, remaining: int, total: int) -> None:
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise BackupError("The database kept changing during the copy; enable WAL mode")
+        last_remaining = remaining
+        if progress is not None:
+            progress(total - remaining, total)
+        if STEP_PAUSE:
+            time.sleep(STEP_PAUSE)
+
+    try:
+        if connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+            connection.execute("BEGIN")
+            connection.execute("SELECT 1 FROM sqlite_master LIMIT 1")
+        connection.backup(target, pages=pages, progress=step)
+    finally:
+        connection.close()
+
+
+def create_backup(
+    kind: str = "auto",
+    directory: str = BACKUP_DIR,
+    source: Optional[str] = None,
+    progress: Optional[Progress] = None,
+) -> dict:
+    """Back up the live database into ``directory``.
+
+    A full backup is a plain copy of the database. An incremental backup
+    holds only the pages that differ from the previous backup, found by
+    comparing per-page hashes. ``auto`` takes an incremental unless there is
+    no full backup yet or ``FULL_EVERY`` incrementals have been taken since
+    the last one.
+    """
+    if kind not in {"auto", "full", "incremental"}:
+        raise BackupError(f"Unknown backup kind '{kind}'")
+    source = source or live_engine.url.database
+    with _backup_lock:
+        began = time.perf_counter()
+        os.makedirs(directory, exist_ok=True)
+        manifest = load_manifest(directory)
+        previous = manifest["backups"][-1] if manifest["backups"] else None
+        previous_hashes = _read_hashes(directory) if previous else None
+        if kind == "auto":
+            kind = "full" if previous_hashes is None or _chain_length(manifest, previous) > FULL_EVERY else "incremental"
+        elif kind == "incremental" and previous_hashes is None:
+            raise BackupError("An incremental backup needs an earlier backup")
+        backup_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+        staging = os.path.join(directory, f".staging-{os.getpid()}.db")
+        _remove(staging)
+        target = sqlite3.connect(staging)
+        try:
+            online_copy(source, target, progress=progress)
+        except Exception:
+            target.close()
+            _remove(staging)
+            raise
+        target.close()
+        copy_seconds = time.perf_counter() - began
+        page_size, page_count = _page_geometry(staging)
+        if kind == "incremental" and previous["page_size"] != page_size:
+            kind = "full"
+        name = f"{kind}-{backup_id}" + (".db" if kind == "full" else ".pages")
+        path = os.path.join(directory, name)
+        try:
+            if kind == "full":
+                digest, hashes = _hash_pages(staging, page_size)
+                os.replace(staging, path)
+                pages_written = page_count
+            else:
+                digest, hashes, pages_written = _write_increment(
+                    staging, path, page_size, page_count, previous_hashes, previous["id"]
+                )
+        finally:
+            _remove(staging)
+        entry = {
+            "id": backup_id,
+            "kind": kind,
+            "file": name,
+            "parent": previous["id"] if kind == "incremental" else None,
+            "created_at": datetime.utcnow().isoformat(),
+            "page_size": page_size,
+            "page_count": page_count,
+            "pages_written": pages_written,
+            "bytes": os.path.getsize(path),
+            "sha256": digest,
+            "copy_seconds": round(copy_seconds, 3),
+            "seconds": round(time.perf_counter() - began, 3),
+        }
+        entry["throughput_mb_s"] = round(page_size * page_count / 1e6 / max(entry["seconds"], 1e-6), 1)
+        _write_atomic(os.path.join(directory, PAGE_HASHES), hashes)
+        manifest["backups"].append(entry)
+        _write_atomic(os.path.join(directory, MANIFEST), json.dumps(manifest, indent=2).encode())
+        return entry
+
+
+def restore_backup(
+    backup_id: Optional[str] = None,
+    target: Optional[str] = None,
+    directory: str = BACKUP_DIR,
+    progress: Optional[Progress] = None,
+) -> dict:
+    """Rebuild a backup and check it; with ``target``, put it in place.
+
+    The full backup at the root of the chain is copied and each
+    incremental's pages are written over it. The result must match the
+    recorded SHA-256 and pass ``PRAGMA integrity_check`` before it replaces
+    ``target``. Without ``target`` this only verifies the backup. Restoring
+    over the live database must only be done with the app stopped.
+    """
+    began = time.perf_counter()
+    manifest = load_manifest(directory)
+    chain = _chain(manifest, backup_id)
+    entry = chain[-1]
+    working = os.path.join(directory, f".restore-{os.getpid()}.db")
+    try:
+        shutil.copyfile(os.path.join(directory, chain[0]["file"]), working)
+        with open(working, "r+b") as handle:
+            for index, increment in enumerate(chain[1:], start=1):
+                _apply_increment(os.path.join(directory, increment["file"]), handle)
+                if progress is not None:
+                    progress(index, len(chain))
+        digest, _ = _hash_pages(working, entry["page_size"])
+        if digest != entry["sha256"]:
+            raise BackupError(f"Backup {entry['id']} does not match its recorded checksum")
+        check = sqlite3.connect(working)
+        try:
+            integrity = check.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            check.close()
+        if integrity != "ok":
+            raise BackupError(f"Backup {entry['id']} failed the integrity check: {integrity}")
+        if target is not None:
+            # A leftover WAL from the old file would be replayed into the new one.
+            for suffix in ("-wal", "-shm", "-journal"):
+                _remove(target + suffix)
+            os.replace(working, target)
+    finally:
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            _remove(working + suffix)
+    return {
+        "id": entry["id"],
+        "chain": [backup["id"] for backup in chain],
+        "target": target,
+        "verified": True,
+        "bytes": entry["page_size"] * entry["page_count"],
+        "seconds": round(time.perf_counter() - began, 3),
+    }
+
+
+def load_manifest(directory: str = BACKUP_DIR) -> dict:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {"backups": []}
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def _chain(manifest: dict, backup_id: Optional[str]) -> list[dict]:
+    by_id = {backup["id"]: backup for backup in manifest["backups"]}
+    if not by_id:
+        raise BackupError("No backups found")
+    entry = by_id.get(backup_id) if backup_id else manifest["backups"][-1]
+    if entry is None:
+        raise BackupError(f"Backup {backup_id} not found")
+    chain = [entry]
+    while chain[-1]["parent"] is not None:
+        parent = by_id.get(chain[-1]["parent"])
+        if parent is None:
+            raise BackupError(f"Backup {chain[-1]['parent']} is missing from the chain")
+        chain.append(parent)
+    return list(reversed(chain))
+
+
+def _chain_length(manifest: dict, entry: dict) -> int:
+    return len(_chain(manifest, entry["id"])) - 1
+
+
+def _page_geometry(path: str) -> tuple[int, int]:
+    with open(path, "rb") as handle:
+        header = handle.read(100)
+    page_size = struct.unpack(">H", header[16:18])[0]
+    page_size = 65536 if page_size == 1 else page_size
+    return page_size, os.path.getsize(path) // page_size
+
+
+def _hash_pages(path: str, page_size: int) -> tuple[str, bytes]:
+    digest = hashlib.sha256()
+    hashes = bytearray()
+    with open(path, "rb") as handle:
+        while block := handle.read(page_size * READ_PAGES):
+            digest.update(block)
+            for start in range(0, len(block), page_size):
+                hashes += hashlib.blake2b(block[start : start + page_size], digest_size=HASH_SIZE).digest()
+    return digest.hexdigest(), bytes(hashes)
+
+
+def _write_increment(
+    staging: str,
+    path: str,
+    page_size: int,
+    page_count: int,
+    previous_hashes: bytes,
+    parent_id: str,
+) -> tuple[str, bytes, int]:
+    digest = hashlib.sha256()
+    hashes = bytearray()
+    compressor = zlib.compressobj(6)
+    written = 0
+    header = json.dumps({"page_size": page_size, "page_count": page_count, "parent": parent_id}).encode()
+    with open(staging, "rb") as source, open(path, "wb") as out:
+        out.write(INCREMENT_MAGIC + struct.pack(">I", len(header)) + header)
+        number = 0
+        while block := source.read(page_size * READ_PAGES):
+            digest.update(block)
+            for start in range(0, len(block), page_size):
+                page = block[start : start + page_size]
+                page_hash = hashlib.blake2b(page, digest_size=HASH_SIZE).digest()
+                hashes += page_hash
+                if previous_hashes[number * HASH_SIZE : (number + 1) * HASH_SIZE] != page_hash:
+                    out.write(compressor.compress(struct.pack(">I", number + 1) + page))
+                    written += 1
+                number += 1
+        out.write(compressor.flush())
+    return digest.hexdigest(), bytes(hashes), written
+
+
+def _apply_increment(path: str, handle) -> None:
+    with open(path, "rb") as source:
+        if source.read(len(INCREMENT_MAGIC)) != INCREMENT_MAGIC:
+            raise BackupError(f"{path} is not an incremental backup")
+        (length,) = struct.unpack(">I", source.read(4))
+        header = json.loads(source.read(length))
+        page_size = header["page_size"]
+        record = 4 + page_size
+        decompressor = zlib.decompressobj()
+        pending = b""
+        while chunk := source.read(1 << 20):
+            pending += decompressor.decompress(chunk)
+            usable = len(pending) - len(pending) % record
+            _write_pages(handle, pending[:usable], page_size)
+            pending = pending[usable:]
+        pending += decompressor.flush()
+        if len(pending) % record:
+            raise BackupError(f"{path} is truncated")
+        _write_pages(handle, pending, page_size)
+    handle.truncate(page_size * header["page_count"])
+
+
+def _write_pages(handle, records: bytes, page_size: int) -> None:
+    record = 4 + page_size
+    for start in range(0, len(records), record):
+        (number,) = struct.unpack(">I", records[start : start + 4])
+        handle.seek((number - 1) * page_size)
+        handle.write(records[start + 4 : start + record])
+
+
+def _read_hashes(directory: str) -> Optional[bytes]:
+    path = os.path.join(directory, PAGE_HASHES)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as handle:
+        return handle.read()
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as handle:
+        handle.write(data)
+    os.replace(temporary, path)
+
+
+def _remove(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.backup", description="Online backup and restore")
+    parser.add_argument("--dir", default=BACKUP_DIR, help="backup directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    take = commands.add_parser("backup", help="take a backup while the app is running")
+    take.add_argument("--kind", choices=("auto", "full", "incremental"), default="auto")
+    commands.add_parser("list", help="list backups")
+    verify = commands.add_parser("verify", help="rebuild a backup and check it")
+    verify.add_argument("--id")
+    restore = commands.add_parser("restore", help="restore a backup; stop the app first")
+    restore.add_argument("--id")
+    restore.add_argument("--target", default=live_engine.url.database)
+    args = parser.parse_args(argv)
+
+    def report(done: int, total: Optional[int]) -> None:
+        print(f"\r{done}/{total}", end="", file=sys.stderr, flush=True)
+
+    try:
+        if args.command == "backup":
+            result = create_backup(args.kind, args.dir, progress=report)
+            print(file=sys.stderr)
+            print(json.dumps(result, indent=2))
+        elif args.command == "list":
+            for entry in load_manifest(args.dir)["backups"]:
+                print(
+                    f"{entry['id']}  {entry['kind']:<11}  {entry['pages_written']:>9} pages  "
+                    f"{entry['bytes']:>12} bytes  {entry['throughput_mb_s']} MB/s"
+                )
+        else:
+            target = args.target if args.command == "restore" else None
+            print(json.dumps(restore_backup(args.id, target, args.dir), indent=2))
+    except BackupError as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,21 @@
 from __future__ import annotations
 
-from datetime import datetime
-from typing import Optional
+import hashlib
+import json
+import operator
+import re
+import string
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Callable, Optional
 
-from sqlalchemy import select
+from sqlalchemy import bindparam, delete, exists, func, insert, literal, or_, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 
-from app import models
+from app import archive, models
+from app.cache import query_cache
 
 
 class StorageError(Exception):
@@ -17,6 +26,10 @@ class SampleError(Exception):
     pass
 
 
+class PlacementConflict(StorageError):
+    pass
+
+
 def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
     return db.execute(
         select(models.User).where(models.User.username == username)
@@ -26,27 +39,401 @@ def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
 def create_user(db: Session, username: str, full_name: Optional[str]) -> models.User:
     user = models.User(username=username, full_name=full_name)
     db.add(user)
-    db.commit()
+    _commit(db)
     db.refresh(user)
     return user
 
 
-def create_sample_type(db: Session, name: str, description: Optional[str]) -> models.SampleType:
+def create_sample_type(
+    db: Session,
+    name: str,
+    description: Optional[str],
+    attribute_schema: Optional[list[dict]] = None,
+) -> models.SampleType:
     sample_type = models.SampleType(name=name, description=description)
+    if attribute_schema:
+        sample_type.attribute_schema_json = json.dumps(_validate_schema(db, None, attribute_schema))
     db.add(sample_type)
-    db.commit()
+    _commit(db)
     db.refresh(sample_type)
     return sample_type
 
 
+ATTRIBUTE_TYPES = ("number", "integer", "string", "boolean", "date", "choice")
+ATTRIBUTE_NAME = re.compile(r"^[A-Za-z_]\w{0,49}$")
+ATTRIBUTE_FILTER = re.compile(r"^(\w+)\s*(>=|<=|!=|=|>|<)\s*(.+)$")
+REINDEX_BATCH = 1000
+ID_FORMAT_FIELDS = {"prefix", "n"}
+# update_sample ignores None for other fields; for these an explicit None clears the date.
+CLEARABLE_SAMPLE_FIELDS = {"expires_at", "retain_until"}
+
+
+def set_attribute_schema(db: Session, sample_type: models.SampleType, schema: list[dict]) -> dict:
+    """Replace a sample type's attribute schema and rebuild its index rows.
+
+    Stored values are checked against the new types first; the schema is
+    rejected if any no longer fit. Newly required attributes are only
+    enforced on later writes.
+    """
+    schema = _validate_schema(db, sample_type.id, schema)
+    fields = {field["name"]: field for field in schema}
+    samples = models.Sample
+    bad = []
+    for sample_id, attributes_json in db.execute(
+        select(samples.sample_id, samples.attributes_json).where(
+            samples.sample_type_id == sample_type.id, samples.attributes_json.is_not(None)
+        )
+    ):
+        for name, value in json.loads(attributes_json).items():
+            if name in fields and value is not None:
+                try:
+                    _coerce_attribute(fields[name], value)
+                except SampleError:
+                    bad.append(sample_id)
+                    break
+        if len(bad) >= 10:
+            break
+    if bad:
+        raise SampleError(f"Stored attributes do not fit the new schema: {', '.join(bad)}")
+    sample_type.attribute_schema_json = json.dumps(schema)
+    db.flush()
+    reindexed = 0
+    last_id = 0
+    while True:
+        batch = db.execute(
+            select(samples.id, samples.attributes_json)
+            .where(samples.sample_type_id == sample_type.id, samples.id > last_id)
+            .order_by(samples.id)
+            .limit(REINDEX_BATCH)
+        ).all()
+        if not batch:
+            break
+        _index_attributes(
+            db, schema, {sample_id: json.loads(raw) if raw else {} for sample_id, raw in batch}
+        )
+        reindexed += len(batch)
+        last_id = batch[-1][0]
+    _commit(db)
+    return {
+        "sample_type_id": sample_type.id,
+        "attributes": len(schema),
+        "reindexed": reindexed,
+        "attribute_schema": schema,
+    }
+
+
+def _validate_schema(db: Session, sample_type_id: Optional[int], schema: list[dict]) -> list[dict]:
+    others = {}
+    for type_id, raw in db.execute(
+        select(models.SampleType.id, models.SampleType.attribute_schema_json).where(
+            models.SampleType.attribute_schema_json.is_not(None)
+        )
+    ):
+        if type_id != sample_type_id:
+            others.update({field["name"]: field["type"] for field in json.loads(raw)})
+    fields = []
+    for entry in schema:
+        name = entry.get("name") or ""
+        kind = entry.get("type")
+        if not ATTRIBUTE_NAME.match(name):
+            raise SampleError(f"Invalid attribute name: {name!r}")
+        if kind not in ATTRIBUTE_TYPES:
+            raise SampleError(f"Attribute {name} has unknown type {kind!r}")
+        if name in {field["name"] for field in fields}:
+            raise SampleError(f"Attribute {name} is defined twice")
+        # Filters compare by type across all sample types, so a name means
+        # the same kind of value everywhere.
+        if others.get(name, kind) != kind:
+            raise SampleError(f"Attribute {name} is a {others[name]} in another sample type")
+        field = {
+            "name": name,
+            "type": kind,
+            "required": bool(entry.get("required")),
+            "indexed": bool(entry.get("indexed")),
+            "unit": entry.get("unit") or None,
+        }
+        if kind == "choice":
+            choices = [str(choice) for choice in entry.get("choices") or []]
+            if not choices:
+                raise SampleError(f"Attribute {name} needs at least one choice")
+            field["choices"] = choices
+        fields.append(field)
+    return fields
+
+
+def _coerce_attribute(field: dict, value):
+    kind = field["type"]
+    try:
+        if kind == "boolean":
+            if isinstance(value, str):
+                if value.strip().lower() not in {"true", "false", "yes", "no", "1", "0"}:
+                    raise ValueError(value)
+                return value.strip().lower() in {"true", "yes", "1"}
+            if not isinstance(value, (bool, int)):
+                raise ValueError(value)
+            return bool(value)
+        if isinstance(value, bool):
+            raise ValueError(value)
+        if kind == "number":
+            return float(value)
+        if kind == "integer":
+            number = float(value)
+            if not number.is_integer():
+                raise ValueError(value)
+            return int(number)
+        if kind == "date":
+            return date.fromisoformat(str(value)[:10]).isoformat()
+        value = str(value)
+        if kind == "choice" and value not in field["choices"]:
+            raise ValueError(value)
+        return value
+    except (TypeError, ValueError):
+        raise SampleError(f"Attribute {field['name']} must be a {kind}, got {value!r}") from None
+
+
+def _validate_attributes(
+    sample_type: Optional[models.SampleType],
+    values: dict,
+    existing: Optional[dict] = None,
+) -> dict:
+    """Check ``values`` against the type's schema and merge them into ``existing``.
+
+    A value of ``None`` removes the attribute. Existing values are kept as
+    they are, so attributes dropped from a schema are not lost.
+    """
+    fields = {field["name"]: field for field in (sample_type.attribute_schema if sample_type else [])}
+    merged = dict(existing or {})
+    for name, value in values.items():
+        if value is None or value == "":
+            merged.pop(name, None)
+        elif name not in fields:
+            raise SampleError(f"Unknown attribute for this sample type: {name}")
+        else:
+            merged[name] = _coerce_attribute(fields[name], value)
+    missing = [name for name, field in fields.items() if field["required"] and name not in merged]
+    if missing:
+        raise SampleError(f"Missing required attributes: {', '.join(missing)}")
+    return merged
+
+
+def _index_attributes(db: Session, schema: list[dict], attributes: dict[int, dict]) -> None:
+    table = models.SampleAttribute
+    db.execute(delete(table).where(table.sample_id.in_(list(attributes))))
+    rows = []
+    for field in schema:
+        if not field["indexed"]:
+            continue
+        for sample_id, values in attributes.items():
+            value = values.get(field["name"])
+            if value is not None:
+                rows.append({"sample_id": sample_id, "name": field["name"], **_index_value(field, value)})
+    if rows:
+        db.execute(insert(table), rows)
+
+
+def _index_value(field: dict, value) -> dict:
+    if field["type"] in {"number", "integer", "boolean"}:
+        return {"num_value": float(value), "text_value": None}
+    return {"num_value": None, "text_value": str(value)}
+
+
+def _attribute_conditions(db: Session, filters: list[str]) -> list:
+    """Turn ``name<op>value`` filters into conditions on ``Sample.id``.
+
+    Attributes a sample type indexes are matched through the side table;
+    types that declare the attribute without indexing it fall back to
+    reading the JSON.
+    """
+    declared: dict[str, list[tuple[int, dict]]] = defaultdict(list)
+    for type_id, raw in db.execute(
+        select(models.SampleType.id, models.SampleType.attribute_schema_json).where(
+            models.SampleType.attribute_schema_json.is_not(None)
+        )
+    ):
+        for field in json.loads(raw):
+            declared[field["name"]].append((type_id, field))
+    operators = {
+        "=": operator.eq,
+        "!=": operator.ne,
+        ">": operator.gt,
+        ">=": operator.ge,
+        "<": operator.lt,
+        "<=": operator.le,
+    }
+    conditions = []
+    for text_filter in filters:
+        match = ATTRIBUTE_FILTER.match(text_filter.strip())
+        if not match:
+            raise SampleError(f"Invalid attribute filter: {text_filter!r}")
+        name, symbol, raw_value = match.groups()
+        if name not in declared:
+            raise SampleError(f"Unknown attribute: {name}")
+        compare = operators[symbol]
+        field = declared[name][0][1]
+        value = _coerce_attribute(field, raw_value.strip())
+        indexed = [type_id for type_id, entry in declared[name] if entry["indexed"]]
+        unindexed = [type_id for type_id, entry in declared[name] if not entry["indexed"]]
+        parts = []
+        if indexed:
+            table = models.SampleAttribute
+            column = table.num_value if field["type"] in {"number", "integer", "boolean"} else table.text_value
+            parts.append(
+                models.Sample.id.in_(
+                    select(table.sample_id).where(
+                        table.name == name, compare(column, _index_value(field, value)[column.key])
+                    )
+                )
+            )
+        if unindexed:
+            extracted = func.json_extract(models.Sample.attributes_json, f"$.{name}")
+            parts.append(
+                models.Sample.sample_type_id.in_(unindexed)
+                & compare(extracted, int(value) if isinstance(value, bool) else value)
+            )
+        conditions.append(or_(*parts))
+    return conditions
+
+
+SAMPLE_COLUMNS = (
+    models.Sample.id,
+    models.Sample.sample_id,
+    models.Sample.name,
+    models.Sample.status,
+    models.Sample.volume,
+    models.Sample.volume_units,
+    models.Sample.sample_type_id,
+    models.Sample.notes,
+    models.Sample.parent_id,
+    models.Sample.expires_at,
+    models.Sample.retain_until,
+    models.Sample.attributes_json,
+    models.Sample.created_at,
+    models.Sample.updated_at,
+)
+# Keys of the rows built from SAMPLE_COLUMNS.
+SAMPLE_FIELDS = tuple(
+    "attributes" if column.key == "attributes_json" else column.key for column in SAMPLE_COLUMNS
+)
+
+EVENT_COLUMNS = (
+    models.Event.id,
+    models.Event.event_type,
+    models.Event.sample_id,
+    models.Event.from_position_id,
+    models.Event.to_position_id,
+    models.Event.created_at,
+)
+
+
 def list_samples(
     db: Session,
     query: Optional[str] = None,
     status: Optional[str] = None,
     sample_type_id: Optional[int] = None,
     sort: str = "sample_id",
+    freezer_id: Optional[int] = None,
+    placed: Optional[bool] = None,
+    attributes: Optional[list[str]] = None,
 ) -> list[models.Sample]:
     stmt = select(models.Sample)
+    stmt = _filter_samples(stmt, query, status, sample_type_id, freezer_id, placed, attributes, db)
+    return list(db.execute(_sort_samples(stmt, sort)).scalars().all())
+
+
+def list_sample_rows(
+    db: Session,
+    query: Optional[str] = None,
+    status: Optional[str] = None,
+    sample_type_id: Optional[int] = None,
+    sort: str = "sample_id",
+    freezer_id: Optional[int] = None,
+    placed: Optional[bool] = None,
+    attributes: Optional[list[str]] = None,
+) -> list[dict]:
+    stmt = select(*SAMPLE_COLUMNS)
+    stmt = _filter_samples(stmt, query, status, sample_type_id, freezer_id, placed, attributes, db)
+    return _as_dicts(db.execute(_sort_samples(stmt, sort)))
+
+
+def sample_facets(
+    db: Session,
+    query: Optional[str] = None,
+    status: Optional[str] = None,
+    sample_type_id: Optional[int] = None,
+    freezer_id: Optional[int] = None,
+    placed: Optional[bool] = None,
+    attributes: Optional[list[str]] = None,
+) -> dict:
+    key = ("sample_facets", query, status, sample_type_id, freezer_id, placed, tuple(attributes or ()))
+    cached = query_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = query_cache.generation
+
+    # One grouped scan over the text-filtered samples; each facet is then
+    # counted with every other active filter applied but not its own, so the
+    # drop-downs show what picking another value would return.
+    freezer_column = models.StorageNode.freezer_id
+    placed_column = models.SampleLocation.id.is_not(None)
+    stmt = (
+        select(
+            models.Sample.status,
+            models.Sample.sample_type_id,
+            freezer_column,
+            placed_column,
+            func.count(),
+        )
+        .outerjoin(models.SampleLocation, models.SampleLocation.sample_id == models.Sample.id)
+        .outerjoin(
+            models.StoragePosition,
+            models.StoragePosition.id == models.SampleLocation.position_id,
+        )
+        .outerjoin(models.StorageNode, models.StorageNode.id == models.StoragePosition.box_id)
+        .group_by(models.Sample.status, models.Sample.sample_type_id, freezer_column, placed_column)
+    )
+    stmt = _filter_samples(stmt, query, attributes=attributes, db=db)
+    active = {
+        "status": status or None,
+        "sample_type": sample_type_id or None,
+        "freezer": freezer_id or None,
+        "placed": placed,
+    }
+    facets = {name: defaultdict(int) for name in active}
+    total = 0
+    for row_status, row_type, row_freezer, row_placed, count in db.execute(stmt):
+        values = {
+            "status": row_status,
+            "sample_type": row_type,
+            "freezer": row_freezer,
+            "placed": bool(row_placed),
+        }
+        misses = [
+            name
+            for name, wanted in active.items()
+            if wanted is not None and values[name] != wanted
+        ]
+        if not misses:
+            total += count
+        for name in facets:
+            if not misses or misses == [name]:
+                facets[name][values[name]] += count
+    result = {"total": total, **{name: dict(counts) for name, counts in facets.items()}}
+    query_cache.set(key, result, generation)
+    return result
+
+
+def _filter_samples(
+    stmt,
+    query: Optional[str] = None,
+    status: Optional[str] = None,
+    sample_type_id: Optional[int] = None,
+    freezer_id: Optional[int] = None,
+    placed: Optional[bool] = None,
+    attributes: Optional[list[str]] = None,
+    db: Optional[Session] = None,
+):
+    if attributes:
+        stmt = stmt.where(*_attribute_conditions(db, attributes))
     if query:
         like = f"%{query}%"
         stmt = stmt.where(
@@ -57,53 +444,589 @@ def list_samples(
         stmt = stmt.where(models.Sample.status == status)
     if sample_type_id:
         stmt = stmt.where(models.Sample.sample_type_id == sample_type_id)
+    location = models.SampleLocation
+    if placed is not None:
+        is_placed = exists().where(location.sample_id == models.Sample.id)
+        stmt = stmt.where(is_placed if placed else ~is_placed)
+    if freezer_id:
+        stmt = stmt.where(
+            models.Sample.id.in_(
+                select(location.sample_id)
+                .join(models.StoragePosition, models.StoragePosition.id == location.position_id)
+                .join(models.StorageNode, models.StorageNode.id == models.StoragePosition.box_id)
+                .where(models.StorageNode.freezer_id == freezer_id)
+            )
+        )
+    return stmt
+
+
+def _sort_samples(stmt, sort: str):
     if sort == "created_at":
-        stmt = stmt.order_by(models.Sample.created_at.desc())
-    else:
-        stmt = stmt.order_by(models.Sample.sample_id.asc())
-    return list(db.execute(stmt).scalars().all())
+        return stmt.order_by(models.Sample.created_at.desc())
+    return stmt.order_by(models.Sample.sample_id.asc())
+
+
+def _as_dicts(result) -> list[dict]:
+    keys = list(result.keys())
+    rows = [dict(zip(keys, row)) for row in result]
+    # Every API returns sample attributes as a decoded "attributes" object.
+    if "attributes_json" in keys:
+        for row in rows:
+            raw = row.pop("attributes_json")
+            row["attributes"] = json.loads(raw) if raw else {}
+    return rows
+
+
+def _check_id_format(format: str) -> None:
+    # Only plain {prefix} and {n} fields: no attribute or index access, and no
+    # nested fields in format specs.
+    try:
+        parsed = [(field, spec) for _, field, spec, _ in string.Formatter().parse(format)]
+    except ValueError as exc:
+        raise SampleError(f"Invalid id format: {exc}")
+    fields = [field for field, _ in parsed if field is not None]
+    for field in fields:
+        if field not in ID_FORMAT_FIELDS:
+            raise SampleError(
+                f"Invalid id format: unsupported field {{{field}}}; use {{prefix}} and {{n}}"
+            )
+    if any(spec and "{" in spec for _, spec in parsed):
+        raise SampleError("Invalid id format: nested fields are not allowed")
+    if "n" not in fields:
+        raise SampleError("Invalid id format: it must contain {n}")
+
+
+def create_id_sequence(
+    db: Session,
+    name: str,
+    prefix: str = "",
+    format: str = "{prefix}{n:06d}",
+    start: int = 1,
+) -> models.IdSequence:
+    _check_id_format(format)
+    sequence = models.IdSequence(name=name, prefix=prefix, format=format, next_value=start)
+    try:
+        sequence.render(start)
+    except (AttributeError, KeyError, IndexError, TypeError, ValueError) as exc:
+        raise SampleError(f"Invalid id format: {exc}")
+    if db.scalar(select(models.IdSequence.id).where(models.IdSequence.name == name)):
+        raise SampleError(f"Id sequence '{name}' already exists")
+    db.add(sequence)
+    _commit(db)
+    db.refresh(sequence)
+    return sequence
+
+
+def allocate_ids(db: Session, name: str, count: int) -> list[str]:
+    ids = _allocate_ids(db, name, count)
+    _commit(db)
+    return ids
+
+
+def _allocate_ids(db: Session, name: str, count: int) -> list[str]:
+    """Reserve ``count`` consecutive ids from a sequence in one statement.
+
+    The increment and read happen in a single UPDATE ... RETURNING, so
+    concurrent workers and processes always receive disjoint blocks. Ids
+    that a caller reserves but never uses are simply skipped.
+    """
+    if count < 1:
+        raise SampleError("Allocate at least one id")
+    table = models.IdSequence.__table__
+    row = db.execute(
+        update(table)
+        .where(table.c.name == name)
+        .values(next_value=table.c.next_value + count)
+        .returning(table.c.next_value, table.c.prefix, table.c.format)
+    ).first()
+    if row is None:
+        raise SampleError(f"Unknown id sequence '{name}'")
+    first = row.next_value - count
+    return [row.format.format(prefix=row.prefix, n=value) for value in range(first, row.next_value)]
 
 
 def create_sample(db: Session, data: dict, user: Optional[models.User]) -> models.Sample:
-    sample = models.Sample(**data)
+    parent_id = data.get("parent_id")
+    if parent_id and not db.get(models.Sample, parent_id):
+        raise SampleError("Parent sample not found")
+    data = dict(data)
+    id_sequence = data.pop("id_sequence", None)
+    if not data.get("sample_id"):
+        if not id_sequence:
+            raise SampleError("Sample ID is required")
+        data["sample_id"] = _allocate_ids(db, id_sequence, 1)[0]
+    attributes = data.pop("attributes", None) or {}
+    sample_type = db.get(models.SampleType, data["sample_type_id"]) if data.get("sample_type_id") else None
+    attributes = _validate_attributes(sample_type, attributes)
+    sample = models.Sample(**data, attributes_json=json.dumps(attributes) if attributes else None)
     db.add(sample)
     db.flush()
+    if sample_type is not None:
+        _index_attributes(db, sample_type.attribute_schema, {sample.id: attributes})
+    payload = {"sample_id": sample.sample_id}
+    if parent_id:
+        payload["parent_id"] = parent_id
     _log_event(
         db,
         event_type=models.EventType.create_sample,
         user=user,
         sample=sample,
-        payload={"sample_id": sample.sample_id},
+        payload=payload,
     )
-    db.commit()
+    if sample.volume is not None:
+        _open_volume_ledgers(db, [(sample.id, sample.volume)], sample.volume_units, user)
+        deltas: dict = {}
+        _add_volume(deltas, _volume_key(sample.sample_type_id, None, sample.volume_units), sample.volume, 1)
+        _apply_volume_deltas(db, deltas)
+    _commit(db)
     db.refresh(sample)
     return sample
 
 
+def create_aliquots(
+    db: Session,
+    parent: models.Sample,
+    count: int,
+    data: dict,
+    user: Optional[models.User],
+) -> list[int]:
+    if count < 1:
+        raise SampleError("Aliquot count must be at least 1")
+    id_sequence = data.pop("id_sequence", None)
+    sample_ids = data.pop("sample_ids", None)
+    if not sample_ids:
+        sample_ids = (
+            _allocate_ids(db, id_sequence, count)
+            if id_sequence
+            else _next_aliquot_ids(db, parent, count)
+        )
+    if len(sample_ids) != count or len(set(sample_ids)) != count:
+        raise SampleError("Provide one unique sample id per aliquot")
+    taken = list(
+        db.execute(
+            select(models.Sample.sample_id).where(models.Sample.sample_id.in_(sample_ids))
+        ).scalars()
+    )
+    if taken:
+        raise SampleError(f"Sample ids already in use: {', '.join(sorted(taken)[:10])}")
+    sample_type_id = data.get("sample_type_id") or parent.sample_type_id
+    sample_type = db.get(models.SampleType, sample_type_id) if sample_type_id else None
+    # Aliquots of the same type start from the parent's attributes.
+    attributes = _validate_attributes(
+        sample_type,
+        data.pop("attributes", None) or {},
+        parent.attributes if sample_type_id == parent.sample_type_id else None,
+    )
+    now = datetime.utcnow()
+    defaults = {
+        "name": parent.name,
+        "status": "active",
+        "volume": None,
+        "volume_units": parent.volume_units,
+        "sample_type_id": parent.sample_type_id,
+        "notes": None,
+        "expires_at": parent.expires_at,
+        "retain_until": parent.retain_until,
+    }
+    defaults.update({key: value for key, value in data.items() if value is not None})
+    defaults["attributes_json"] = json.dumps(attributes) if attributes else None
+    ids = list(
+        db.scalars(
+            insert(models.Sample).returning(models.Sample.id, sort_by_parameter_order=True),
+            [
+                {
+                    **defaults,
+                    "sample_id": sample_id,
+                    "parent_id": parent.id,
+                    "created_at": now,
+                    "updated_at": now,
+                }
+                for sample_id in sample_ids
+            ],
+        )
+    )
+    _log_events_bulk(
+        db,
+        [
+            {
+                "event_type": models.EventType.create_sample,
+                "sample_id": child_id,
+                "payload": {"sample_id": sample_id, "parent_id": parent.id},
+            }
+            for child_id, sample_id in zip(ids, sample_ids)
+        ],
+        user,
+    )
+    if sample_type is not None:
+        _index_attributes(db, sample_type.attribute_schema, {child_id: attributes for child_id in ids})
+    volume = defaults["volume"]
+    if volume is not None:
+        _open_volume_ledgers(
+            db, [(child_id, volume) for child_id in ids], defaults["volume_units"], user
+        )
+        deltas: dict = {}
+        key = _volume_key(defaults["sample_type_id"], None, defaults["volume_units"])
+        _add_volume(deltas, key, volume * len(ids), len(ids))
+        _apply_volume_deltas(db, deltas)
+    _commit(db)
+    return ids
+
+
+def sample_descendants(
+    db: Session, sample_id: int, max_depth: Optional[int] = None
+) -> list[dict]:
+    sample = models.Sample
+    tree = (
+        select(sample.id, literal(0).label("depth"))
+        .where(sample.id == sample_id)
+        .cte("descendants", recursive=True)
+    )
+    step = select(sample.id, tree.c.depth + 1).join(tree, sample.parent_id == tree.c.id)
+    if max_depth is not None:
+        step = step.where(tree.c.depth < max_depth)
+    return _lineage_rows(db, tree.union_all(step))
+
+
+def sample_ancestors(db: Session, sample_id: int) -> list[dict]:
+    sample = models.Sample
+    tree = (
+        select(sample.parent_id.label("id"), literal(1).label("depth"))
+        .where(sample.id == sample_id, sample.parent_id.is_not(None))
+        .cte("ancestors", recursive=True)
+    )
+    step = (
+        select(sample.parent_id, tree.c.depth + 1)
+        .join(tree, sample.id == tree.c.id)
+        .where(sample.parent_id.is_not(None))
+    )
+    return _lineage_rows(db, tree.union_all(step))
+
+
+def _lineage_rows(db: Session, tree) -> list[dict]:
+    sample = models.Sample
+    return _as_dicts(
+        db.execute(
+            select(
+                sample.id,
+                sample.sample_id,
+                sample.parent_id,
+                sample.status,
+                sample.sample_type_id,
+                tree.c.depth,
+            )
+            .join(tree, tree.c.id == sample.id)
+            .where(tree.c.depth > 0)
+            .order_by(tree.c.depth, sample.id)
+        )
+    )
+
+
+def _next_aliquot_ids(db: Session, parent: models.Sample, count: int) -> list[str]:
+    existing = db.scalar(
+        select(func.count(models.Sample.id)).where(models.Sample.parent_id == parent.id)
+    )
+    return [f"{parent.sample_id}-{index}" for index in range(existing + 1, existing + count + 1)]
+
+
 def update_sample(db: Session, sample: models.Sample, data: dict, user: Optional[models.User]) -> models.Sample:
     previous_status = sample.status
+    previous_volume = sample.volume
+    previous_type_id, previous_units = sample.sample_type_id, sample.volume_units
+    new_volume = data.get("volume")
+    attributes = data.get("attributes")
     for key, value in data.items():
-        if value is not None:
+        if key in {"volume", "attributes"}:
+            continue
+        if value is not None or key in CLEARABLE_SAMPLE_FIELDS:
             setattr(sample, key, value)
+    if attributes is not None or sample.sample_type_id != previous_type_id:
+        sample_type = db.get(models.SampleType, sample.sample_type_id) if sample.sample_type_id else None
+        if sample.sample_type_id == previous_type_id:
+            merged = _validate_attributes(sample_type, attributes, sample.attributes)
+        else:
+            # A new type has a different schema, so every value is checked again.
+            merged = _validate_attributes(sample_type, {**sample.attributes, **(attributes or {})})
+        sample.attributes_json = json.dumps(merged) if merged else None
+        _index_attributes(db, sample_type.attribute_schema if sample_type else [], {sample.id: merged})
     db.add(sample)
+    db.flush()
+    status = data.get("status")
+    _log_events_bulk(
+        db,
+        _update_events(
+            sample.id, previous_status, status if status and status != previous_status else None
+        ),
+        user,
+    )
+    if previous_volume is not None and (previous_type_id, previous_units) != (
+        sample.sample_type_id,
+        sample.volume_units,
+    ):
+        freezer_id = _freezer_for_sample(db, sample.id)
+        deltas: dict = {}
+        _add_volume(deltas, _volume_key(previous_type_id, freezer_id, previous_units), -previous_volume, -1)
+        _add_volume(deltas, _volume_key(sample.sample_type_id, freezer_id, sample.volume_units), previous_volume, 1)
+        _apply_volume_deltas(db, deltas)
+    if new_volume is not None and new_volume != previous_volume:
+        db.flush()
+        _record_volume_change(
+            db, sample, new_volume - (previous_volume or 0), "adjustment", user
+        )
+    _commit(db)
+    db.refresh(sample)
+    return sample
+
+
+def set_sample_status(
+    db: Session,
+    sample_ids: list[int],
+    status: str,
+    user: Optional[models.User],
+    reason: Optional[str] = None,
+) -> int:
+    """Move many samples to ``status`` with one event batch.
+
+    Writes the same update/status_change event pair as ``update_sample``.
+    Samples already in ``status`` are left alone. The UPDATE re-checks the
+    status it read, so when two processes race for the same rows only the
+    rows each one actually changed get events.
+    """
+    sample = models.Sample
+    rows = db.execute(
+        select(sample.id, sample.status).where(sample.id.in_(sample_ids), sample.status != status)
+    ).all()
+    by_previous: dict = defaultdict(list)
+    for sample_id, previous in rows:
+        by_previous[previous].append(sample_id)
+    events = []
+    changed = 0
+    for previous, ids in by_previous.items():
+        updated = db.execute(
+            update(sample)
+            .where(sample.id.in_(ids), sample.status == previous)
+            .values(status=status, updated_at=datetime.utcnow())
+            .returning(sample.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        for sample_id in updated:
+            events.extend(_update_events(sample_id, previous, status, reason))
+        changed += len(updated)
+    if not changed:
+        _rollback(db)
+        return 0
+    _log_events_bulk(db, events, user)
+    _commit(db)
+    return changed
+
+
+def _update_events(
+    sample_id: int,
+    previous_status: Optional[str],
+    status: Optional[str] = None,
+    reason: Optional[str] = None,
+) -> list[dict]:
+    events = [
+        {
+            "event_type": models.EventType.update_sample,
+            "sample_id": sample_id,
+            "payload": {"updated_at": datetime.utcnow().isoformat()},
+        }
+    ]
+    if status is not None:
+        payload = {"from": previous_status, "to": status}
+        if reason:
+            payload["reason"] = reason
+        events.append(
+            {"event_type": models.EventType.status_change, "sample_id": sample_id, "payload": payload}
+        )
+    return events
+
+
+def record_volume_change(
+    db: Session,
+    sample: models.Sample,
+    delta: float,
+    reason: str,
+    user: Optional[models.User],
+    note: Optional[str] = None,
+) -> models.VolumeTransaction:
+    transaction = _record_volume_change(db, sample, delta, reason, user, note)
+    _commit(db)
+    db.refresh(sample)
+    return transaction
+
+
+def volume_history(db: Session, sample_id: int) -> list[models.VolumeTransaction]:
+    return list(
+        db.execute(
+            select(models.VolumeTransaction)
+            .where(models.VolumeTransaction.sample_id == sample_id)
+            .order_by(models.VolumeTransaction.id.desc())
+        ).scalars()
+    )
+
+
+def volume_rollups(
+    db: Session,
+    sample_type_id: Optional[int] = None,
+    freezer_id: Optional[int] = None,
+    volume_units: Optional[str] = None,
+) -> list[models.VolumeRollup]:
+    rollup = models.VolumeRollup
+    stmt = select(rollup).order_by(rollup.sample_type_id, rollup.freezer_id, rollup.volume_units)
+    if sample_type_id is not None:
+        stmt = stmt.where(rollup.sample_type_id == sample_type_id)
+    if freezer_id is not None:
+        stmt = stmt.where(rollup.freezer_id == freezer_id)
+    if volume_units is not None:
+        stmt = stmt.where(rollup.volume_units == volume_units)
+    return list(db.execute(stmt).scalars())
+
+
+def freezers_for_positions(db: Session, position_ids: list[int]) -> dict[int, int]:
+    position_ids = [position_id for position_id in set(position_ids) if position_id]
+    if not position_ids:
+        return {}
+    return dict(
+        db.execute(
+            select(models.StoragePosition.id, models.StorageNode.freezer_id)
+            .join(models.StorageNode, models.StorageNode.id == models.StoragePosition.box_id)
+            .where(
+                models.StoragePosition.id.in_(position_ids),
+                models.StorageNode.freezer_id.is_not(None),
+            )
+        ).all()
+    )
+
+
+def _freezer_for_sample(db: Session, sample_id: int) -> Optional[int]:
+    current = _current_location(db, sample_id)
+    if not current:
+        return None
+    return freezers_for_positions(db, [current.position_id]).get(current.position_id)
+
+
+def _record_volume_change(
+    db: Session,
+    sample: models.Sample,
+    delta: float,
+    reason: str,
+    user: Optional[models.User],
+    note: Optional[str] = None,
+) -> models.VolumeTransaction:
+    if not delta:
+        raise SampleError("Volume change must be non-zero")
+    table = models.Sample.__table__
+    was_tracked = db.scalar(select(table.c.volume).where(table.c.id == sample.id)) is not None
+    # Balance check and write in one statement so concurrent withdrawals
+    # cannot overdraw a tube.
+    volume_after = db.execute(
+        update(table)
+        .where(
+            table.c.id == sample.id,
+            table.c.volume.is_not(None) if was_tracked else table.c.volume.is_(None),
+            func.coalesce(table.c.volume, 0) + delta >= 0,
+        )
+        .values(volume=func.coalesce(table.c.volume, 0) + delta, updated_at=datetime.utcnow())
+        .returning(table.c.volume)
+    ).scalar_one_or_none()
+    if volume_after is None:
+        raise SampleError("Not enough volume remaining for this withdrawal")
+    transaction = models.VolumeTransaction(
+        sample_id=sample.id,
+        delta=delta,
+        volume_after=volume_after,
+        volume_units=sample.volume_units,
+        reason=reason,
+        note=note,
+        user_id=user.id if user else None,
+        created_at=datetime.utcnow(),
+    )
+    db.add(transaction)
+    deltas: dict = {}
+    key = _volume_key(sample.sample_type_id, _freezer_for_sample(db, sample.id), sample.volume_units)
+    _add_volume(deltas, key, delta, 0 if was_tracked else 1)
+    _apply_volume_deltas(db, deltas)
     _log_event(
         db,
-        event_type=models.EventType.update_sample,
+        event_type=models.EventType.volume_change,
         user=user,
         sample=sample,
-        payload={"updated_at": datetime.utcnow().isoformat()},
+        payload={"delta": delta, "volume_after": volume_after, "reason": reason},
     )
-    if "status" in data and data.get("status") and data.get("status") != previous_status:
-        _log_event(
-            db,
-            event_type=models.EventType.status_change,
-            user=user,
-            sample=sample,
-            payload={"from": previous_status, "to": data.get("status")},
+    db.flush()
+    return transaction
+
+
+def _open_volume_ledgers(
+    db: Session,
+    volumes: list[tuple[int, float]],
+    volume_units: Optional[str],
+    user: Optional[models.User],
+) -> None:
+    now = datetime.utcnow()
+    db.execute(
+        insert(models.VolumeTransaction),
+        [
+            {
+                "sample_id": sample_id,
+                "delta": volume,
+                "volume_after": volume,
+                "volume_units": volume_units,
+                "reason": "initial",
+                "user_id": user.id if user else None,
+                "created_at": now,
+            }
+            for sample_id, volume in volumes
+        ],
+    )
+
+
+def _volume_key(
+    sample_type_id: Optional[int], freezer_id: Optional[int], volume_units: Optional[str]
+) -> tuple[int, int, str]:
+    return (sample_type_id or 0, freezer_id or 0, volume_units or "")
+
+
+def _add_volume(deltas: dict, key: tuple, volume: float, count: int) -> None:
+    total = deltas.setdefault(key, [0.0, 0])
+    total[0] += volume
+    total[1] += count
+
+
+def _move_volume(
+    deltas: dict,
+    sample: models.Sample,
+    from_freezer_id: Optional[int],
+    to_freezer_id: Optional[int],
+) -> None:
+    if sample.volume is None or (from_freezer_id or 0) == (to_freezer_id or 0):
+        return
+    _add_volume(deltas, _volume_key(sample.sample_type_id, from_freezer_id, sample.volume_units), -sample.volume, -1)
+    _add_volume(deltas, _volume_key(sample.sample_type_id, to_freezer_id, sample.volume_units), sample.volume, 1)
+
+
+def _apply_volume_deltas(db: Session, deltas: dict) -> None:
+    table = models.VolumeRollup.__table__
+    for (sample_type_id, freezer_id, volume_units), (volume, count) in deltas.items():
+        if not volume and not count:
+            continue
+        stmt = sqlite_insert(table).values(
+            sample_type_id=sample_type_id,
+            freezer_id=freezer_id,
+            volume_units=volume_units,
+            total_volume=volume,
+            sample_count=count,
+        )
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["sample_type_id", "freezer_id", "volume_units"],
+                set_={
+                    "total_volume": table.c.total_volume + stmt.excluded.total_volume,
+                    "sample_count": table.c.sample_count + stmt.excluded.sample_count,
+                },
+            )
         )
-    db.commit()
-    db.refresh(sample)
-    return sample
 
 
 def create_storage_node(
@@ -113,46 +1036,450 @@ def create_storage_node(
     parent_id: Optional[int],
     user: Optional[models.User],
 ) -> models.StorageNode:
+    parent = db.get(models.StorageNode, parent_id) if parent_id else None
+    if parent_id and parent is None:
+        raise StorageError("Parent node not found")
     node = models.StorageNode(name=name, node_type=node_type, parent_id=parent_id)
     db.add(node)
     db.flush()
+    node.path = f"{parent.path if parent else '/'}{node.id}/"
+    node.freezer_id = node.id if node_type == models.StorageNodeType.freezer else (
+        parent.freezer_id if parent else None
+    )
     _log_event(
         db,
         event_type=models.EventType.create_storage,
         user=user,
         payload={"node_id": node.id, "node_type": node_type.value},
     )
-    db.commit()
+    _commit(db)
     db.refresh(node)
     return node
 
 
-def create_box_positions(
+def relocate_storage_node(
     db: Session,
-    box_id: int,
+    node: models.StorageNode,
+    parent: Optional[models.StorageNode],
+    user: Optional[models.User],
+    sample_events: bool = False,
+    batch_size: int = 1000,
+) -> dict:
+    """Reparent ``node`` and everything below it with set-based statements.
+
+    Derived paths and freezer ids for the whole subtree are rewritten with two
+    UPDATEs; samples never change position, so only volume rollups and the
+    change feed are adjusted for them. One summary event is always written;
+    ``sample_events`` adds one event per relocated sample in batches.
+    """
+    if parent is not None and parent.path.startswith(node.path):
+        raise StorageError("Cannot move a node into its own subtree")
+    if parent is None and node.node_type != models.StorageNodeType.freezer:
+        raise StorageError("Only freezers can be top-level nodes")
+    nodes = models.StorageNode.__table__
+    old_path = node.path
+    new_path = f"{parent.path if parent else '/'}{node.id}/"
+    old_freezer = node.freezer_id
+    new_freezer = node.id if node.node_type == models.StorageNodeType.freezer else (
+        parent.freezer_id if parent else None
+    )
+    from_parent_id = node.parent_id
+    in_subtree = nodes.c.path.like(f"{old_path}%")
+
+    boxes = db.scalar(
+        select(func.count()).where(in_subtree, nodes.c.node_type == models.StorageNodeType.box)
+    )
+    location = models.SampleLocation
+    sample_rows = db.execute(
+        select(
+            location.sample_id,
+            models.Sample.sample_type_id,
+            models.Sample.volume,
+            models.Sample.volume_units,
+        )
+        .join(models.StoragePosition, models.StoragePosition.id == location.position_id)
+        .join(nodes, nodes.c.id == models.StoragePosition.box_id)
+        .join(models.Sample, models.Sample.id == location.sample_id)
+        .where(in_subtree)
+    ).all()
+
+    db.execute(update(nodes).where(nodes.c.id == node.id).values(parent_id=parent.id if parent else None))
+    if new_path != old_path:
+        db.execute(
+            update(nodes)
+            .where(in_subtree)
+            .values(path=literal(new_path).concat(func.substr(nodes.c.path, len(old_path) + 1)))
+        )
+    if new_freezer != old_freezer:
+        db.execute(
+            update(nodes)
+            .where(
+                nodes.c.path.like(f"{new_path}%"),
+                nodes.c.freezer_id.is_(None)
+                if old_freezer is None
+                else nodes.c.freezer_id == old_freezer,
+            )
+            .values(freezer_id=new_freezer)
+        )
+        deltas: dict = {}
+        for row in sample_rows:
+            if row.volume is not None:
+                _add_volume(deltas, _volume_key(row.sample_type_id, old_freezer, row.volume_units), -row.volume, -1)
+                _add_volume(deltas, _volume_key(row.sample_type_id, new_freezer, row.volume_units), row.volume, 1)
+        _apply_volume_deltas(db, deltas)
+
+    summary = {
+        "node_id": node.id,
+        "from_parent_id": from_parent_id,
+        "to_parent_id": parent.id if parent else None,
+        "from_freezer_id": old_freezer,
+        "to_freezer_id": new_freezer,
+        "boxes": boxes,
+        "samples": len(sample_rows),
+    }
+    _log_event(db, event_type=models.EventType.relocate_storage, user=user, payload=summary)
+    sample_ids = [row.sample_id for row in sample_rows]
+    for start in range(0, len(sample_ids), batch_size):
+        chunk = sample_ids[start : start + batch_size]
+        if sample_events:
+            _log_events_bulk(
+                db,
+                [
+                    {
+                        "event_type": models.EventType.relocate_storage,
+                        "sample_id": sample_id,
+                        "payload": {"node_id": node.id, "to_parent_id": summary["to_parent_id"]},
+                    }
+                    for sample_id in chunk
+                ],
+                user,
+            )
+        else:
+            _record_changes(db, [("location", sample_id) for sample_id in chunk])
+    _commit(db)
+    db.expire_all()
+    return summary
+
+
+@dataclass
+class VirtualPosition:
+    box_id: int
+    row: int
+    col: int
+    label: str
+    id: Optional[int] = None
+    location: None = None
+
+
+def create_box_layout(
+    db: Session,
+    name: str,
     rows: int,
     cols: int,
+    label_scheme: models.LabelScheme = models.LabelScheme.alpha_numeric,
+) -> models.BoxLayout:
+    if rows < 1 or cols < 1:
+        raise StorageError("Layouts need at least one row and one column")
+    layout = models.BoxLayout(name=name, rows=rows, cols=cols, label_scheme=label_scheme)
+    db.add(layout)
+    _commit(db)
+    db.refresh(layout)
+    return layout
+
+
+def get_or_create_box_layout(
+    db: Session,
+    rows: int,
+    cols: int,
+    label_scheme: models.LabelScheme = models.LabelScheme.alpha_numeric,
+) -> models.BoxLayout:
+    layout = db.execute(
+        select(models.BoxLayout).where(
+            models.BoxLayout.rows == rows,
+            models.BoxLayout.cols == cols,
+            models.BoxLayout.label_scheme == label_scheme,
+        )
+    ).scalars().first()
+    if layout:
+        return layout
+    if rows < 1 or cols < 1:
+        raise StorageError("Layouts need at least one row and one column")
+    name = f"{rows}x{cols}"
+    if label_scheme != models.LabelScheme.alpha_numeric:
+        name = f"{name} {label_scheme.value}"
+    layout = models.BoxLayout(name=name, rows=rows, cols=cols, label_scheme=label_scheme)
+    db.add(layout)
+    db.flush()
+    return layout
+
+
+def assign_box_layout(
+    db: Session,
+    box_id: int,
+    layout: models.BoxLayout,
     user: Optional[models.User],
-) -> list[models.StoragePosition]:
-    positions = []
-    for row in range(1, rows + 1):
-        row_label = chr(64 + row)
-        for col in range(1, cols + 1):
-            label = f"{row_label}{col}"
-            positions.append(
-                models.StoragePosition(
-                    box_id=box_id, row=row, col=col, label=label
-                )
-            )
-    db.add_all(positions)
+    materialize: bool = False,
+) -> int:
+    box = db.get(models.StorageNode, box_id)
+    if not box or box.node_type != models.StorageNodeType.box:
+        raise StorageError("Box not found")
+    position = models.StoragePosition
+    outside = db.execute(
+        select(position.id)
+        .where(
+            position.box_id == box_id,
+            (position.row > layout.rows) | (position.col > layout.cols),
+        )
+        .limit(1)
+    ).first()
+    if outside:
+        raise StorageError("Box has positions outside the requested layout")
+    box.layout_id = layout.id
+    created = _materialize_positions(db, box_id, layout) if materialize else 0
     _log_event(
         db,
         event_type=models.EventType.create_storage,
         user=user,
-        payload={"box_id": box_id, "positions": len(positions)},
+        payload={"box_id": box_id, "layout_id": layout.id, "positions": created},
+    )
+    _commit(db)
+    return created
+
+
+def create_box_positions(
+    db: Session,
+    box_id: int,
+    rows: int,
+    cols: int,
+    user: Optional[models.User],
+    materialize: bool = True,
+    label_scheme: models.LabelScheme = models.LabelScheme.alpha_numeric,
+) -> int:
+    layout = get_or_create_box_layout(db, rows, cols, label_scheme)
+    return assign_box_layout(db, box_id, layout, user, materialize)
+
+
+def ensure_position(db: Session, box_id: int, row: int, col: int) -> models.StoragePosition:
+    position = _position_at(db, box_id, row, col)
+    if position:
+        return position
+    box = db.get(models.StorageNode, box_id)
+    if not box or box.node_type != models.StorageNodeType.box:
+        raise StorageError("Box not found")
+    layout = box.layout
+    if not layout or not (1 <= row <= layout.rows and 1 <= col <= layout.cols):
+        raise StorageError("Position is outside the box layout")
+    db.execute(
+        sqlite_insert(models.StoragePosition.__table__)
+        .values(box_id=box_id, row=row, col=col, label=layout.label(row, col))
+        .on_conflict_do_nothing()
+    )
+    _commit(db)
+    return _position_at(db, box_id, row, col)
+
+
+def box_cells(db: Session, box: models.StorageNode) -> list:
+    positions = list(
+        db.execute(
+            select(models.StoragePosition)
+            .where(models.StoragePosition.box_id == box.id)
+            .order_by(models.StoragePosition.row, models.StoragePosition.col)
+        ).scalars()
     )
-    db.commit()
-    return positions
+    layout = box.layout
+    if not layout:
+        return positions
+    by_cell = {(position.row, position.col): position for position in positions}
+    return [
+        by_cell.get((row, col))
+        or VirtualPosition(box_id=box.id, row=row, col=col, label=layout.label(row, col))
+        for row in range(1, layout.rows + 1)
+        for col in range(1, layout.cols + 1)
+    ]
+
+
+def box_cell_rows(db: Session, box: models.StorageNode) -> list[dict]:
+    position = models.StoragePosition
+    result = db.execute(
+        select(
+            position.id,
+            position.label,
+            position.row,
+            position.col,
+            models.SampleLocation.sample_id,
+        )
+        .outerjoin(models.SampleLocation, models.SampleLocation.position_id == position.id)
+        .where(position.box_id == box.id)
+        .order_by(position.row, position.col)
+    )
+    cells = [
+        {
+            "id": position_id,
+            "label": label,
+            "row": row,
+            "col": col,
+            "occupied": sample_id is not None,
+            "sample_id": sample_id,
+        }
+        for position_id, label, row, col, sample_id in result
+    ]
+    layout = box.layout
+    if not layout:
+        return cells
+    by_cell = {(cell["row"], cell["col"]): cell for cell in cells}
+    return [
+        by_cell.get((row, col))
+        or {
+            "id": None,
+            "label": layout.label(row, col),
+            "row": row,
+            "col": col,
+            "occupied": False,
+            "sample_id": None,
+        }
+        for row in range(1, layout.rows + 1)
+        for col in range(1, layout.cols + 1)
+    ]
+
+
+GRID_SAMPLE_COLUMNS = ("sample_id", "status", "sample_type_id")
+
+
+def box_grids(
+    db: Session,
+    box_ids: Optional[list[int]] = None,
+    under: Optional[models.StorageNode] = None,
+    known_etags: frozenset = frozenset(),
+) -> dict:
+    """Compact grids for the given boxes, or every box below ``under``.
+
+    Each box gets a dense ``rows`` x ``cols`` array holding a sample's id or
+    ``None``; the samples themselves are listed once in a shared table with
+    ``GRID_SAMPLE_COLUMNS``. Boxes whose ETag is in ``known_etags`` are
+    returned without their grid. Everything comes from one query.
+    """
+    box = models.StorageNode
+    layout = models.BoxLayout
+    position = models.StoragePosition
+    sample = models.Sample
+    stmt = (
+        select(
+            box.id,
+            box.name,
+            layout.rows,
+            layout.cols,
+            position.row,
+            position.col,
+            sample.id,
+            sample.sample_id,
+            sample.status,
+            sample.sample_type_id,
+        )
+        .select_from(box)
+        .outerjoin(layout, layout.id == box.layout_id)
+        .outerjoin(position, position.box_id == box.id)
+        .outerjoin(models.SampleLocation, models.SampleLocation.position_id == position.id)
+        .outerjoin(sample, sample.id == models.SampleLocation.sample_id)
+        .where(box.node_type == models.StorageNodeType.box)
+        .order_by(box.name, box.id)
+    )
+    if box_ids is not None:
+        stmt = stmt.where(box.id.in_(box_ids))
+    if under is not None:
+        stmt = stmt.where(box.path.startswith(under.path))
+    boxes: dict[int, dict] = {}
+    for box_id, name, rows, cols, row, col, key, *values in db.execute(stmt):
+        entry = boxes.get(box_id)
+        if entry is None:
+            entry = boxes[box_id] = {
+                "id": box_id,
+                "name": name,
+                "rows": rows or 0,
+                "cols": cols or 0,
+                "cells": {},
+                "samples": {},
+            }
+        if row is None:
+            continue
+        # Positions outside the layout still show up, so the grid grows.
+        entry["rows"] = max(entry["rows"], row)
+        entry["cols"] = max(entry["cols"], col)
+        if key is not None:
+            entry["cells"][(row, col)] = key
+            entry["samples"][key] = values
+    samples: dict[int, list] = {}
+    result = []
+    for entry in boxes.values():
+        cells = entry.pop("cells")
+        box_samples = entry.pop("samples")
+        grid = [
+            [cells.get((row, col)) for col in range(1, entry["cols"] + 1)]
+            for row in range(1, entry["rows"] + 1)
+        ]
+        digest = hashlib.blake2b(
+            repr((entry["name"], grid, sorted(box_samples.items()))).encode(), digest_size=8
+        ).hexdigest()
+        entry["etag"] = f'"{entry["id"]}-{digest}"'
+        if entry["etag"] in known_etags:
+            entry["unchanged"] = True
+        else:
+            entry["grid"] = grid
+            samples.update(box_samples)
+        result.append(entry)
+    return {"sample_columns": GRID_SAMPLE_COLUMNS, "samples": samples, "boxes": result}
+
+
+def _materialize_positions(db: Session, box_id: int, layout: models.BoxLayout) -> int:
+    rows = [
+        {"box_id": box_id, "row": row, "col": col, "label": layout.label(row, col)}
+        for row in range(1, layout.rows + 1)
+        for col in range(1, layout.cols + 1)
+    ]
+    result = db.execute(
+        sqlite_insert(models.StoragePosition.__table__).on_conflict_do_nothing(), rows
+    )
+    return result.rowcount
+
+
+def _ensure_cells(db: Session, cells: list[tuple[int, int, int]]) -> dict:
+    box_ids = {box_id for box_id, _, _ in cells}
+    layouts = dict(
+        db.execute(
+            select(models.StorageNode.id, models.BoxLayout)
+            .join(models.BoxLayout, models.BoxLayout.id == models.StorageNode.layout_id)
+            .where(models.StorageNode.id.in_(box_ids))
+        ).all()
+    )
+    rows = []
+    for box_id, row, col in cells:
+        layout = layouts.get(box_id)
+        if layout and 1 <= row <= layout.rows and 1 <= col <= layout.cols:
+            rows.append(
+                {"box_id": box_id, "row": row, "col": col, "label": layout.label(row, col)}
+            )
+    if rows:
+        db.execute(
+            sqlite_insert(models.StoragePosition.__table__).on_conflict_do_nothing(), rows
+        )
+    position = models.StoragePosition
+    return {
+        (row.box_id, row.row, row.col): row.id
+        for row in db.execute(
+            select(position.id, position.box_id, position.row, position.col).where(
+                position.box_id.in_(box_ids)
+            )
+        )
+    }
+
+
+def _position_at(db: Session, box_id: int, row: int, col: int) -> Optional[models.StoragePosition]:
+    return db.execute(
+        select(models.StoragePosition).where(
+            models.StoragePosition.box_id == box_id,
+            models.StoragePosition.row == row,
+            models.StoragePosition.col == col,
+        )
+    ).scalar_one_or_none()
 
 
 def place_or_move_sample(
@@ -161,17 +1488,24 @@ def place_or_move_sample(
     position: models.StoragePosition,
     user: Optional[models.User],
 ) -> models.SampleLocation:
-    if position.location:
-        raise StorageError("Position already occupied")
-    existing_location = sample.location
-    if existing_location:
-        from_position_id = existing_location.position_id
-        existing_location.position_id = position.id
-        existing_location.placed_at = datetime.utcnow()
+    current = _current_location(db, sample.id)
+    if current:
+        _relocate(db, current, position.id, "Position already occupied")
+        from_position_id = current.position_id
         event_type = models.EventType.move_sample
     else:
-        existing_location = models.SampleLocation(sample_id=sample.id, position_id=position.id)
-        db.add(existing_location)
+        placed = db.execute(
+            sqlite_insert(models.SampleLocation.__table__)
+            .values(
+                sample_id=sample.id,
+                position_id=position.id,
+                placed_at=datetime.utcnow(),
+                version=1,
+            )
+            .on_conflict_do_nothing()
+        )
+        if placed.rowcount != 1:
+            raise PlacementConflict("Position already occupied")
         from_position_id = None
         event_type = models.EventType.place_sample
     _log_event(
@@ -183,9 +1517,13 @@ def place_or_move_sample(
         to_position_id=position.id,
         payload={"position_id": position.id},
     )
-    db.commit()
-    db.refresh(existing_location)
-    return existing_location
+    if sample.volume is not None:
+        freezers = freezers_for_positions(db, [from_position_id, position.id])
+        deltas: dict = {}
+        _move_volume(deltas, sample, freezers.get(from_position_id), freezers.get(position.id))
+        _apply_volume_deltas(db, deltas)
+    _commit(db)
+    return _load_location(db, sample)
 
 
 def move_sample(
@@ -194,25 +1532,191 @@ def move_sample(
     to_position: models.StoragePosition,
     user: Optional[models.User],
 ) -> models.SampleLocation:
-    if to_position.location:
-        raise StorageError("Destination position already occupied")
-    if not sample.location:
+    current = _current_location(db, sample.id)
+    if not current:
         raise SampleError("Sample has no current location")
-    from_position_id = sample.location.position_id
-    sample.location.position_id = to_position.id
-    sample.location.placed_at = datetime.utcnow()
-    _log_event(
-        db,
-        event_type=models.EventType.move_sample,
-        user=user,
-        sample=sample,
-        from_position_id=from_position_id,
-        to_position_id=to_position.id,
-        payload={"from": from_position_id, "to": to_position.id},
+    _apply_move(db, sample, current, to_position.id, user)
+    _commit(db)
+    return _load_location(db, sample)
+
+
+def apply_moves(
+    db: Session,
+    moves: list[dict],
+    user: Optional[models.User],
+    batch_size: int = 500,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> int:
+    """Apply many moves, committing once per batch.
+
+    Each move is a dict with ``sample_id`` and either ``to_position_id`` or a
+    ``to_box_id``/``to_row``/``to_col`` cell of a box layout, plus optionally
+    ``from_position_id``; when given, the sample must still be there so a stale
+    plan is rejected instead of silently applied. ``progress`` is called with
+    ``(moved, total)`` after each committed batch.
+    """
+    location = models.SampleLocation
+    moved = 0
+    for start in range(0, len(moves), batch_size):
+        batch = moves[start : start + batch_size]
+        cells = [
+            (move["to_box_id"], move["to_row"], move["to_col"])
+            for move in batch
+            if move.get("to_position_id") is None
+        ]
+        if cells:
+            resolved = _ensure_cells(db, cells)
+            batch = [
+                move
+                if move.get("to_position_id") is not None
+                else {
+                    **move,
+                    "to_position_id": resolved.get(
+                        (move["to_box_id"], move["to_row"], move["to_col"])
+                    ),
+                }
+                for move in batch
+            ]
+        sample_ids = [move["sample_id"] for move in batch]
+        position_ids = [move["to_position_id"] for move in batch]
+        samples = {
+            sample.id: sample
+            for sample in db.execute(
+                select(models.Sample).where(models.Sample.id.in_(sample_ids))
+            ).scalars()
+        }
+        current = {
+            row.sample_id: row
+            for row in db.execute(
+                select(location.id, location.sample_id, location.position_id, location.version)
+                .where(location.sample_id.in_(sample_ids))
+            )
+        }
+        positions = set(
+            db.execute(
+                select(models.StoragePosition.id).where(
+                    models.StoragePosition.id.in_(position_ids)
+                )
+            ).scalars()
+        )
+        freezers = freezers_for_positions(
+            db, position_ids + [row.position_id for row in current.values()]
+        )
+        volume_deltas: dict = {}
+        events: list[dict] = []
+        try:
+            for move in batch:
+                sample = samples.get(move["sample_id"])
+                if not sample or move["to_position_id"] not in positions:
+                    raise StorageError("Sample or position not found")
+                row = current.get(sample.id)
+                if not row:
+                    raise SampleError(f"Sample {sample.sample_id} has no current location")
+                expected = move.get("from_position_id")
+                if expected is not None and row.position_id != expected:
+                    raise PlacementConflict(f"Sample {sample.sample_id} moved since the plan was made")
+                _apply_move(
+                    db, sample, row, move["to_position_id"], user, freezers, volume_deltas, events
+                )
+            _log_events_bulk(db, events, user)
+            _apply_volume_deltas(db, volume_deltas)
+        except Exception:
+            _rollback(db)
+            raise
+        _commit(db)
+        moved += len(batch)
+        if progress is not None:
+            progress(moved, len(moves))
+    return moved
+
+
+def _current_location(db: Session, sample_id: int):
+    location = models.SampleLocation
+    return db.execute(
+        select(location.id, location.position_id, location.version).where(
+            location.sample_id == sample_id
+        )
+    ).first()
+
+
+def _relocate_statement():
+    location = models.SampleLocation.__table__
+    occupant = location.alias("occupant")
+    return (
+        update(location)
+        .where(
+            location.c.id == bindparam("location_id"),
+            location.c.version == bindparam("expected_version"),
+            ~exists().where(occupant.c.position_id == bindparam("to_position_id")),
+        )
+        .values(
+            position_id=bindparam("to_position_id"),
+            placed_at=bindparam("placed_at"),
+            version=location.c.version + 1,
+        )
     )
-    db.commit()
-    db.refresh(sample.location)
-    return sample.location
+
+
+# Built once: bulk moves run it per sample and rebuilding it dominated.
+RELOCATE = _relocate_statement()
+
+
+def _relocate(db: Session, current, to_position_id: int, conflict_message: str) -> None:
+    # Occupancy check, optimistic version check and write happen in one
+    # statement, so concurrent placements cannot interleave between them.
+    moved = db.execute(
+        RELOCATE,
+        {
+            "location_id": current.id,
+            "expected_version": current.version,
+            "to_position_id": to_position_id,
+            "placed_at": datetime.utcnow(),
+        },
+    )
+    if moved.rowcount != 1:
+        raise PlacementConflict(conflict_message)
+
+
+def _apply_move(
+    db: Session,
+    sample: models.Sample,
+    current,
+    to_position_id: int,
+    user: Optional[models.User],
+    freezers: Optional[dict[int, int]] = None,
+    volume_deltas: Optional[dict] = None,
+    events: Optional[list[dict]] = None,
+) -> None:
+    _relocate(db, current, to_position_id, "Destination position already occupied")
+    event = {
+        "event_type": models.EventType.move_sample,
+        "sample_id": sample.id,
+        "from_position_id": current.position_id,
+        "to_position_id": to_position_id,
+        "payload": {"from": current.position_id, "to": to_position_id},
+    }
+    # Callers moving many samples collect events and log them in one go.
+    if events is None:
+        _log_events_bulk(db, [event], user)
+    else:
+        events.append(event)
+    if sample.volume is None:
+        return
+    if freezers is None:
+        freezers = freezers_for_positions(db, [current.position_id, to_position_id])
+    deltas = volume_deltas if volume_deltas is not None else {}
+    _move_volume(deltas, sample, freezers.get(current.position_id), freezers.get(to_position_id))
+    if volume_deltas is None:
+        _apply_volume_deltas(db, deltas)
+
+
+def _load_location(db: Session, sample: models.Sample) -> models.SampleLocation:
+    db.expire(sample, ["location"])
+    return db.execute(
+        select(models.SampleLocation)
+        .where(models.SampleLocation.sample_id == sample.id)
+        .execution_options(populate_existing=True)
+    ).scalar_one()
 
 
 def storage_path_for_position(position: models.StoragePosition) -> str:
@@ -229,12 +1733,137 @@ def storage_tree(db: Session) -> list[models.StorageNode]:
     )
 
 
-def recent_events(db: Session, limit: int = 50) -> list[models.Event]:
-    return list(
+def subtree_cte(node_id: int):
+    """Recursive CTE yielding ``id`` and ``node_type`` for a node and its descendants."""
+    nodes = models.StorageNode
+    tree = (
+        select(nodes.id, nodes.node_type)
+        .where(nodes.id == node_id)
+        .cte("subtree", recursive=True)
+    )
+    return tree.union_all(
+        select(nodes.id, nodes.node_type).where(nodes.parent_id == tree.c.id)
+    )
+
+
+def recent_events(db: Session, limit: int = 50) -> list:
+    events: list = list(
         db.execute(
             select(models.Event).order_by(models.Event.created_at.desc()).limit(limit)
         ).scalars()
     )
+    if len(events) < limit:
+        events.extend(_archived_events(db, limit=limit - len(events)))
+    return events
+
+
+def recent_event_rows(db: Session, limit: int = 50) -> list[dict]:
+    rows = _as_dicts(
+        db.execute(
+            select(*EVENT_COLUMNS).order_by(models.Event.created_at.desc()).limit(limit)
+        )
+    )
+    if len(rows) < limit:
+        keys = [column.key for column in EVENT_COLUMNS]
+        rows.extend(
+            {key: row[key] for key in keys}
+            for row in archive.archived_event_rows(db, limit=limit - len(rows))
+        )
+    return rows
+
+
+def sample_events(db: Session, sample_id: int) -> list:
+    """Full history of one sample, newest first, including archived events."""
+    events: list = list(
+        db.execute(
+            select(models.Event)
+            .where(models.Event.sample_id == sample_id)
+            .order_by(models.Event.created_at.desc())
+        ).scalars()
+    )
+    events.extend(_archived_events(db, sample_id=sample_id))
+    return events
+
+
+def _archived_events(
+    db: Session, sample_id: Optional[int] = None, limit: Optional[int] = None
+) -> list[archive.ArchivedEvent]:
+    events = [
+        archive.ArchivedEvent(row)
+        for row in archive.archived_event_rows(db, sample_id=sample_id, limit=limit)
+    ]
+    sample_ids = {event.sample_id for event in events if event.sample_id is not None}
+    if sample_ids:
+        samples = {
+            sample.id: sample
+            for sample in db.execute(
+                select(models.Sample).where(models.Sample.id.in_(sample_ids))
+            ).scalars()
+        }
+        for event in events:
+            event.sample = samples.get(event.sample_id)
+    return events
+
+
+def change_feed(db: Session, since: int = 0, limit: int = 1000) -> dict:
+    change = models.ChangeLog
+    rows = db.execute(
+        select(change.seq, change.entity, change.entity_id)
+        .where(change.seq > since)
+        .order_by(change.seq)
+        .limit(limit + 1)
+    ).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    sample_ids = [row.entity_id for row in rows if row.entity == "sample"]
+    location_ids = [row.entity_id for row in rows if row.entity == "location"]
+    samples = {
+        row["id"]: row
+        for row in _as_dicts(
+            db.execute(select(*SAMPLE_COLUMNS).where(models.Sample.id.in_(sample_ids)))
+        )
+    }
+    location = models.SampleLocation
+    position = models.StoragePosition
+    locations = {
+        row["sample_id"]: row
+        for row in _as_dicts(
+            db.execute(
+                select(
+                    location.sample_id,
+                    location.position_id,
+                    position.box_id,
+                    position.row,
+                    position.col,
+                    position.label,
+                    location.placed_at,
+                    location.version,
+                )
+                .join(position, position.id == location.position_id)
+                .where(location.sample_id.in_(location_ids))
+            )
+        )
+    }
+    current = {"sample": samples, "location": locations}
+    changes = []
+    for row in rows:
+        # An entity that no longer exists is reported as a deletion.
+        data = current[row.entity].get(row.entity_id)
+        changes.append(
+            {
+                "seq": row.seq,
+                "entity": row.entity,
+                "id": row.entity_id,
+                "op": "upsert" if data is not None else "delete",
+                "data": data,
+            }
+        )
+    return {
+        "since": since,
+        "next": rows[-1].seq if rows else since,
+        "has_more": has_more,
+        "changes": changes,
+    }
 
 
 def seed_storage(db: Session, user: Optional[models.User]) -> None:
@@ -253,6 +1882,44 @@ def seed_storage(db: Session, user: Optional[models.User]) -> None:
     create_box_positions(db, box.id, rows=8, cols=12, user=user)
 
 
+def _log_events_bulk(
+    db: Session, events: list[dict], user: Optional[models.User] = None
+) -> None:
+    now = datetime.utcnow()
+    rows = _chain_events(
+        db,
+        [
+            {
+                "event_type": event["event_type"],
+                "user_id": user.id if user else None,
+                "sample_id": event.get("sample_id"),
+                "from_position_id": event.get("from_position_id"),
+                "to_position_id": event.get("to_position_id"),
+                "payload_json": json.dumps(event["payload"]) if event.get("payload") else None,
+                "created_at": now,
+            }
+            for event in events
+        ],
+    )
+    db.execute(insert(models.Event), rows)
+    _record_activity(db, rows)
+    _record_changes(db, [key for event in events for key in _changed_entities(event)])
+
+
+def _commit(db: Session) -> None:
+    # Under the group-commit writer the coordinator owns the transaction and
+    # commits a whole batch at once; mutations only flush their changes.
+    if db.info.get("group_commit"):
+        db.flush()
+    else:
+        db.commit()
+
+
+def _rollback(db: Session) -> None:
+    if not db.info.get("group_commit"):
+        db.rollback()
+
+
 def _log_event(
     db: Session,
     event_type: models.EventType,
@@ -262,16 +1929,199 @@ def _log_event(
     to_position_id: Optional[int] = None,
     payload: Optional[dict] = None,
 ) -> models.Event:
-    event = models.Event(
-        event_type=event_type,
-        user_id=user.id if user else None,
-        sample_id=sample.id if sample else None,
-        from_position_id=from_position_id,
-        to_position_id=to_position_id,
-        created_at=datetime.utcnow(),
-    )
-    if payload:
-        event.set_payload(payload)
+    row = {
+        "event_type": event_type,
+        "user_id": user.id if user else None,
+        "sample_id": sample.id if sample else None,
+        "from_position_id": from_position_id,
+        "to_position_id": to_position_id,
+        "payload_json": json.dumps(payload) if payload else None,
+        "created_at": datetime.utcnow(),
+    }
+    event = models.Event(**_chain_events(db, [row])[0])
     db.add(event)
     db.flush()
+    _record_activity(db, [row])
+    _record_changes(
+        db,
+        _changed_entities({"event_type": event_type, "sample_id": event.sample_id}),
+    )
     return event
+
+
+def _chain_events(db: Session, rows: list[dict]) -> list[dict]:
+    """Give new event rows consecutive ids and chain hashes, in place.
+
+    The head row is claimed with a no-op UPDATE first, which takes the write
+    lock (SQLite) or a row lock (Postgres), so concurrent writers extend the
+    chain one at a time and never fork it.
+    """
+    head = models.EventChainHead.__table__
+    claimed = db.execute(
+        update(head)
+        .where(head.c.id == 1)
+        .values(event_id=head.c.event_id)
+        .returning(head.c.event_id, head.c.hash)
+    ).first()
+    if claimed is None:
+        db.execute(insert(head).values(id=1, event_id=0, hash=models.GENESIS_HASH))
+        last_id, prev_hash = 0, models.GENESIS_HASH
+    else:
+        last_id, prev_hash = claimed
+    for row in rows:
+        last_id += 1
+        row["id"] = last_id
+        row["prev_hash"] = prev_hash
+        row["hash"] = prev_hash = models.event_hash(prev_hash, row)
+    db.execute(update(head).where(head.c.id == 1).values(event_id=last_id, hash=prev_hash))
+    return rows
+
+
+LOCATION_EVENTS = {
+    models.EventType.place_sample,
+    models.EventType.move_sample,
+    models.EventType.relocate_storage,
+}
+
+
+def _changed_entities(event: dict) -> list[tuple[str, int]]:
+    sample_id = event.get("sample_id")
+    if sample_id is None:
+        return []
+    if event["event_type"] in LOCATION_EVENTS:
+        return [("location", sample_id)]
+    return [("sample", sample_id)]
+
+
+def fold_activity(
+    rows: list[dict], nodes: dict[int, tuple[int, Optional[int]]]
+) -> tuple[Counter, dict]:
+    """Fold event rows into daily activity counts and occupancy changes.
+
+    ``nodes`` maps position ids to (box id, freezer id). Returns activity
+    counts keyed like ``DailyActivity`` and ``{(node_id, day): [placed,
+    removed]}`` for every freezer and box whose occupancy moved.
+    """
+    activity: Counter = Counter()
+    occupancy: dict = defaultdict(lambda: [0, 0])
+    for row in rows:
+        event_type = models.EventType(row["event_type"])
+        day = row["created_at"].date()
+        source = nodes.get(row.get("from_position_id"))
+        target = nodes.get(row.get("to_position_id"))
+        box_id, freezer_id = target or source or (0, 0)
+        activity[(day, freezer_id or 0, box_id or 0, row.get("user_id") or 0, event_type.value)] += 1
+        if event_type in (models.EventType.place_sample, models.EventType.move_sample):
+            for node_id in source or ():
+                if node_id:
+                    occupancy[(node_id, day)][1] += 1
+            for node_id in target or ():
+                if node_id:
+                    occupancy[(node_id, day)][0] += 1
+        elif event_type == models.EventType.relocate_storage and row.get("sample_id") is None:
+            # Whole subtrees move without per-sample position changes; the
+            # summary says how many samples changed freezer.
+            summary = json.loads(row["payload_json"] or "{}")
+            if summary.get("from_freezer_id") != summary.get("to_freezer_id") and summary.get("samples"):
+                if summary.get("from_freezer_id"):
+                    occupancy[(summary["from_freezer_id"], day)][1] += summary["samples"]
+                if summary.get("to_freezer_id"):
+                    occupancy[(summary["to_freezer_id"], day)][0] += summary["samples"]
+    return activity, occupancy
+
+
+def position_nodes(db: Session, position_ids) -> dict[int, tuple[int, Optional[int]]]:
+    position_ids = [position_id for position_id in set(position_ids) if position_id]
+    if not position_ids:
+        return {}
+    return {
+        position_id: (box_id, freezer_id)
+        for position_id, box_id, freezer_id in db.execute(
+            select(models.StoragePosition.id, models.StoragePosition.box_id, models.StorageNode.freezer_id)
+            .join(models.StorageNode, models.StorageNode.id == models.StoragePosition.box_id)
+            .where(models.StoragePosition.id.in_(position_ids))
+        )
+    }
+
+
+def _record_activity(db: Session, rows: list[dict]) -> None:
+    nodes = position_nodes(
+        db, [row.get(key) for row in rows for key in ("from_position_id", "to_position_id")]
+    )
+    activity, occupancy = fold_activity(rows, nodes)
+    table = models.DailyActivity.__table__
+    stmt = sqlite_insert(table)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["day", "freezer_id", "box_id", "user_id", "event_type"],
+            set_={"count": table.c.count + stmt.excluded.count},
+        ),
+        [
+            {
+                "day": day,
+                "freezer_id": freezer_id,
+                "box_id": box_id,
+                "user_id": user_id,
+                "event_type": event_type,
+                "count": count,
+            }
+            for (day, freezer_id, box_id, user_id, event_type), count in activity.items()
+        ],
+    )
+    if occupancy:
+        _apply_occupancy(db, occupancy)
+
+
+def _apply_occupancy(db: Session, occupancy: dict) -> None:
+    # A node's first row of the day starts from its latest earlier row.
+    table = models.DailyOccupancy.__table__
+    previous = (
+        select(table.c.occupied)
+        .where(table.c.node_id == bindparam("node"), table.c.day < bindparam("on"))
+        .order_by(table.c.day.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    stmt = sqlite_insert(table).values(
+        node_id=bindparam("node"),
+        day=bindparam("on"),
+        placed=bindparam("added"),
+        removed=bindparam("taken"),
+        occupied=func.coalesce(previous, 0) + bindparam("added") - bindparam("taken"),
+    )
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["node_id", "day"],
+            set_={
+                "occupied": table.c.occupied + stmt.excluded.placed - stmt.excluded.removed,
+                "placed": table.c.placed + stmt.excluded.placed,
+                "removed": table.c.removed + stmt.excluded.removed,
+            },
+        ),
+        [
+            {"node": node_id, "on": day, "added": added, "taken": taken}
+            for (node_id, day), (added, taken) in sorted(occupancy.items(), key=lambda item: item[0][1])
+        ],
+    )
+
+
+def _record_changes(db: Session, keys: list[tuple[str, int]]) -> None:
+    # Called after the mutation's own writes, so this transaction already
+    # holds SQLite's write lock and MAX(seq) cannot move underneath it.
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return
+    table = models.ChangeLog.__table__
+    start = db.scalar(select(func.coalesce(func.max(table.c.seq), 0)))
+    now = datetime.utcnow()
+    stmt = sqlite_insert(table)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["entity", "entity_id"],
+            set_={"seq": stmt.excluded.seq, "changed_at": stmt.excluded.changed_at},
+        ),
+        [
+            {"entity": entity, "entity_id": entity_id, "seq": start + index, "changed_at": now}
+            for index, (entity, entity_id) in enumerate(keys, start=1)
+        ],
+    )
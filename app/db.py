@@ -1,13 +1,28 @@
 from __future__ import annotations
 
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
 DATABASE_URL = "sqlite:///./freezer.db"
+# WAL lets online backups and report snapshots read a consistent copy
+# without blocking writers.
+WAL = os.environ.get("FREEZER_SQLITE_WAL", "1").lower() in {"1", "true", "yes"}
 
 engine = create_engine(
     DATABASE_URL, connect_args={"check_same_thread": False}
 )
+
+
+@event.listens_for(engine, "connect")
+def _set_journal_mode(dbapi_connection, _record) -> None:
+    if WAL:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, aliased, sessionmaker
+
+from app import crud, models
+from app.db import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("FREEZER_EXPIRY_SWEEP", "1").lower() in {"1", "true", "yes"}
+SWEEP_SECONDS = float(os.environ.get("FREEZER_EXPIRY_SWEEP_SECONDS", "3600"))
+BATCH_SIZE = int(os.environ.get("FREEZER_EXPIRY_BATCH", "500"))
+
+EXPIRED = "expired"
+DISPOSAL_DUE = "disposal_due"
+
+# (kind, due-date column, statuses the rule applies to, status it sets)
+RULES = (
+    ("expiry", models.Sample.expires_at, ("active",), EXPIRED),
+    ("retention", models.Sample.retain_until, ("active", "archived", EXPIRED), DISPOSAL_DUE),
+)
+
+
+class ExpirySweeper:
+    def __init__(self, sessions: sessionmaker = SessionLocal, interval: float = SWEEP_SECONDS) -> None:
+        self._sessions = sessions
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="expiry-sweeper", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stopping = True
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopping:
+            try:
+                with self._sessions() as db:
+                    result = sweep(db)
+                if any(result.values()):
+                    logger.info("Expiry sweep: %s", result)
+            except Exception:
+                logger.exception("Expiry sweep failed")
+            self._wake.wait(self.interval)
+
+
+_sweeper: Optional[ExpirySweeper] = None
+
+
+def start_sweeper() -> Optional[ExpirySweeper]:
+    global _sweeper
+    if ENABLED and _sweeper is None:
+        _sweeper = ExpirySweeper()
+        _sweeper.start()
+    return _sweeper
+
+
+def stop_sweeper() -> None:
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.stop()
+        _sweeper = None
+
+
+def sweep(
+    db: Session,
+    now: Optional[datetime] = None,
+    batch_size: int = BATCH_SIZE,
+    progress: Optional[Callable[[int], None]] = None,
+) -> dict:
+    """Apply every rule to samples whose due date has passed, in batches.
+
+    Each batch is one ``crud.set_sample_status`` call and is committed on its
+    own, so a sweep interrupted part way keeps the batches it finished.
+    """
+    now = now or datetime.utcnow()
+    result = {}
+    swept = 0
+    for kind, column, statuses, status in RULES:
+        changed = 0
+        while True:
+            ids = list(
+                db.execute(
+                    select(models.Sample.id)
+                    .where(models.Sample.status.in_(statuses), column <= now)
+                    .limit(batch_size)
+                ).scalars()
+            )
+            if not ids:
+                break
+            changed += crud.set_sample_status(db, ids, status, None, reason=f"{kind} date passed")
+            if progress is not None:
+                progress(swept + changed)
+        result[kind] = changed
+        swept += changed
+    return result
+
+
+def upcoming(
+    db: Session,
+    days: int = 30,
+    freezer_id: Optional[int] = None,
+    now: Optional[datetime] = None,
+    limit: int = 1000,
+) -> list[dict]:
+    """Samples coming due within ``days``, grouped by freezer.
+
+    Overdue samples that have not been swept yet are included. Unplaced
+    samples are grouped under a ``freezer_id`` of ``None``.
+    """
+    horizon = (now or datetime.utcnow()) + timedelta(days=days)
+    sample = models.Sample
+    box = aliased(models.StorageNode)
+    freezer = aliased(models.StorageNode)
+    due = []
+    for kind, column, statuses, _ in RULES:
+        query = (
+            select(
+                sample.id,
+                sample.sample_id,
+                sample.name,
+                sample.status,
+                column.label("due_at"),
+                box.freezer_id,
+                freezer.name.label("freezer_name"),
+            )
+            .outerjoin(models.SampleLocation, models.SampleLocation.sample_id == sample.id)
+            .outerjoin(models.StoragePosition, models.StoragePosition.id == models.SampleLocation.position_id)
+            .outerjoin(box, box.id == models.StoragePosition.box_id)
+            .outerjoin(freezer, freezer.id == box.freezer_id)
+            .where(sample.status.in_(statuses), column <= horizon)
+            .order_by(column)
+            .limit(limit)
+        )
+        if freezer_id is not None:
+            query = query.where(box.freezer_id == freezer_id)
+        due.extend({**row._asdict(), "kind": kind} for row in db.execute(query))
+    groups: dict[Optional[int], dict] = {}
+    for row in sorted(due, key=lambda row: row["due_at"]):
+        group = groups.setdefault(
+            row["freezer_id"],
+            {"freezer_id": row["freezer_id"], "freezer_name": row.pop("freezer_name"), "samples": []},
+        )
+        row.pop("freezer_name", None)
+        row.pop("freezer_id")
+        group["samples"].append(row)
+    return sorted(groups.values(), key=lambda group: (group["freezer_id"] is None, group["freezer_name"] or ""))
@@ -0,0 +1,515 @@
+from __future__ import annotations
+
+import csv
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session, sessionmaker
+
+from app import archive, audit, backup, crud, expiry, labels, models, reporting, schemas, trends
+from app.db import SessionLocal
+
+WORKERS = int(os.environ.get("FREEZER_JOB_WORKERS", "2"))
+RESULT_DIR = os.environ.get(
+    "FREEZER_JOB_DIR", os.path.join(tempfile.gettempdir(), "freezer-jobs")
+)
+PROGRESS_INTERVAL = 0.5
+HEARTBEAT_SECONDS = float(os.environ.get("FREEZER_JOB_HEARTBEAT_SECONDS", "15"))
+STALE_AFTER = HEARTBEAT_SECONDS * 4
+UNFINISHED = (models.JobStatus.queued, models.JobStatus.running)
+
+logger = logging.getLogger(__name__)
+_owner_token = uuid.uuid4().hex[:8]
+
+JOB_TYPES: dict[str, Callable[..., Any]] = {}
+
+# Kinds clients may submit through POST /jobs, with their parameter schemas.
+# Backup, archive and audit jobs are only started by their own routes.
+USER_JOBS: dict[str, type[BaseModel]] = {
+    "seed_storage": schemas.SeedStorageParams,
+    "create_box_positions": schemas.BoxPositionsParams,
+    "apply_moves": schemas.ApplyMovesParams,
+    "update_samples": schemas.UpdateSamplesParams,
+    "export_samples": schemas.ExportSamplesParams,
+    "render_labels": schemas.RenderLabelsParams,
+}
+
+
+class JobError(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job_type(name: str):
+    def register(fn: Callable[..., Any]) -> Callable[..., Any]:
+        JOB_TYPES[name] = fn
+        return fn
+
+    return register
+
+
+def owner() -> str:
+    """Identifies this process; the pid is read on every call so forks differ."""
+    return f"{socket.gethostname()}:{os.getpid()}:{_owner_token}"
+
+
+class JobContext:
+    """Handed to running jobs for progress reporting and cancellation.
+
+    Progress is written from a separate short session so it is visible to
+    pollers while the job's own transaction is still open; writes are
+    throttled to one per ``PROGRESS_INTERVAL`` unless ``force`` is set.
+    """
+
+    def __init__(self, job_id: int, sessions: sessionmaker) -> None:
+        self.job_id = job_id
+        self.result_path: Optional[str] = None
+        self._sessions = sessions
+        self._last_write = 0.0
+
+    def progress(
+        self,
+        done: int,
+        total: Optional[int] = None,
+        message: Optional[str] = None,
+        force: bool = False,
+    ) -> None:
+        now = time.monotonic()
+        if not force and now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._last_write = now
+        values: dict[str, Any] = {"progress": done}
+        if total is not None:
+            values["total"] = total
+        if message is not None:
+            values["message"] = message[:255]
+        with self._sessions() as session:
+            session.execute(update(models.Job).where(models.Job.id == self.job_id).values(**values))
+            session.commit()
+            cancelled = session.scalar(
+                select(models.Job.cancel_requested).where(models.Job.id == self.job_id)
+            )
+        if cancelled:
+            raise JobCancelled()
+
+    def output_path(self, suffix: str) -> str:
+        os.makedirs(RESULT_DIR, exist_ok=True)
+        self.result_path = os.path.join(RESULT_DIR, f"job-{self.job_id}{suffix}")
+        return self.result_path
+
+
+class JobRunner:
+    def __init__(self, sessions: sessionmaker = SessionLocal, workers: int = WORKERS) -> None:
+        self._sessions = sessions
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._futures: dict[int, Future] = {}
+        self._stopped = threading.Event()
+        self._heartbeat = threading.Thread(target=self._beat, name="job-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def submit(self, job_id: int) -> None:
+        future = self._executor.submit(run_job, job_id, self._sessions)
+        self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._futures.pop(job_id, None))
+
+    def cancel(self, job_id: int) -> bool:
+        future = self._futures.get(job_id)
+        return bool(future and future.cancel())
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _beat(self) -> None:
+        while not self._stopped.wait(HEARTBEAT_SECONDS):
+            try:
+                with self._sessions() as db:
+                    db.execute(
+                        update(models.Job)
+                        .where(models.Job.owner == owner(), models.Job.status.in_(UNFINISHED))
+                        .values(heartbeat_at=datetime.utcnow())
+                    )
+                    db.commit()
+                recover_interrupted(self._sessions)
+            except Exception:
+                logger.exception("Job heartbeat failed")
+
+
+_runner: Optional[JobRunner] = None
+
+
+def start_runner() -> JobRunner:
+    global _runner
+    if _runner is None:
+        recover_interrupted(SessionLocal)
+        _runner = JobRunner()
+    return _runner
+
+
+def stop_runner() -> None:
+    global _runner
+    if _runner is not None:
+        _runner.stop()
+        _runner = None
+
+
+def user_params(kind: str, params: Optional[dict]) -> dict:
+    """Validate client-supplied parameters for a user-facing job kind."""
+    if kind not in JOB_TYPES:
+        raise JobError(f"Unknown job type '{kind}'")
+    schema = USER_JOBS.get(kind)
+    if schema is None:
+        raise JobError(f"Job type '{kind}' cannot be submitted directly")
+    try:
+        validated = schema.model_validate(params or {})
+    except ValidationError as exc:
+        problems = "; ".join(
+            f"{'.'.join(str(part) for part in error['loc']) or 'params'}: {error['msg']}"
+            for error in exc.errors()
+        )
+        raise JobError(f"Invalid {kind} params: {problems}")
+    return validated.model_dump(mode="json", exclude_unset=True)
+
+
+def submit_job(
+    db: Session, kind: str, params: Optional[dict], user: Optional[models.User]
+) -> models.Job:
+    if kind not in JOB_TYPES:
+        raise JobError(f"Unknown job type '{kind}'")
+    job = models.Job(
+        kind=kind,
+        status=models.JobStatus.queued,
+        params_json=json.dumps(params or {}),
+        user_id=user.id if user else None,
+        owner=owner(),
+        heartbeat_at=datetime.utcnow(),
+        created_at=datetime.utcnow(),
+    )
+    db.add(job)
+    db.commit()
+    if _runner is None:
+        run_job(job.id, sessionmaker(bind=db.get_bind()))
+    else:
+        _runner.submit(job.id)
+    db.refresh(job)
+    return job
+
+
+def cancel_job(db: Session, job: models.Job) -> models.Job:
+    if job.finished:
+        return job
+    job.cancel_requested = True
+    if job.status == models.JobStatus.queued and _runner is not None and _runner.cancel(job.id):
+        job.status = models.JobStatus.cancelled
+        job.finished_at = datetime.utcnow()
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def list_jobs(db: Session, limit: int = 50) -> list[models.Job]:
+    return list(
+        db.execute(select(models.Job).order_by(models.Job.id.desc()).limit(limit)).scalars()
+    )
+
+
+def run_job(job_id: int, sessions: sessionmaker) -> None:
+    with sessions() as db:
+        job = db.get(models.Job, job_id)
+        if job is None or job.status != models.JobStatus.queued:
+            return
+        if job.cancel_requested:
+            _finish(db, job, models.JobStatus.cancelled)
+            return
+        job.status = models.JobStatus.running
+        job.started_at = datetime.utcnow()
+        job.owner = owner()
+        job.heartbeat_at = job.started_at
+        db.commit()
+        user = db.get(models.User, job.user_id) if job.user_id else None
+        context = JobContext(job_id, sessions)
+        try:
+            result = JOB_TYPES[job.kind](db, context, user, **job.params)
+        except JobCancelled:
+            db.rollback()
+            _finish(db, job, models.JobStatus.cancelled)
+        except Exception as exc:
+            db.rollback()
+            job.error = "".join(traceback.format_exception_only(type(exc), exc)).strip()
+            _finish(db, job, models.JobStatus.failed)
+        else:
+            job.result_path = context.result_path
+            if result is not None:
+                job.result_json = json.dumps(result, default=str)
+            _finish(db, job, models.JobStatus.succeeded)
+
+
+def recover_interrupted(sessions: sessionmaker) -> int:
+    """Fail unfinished jobs whose owning process is gone.
+
+    Jobs run in the process that queued them. An owner is gone when its
+    heartbeat is older than ``STALE_AFTER``, or at once when it was on this
+    host and its pid no longer runs this process. Runs at startup and with
+    every heartbeat, so other live workers keep their jobs.
+    """
+    stale = datetime.utcnow() - timedelta(seconds=STALE_AFTER)
+    with sessions() as db:
+        rows = db.execute(
+            select(models.Job.id, models.Job.owner, models.Job.heartbeat_at).where(
+                models.Job.status.in_(UNFINISHED)
+            )
+        ).all()
+        lost = [row.id for row in rows if _owner_gone(row.owner, row.heartbeat_at, stale)]
+        if lost:
+            db.execute(
+                update(models.Job)
+                .where(models.Job.id.in_(lost), models.Job.status.in_(UNFINISHED))
+                .values(
+                    status=models.JobStatus.failed,
+                    error="Interrupted: the server process running it stopped",
+                    finished_at=datetime.utcnow(),
+                )
+            )
+            db.commit()
+    return len(lost)
+
+
+def _owner_gone(job_owner: Optional[str], heartbeat_at: Optional[datetime], stale: datetime) -> bool:
+    if job_owner is None or heartbeat_at is None:
+        return True
+    if job_owner == owner():
+        return False
+    host, pid, _ = job_owner.rsplit(":", 2)
+    if host == socket.gethostname() and (int(pid) == os.getpid() or not _pid_alive(int(pid))):
+        return True
+    return heartbeat_at < stale
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _finish(db: Session, job: models.Job, status: models.JobStatus) -> None:
+    job.status = status
+    job.finished_at = datetime.utcnow()
+    db.commit()
+
+
+@job_type("seed_storage")
+def seed_storage_job(db: Session, context: JobContext, user: Optional[models.User]) -> dict:
+    context.progress(0, 1, "Creating demo storage", force=True)
+    crud.seed_storage(db, user)
+    context.progress(1, 1, force=True)
+    return {"status": "ok"}
+
+
+@job_type("create_box_positions")
+def create_box_positions_job(
+    db: Session,
+    context: JobContext,
+    user: Optional[models.User],
+    box_id: int,
+    rows: int,
+    cols: int,
+    materialize: bool = True,
+    label_scheme: str = models.LabelScheme.alpha_numeric.value,
+) -> dict:
+    context.progress(0, rows * cols, force=True)
+    created = crud.create_box_positions(
+        db,
+        box_id,
+        rows,
+        cols,
+        user,
+        materialize=materialize,
+        label_scheme=models.LabelScheme(label_scheme),
+    )
+    context.progress(rows * cols, force=True)
+    return {"box_id": box_id, "positions": created}
+
+
+@job_type("apply_moves")
+def apply_moves_job(
+    db: Session,
+    context: JobContext,
+    user: Optional[models.User],
+    moves: list[dict],
+    batch_size: int = 500,
+) -> dict:
+    # Batches already committed stay applied if the job is cancelled or a
+    # later batch fails; progress shows how far it got.
+    context.progress(0, len(moves), force=True)
+    moved = crud.apply_moves(db, moves, user, batch_size, progress=context.progress)
+    return {"moved": moved}
+
+
+@job_type("evacuate_storage")
+def evacuate_storage_job(
+    db: Session,
+    context: JobContext,
+    user: Optional[models.User],
+    node_id: int,
+    freezer_ids: Optional[list[int]] = None,
+    batch_size: int = 500,
+) -> dict:
+    from app import planning
+
+    context.progress(0, message="Planning evacuation", force=True)
+    plan = planning.plan_evacuation(db, node_id, freezer_ids)
+    context.progress(0, len(plan.moves), force=True)
+    moved = crud.apply_moves(db, plan.as_moves(), user, batch_size, progress=context.progress)
+    return {"moved": moved, "unplaced": plan.unplaced}
+
+
+@job_type("update_samples")
+def update_samples_job(
+    db: Session,
+    context: JobContext,
+    user: Optional[models.User],
+    sample_ids: list[int],
+    data: dict,
+) -> dict:
+    unknown = set(data) - set(schemas.SampleUpdate.model_fields)
+    if unknown:
+        raise JobError(f"Unknown sample fields: {', '.join(sorted(unknown))}")
+    data = schemas.SampleUpdate(**data).model_dump(exclude_unset=True)
+    context.progress(0, len(sample_ids), force=True)
+    updated = 0
+    for index, sample_id in enumerate(sample_ids, start=1):
+        sample = db.get(models.Sample, sample_id)
+        if sample is not None:
+            crud.update_sample(db, sample, data, user)
+            updated += 1
+        context.progress(index)
+    context.progress(len(sample_ids), force=True)
+    return {"updated": updated}
+
+
+@job_type("export_samples")
+def export_samples_job(
+    db: Session,
+    context: JobContext,
+    user: Optional[models.User],
+    **filters: Any,
+) -> dict:
+    rows = crud.list_sample_rows(db, **filters)
+    path = context.output_path(".csv")
+    context.progress(0, len(rows), force=True)
+    with open(path, "w", newline="") as handle:
+        writer = csv.DictWriter(handle, fieldnames=crud.SAMPLE_FIELDS)
+        writer.writeheader()
+        for index, row in enumerate(rows, start=1):
+            attributes = row["attributes"]
+            writer.writerow({**row, "attributes": json.dumps(attributes) if attributes else ""})
+            if index % 1000 == 0:
+                context.progress(index)
+    context.progress(len(rows), force=True)
+    return {"rows": len(rows)}
+
+
+@job_type("render_labels")
+def render_labels_job(
+    db: Session,
+    context: JobContext,
+    user: Optional[models.User],
+    format: str = "pdf",
+    **selection: Any,
+) -> dict:
+    rows = labels.label_rows(db, **selection)
+    path = context.output_path(f".{format}")
+    context.progress(0, len(rows), force=True)
+    with open(path, "wb") as handle:
+        for part in labels.render(rows, format, progress=context.progress):
+            handle.write(part)
+    context.progress(len(rows), force=True)
+    return {"labels": len(rows), "format": format}
+
+
+@job_type("backup_database")
+def backup_database_job(
+    db: Session,
+    context: JobContext,
+    user: Optional[models.User],
+    kind: str = "auto",
+) -> dict:
+    context.progress(0, message=f"Taking {kind} backup", force=True)
+    return backup.create_backup(kind, progress=context.progress)
+
+
+@job_type("verify_backup")
+def verify_backup_job(
+    db: Session,
+    context: JobContext,
+    user: Optional[models.User],
+    backup_id: Optional[str] = None,
+) -> dict:
+    context.progress(0, message="Rebuilding backup", force=True)
+    return backup.restore_backup(backup_id, progress=context.progress)
+
+
+@job_type("archive_events")
+def archive_events_job(
+    db: Session,
+    context: JobContext,
+    user: Optional[models.User],
+    before: Optional[str] = None,
+) -> dict:
+    cutoff = datetime.fromisoformat(before) if before else archive.default_cutoff()
+    context.progress(0, message=f"Archiving events before {cutoff.isoformat()}", force=True)
+    return archive.archive_events(db, cutoff, progress=context.progress)
+
+
+@job_type("expiry_sweep")
+def expiry_sweep_job(db: Session, context: JobContext, user: Optional[models.User]) -> dict:
+    context.progress(0, message="Sweeping expired and retention-due samples", force=True)
+    return expiry.sweep(db, progress=context.progress)
+
+
+@job_type("refresh_report_snapshot")
+def refresh_report_snapshot_job(db: Session, context: JobContext, user: Optional[models.User]) -> dict:
+    context.progress(0, 1, "Copying database", force=True)
+    result = reporting.refresh_snapshot()
+    context.progress(1, 1, force=True)
+    return result
+
+
+@job_type("verify_events")
+def verify_events_job(
+    db: Session,
+    context: JobContext,
+    user: Optional[models.User],
+    full: bool = False,
+) -> dict:
+    message = "Verifying every event" if full else "Verifying events since the last checkpoint"
+    context.progress(0, message=message, force=True)
+    result = audit.verify_events(db, full=full, progress=context.progress)
+    if not result["ok"]:
+        raise JobError(f"Event chain verification failed: {result['problems'][0]}")
+    return result
+
+
+@job_type("backfill_rollups")
+def backfill_rollups_job(db: Session, context: JobContext, user: Optional[models.User]) -> dict:
+    context.progress(0, message="Replaying events into daily rollups", force=True)
+    return trends.backfill_rollups(db, progress=context.progress)
@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Callable, Iterator, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import crud, models
+
+WORKERS = int(os.environ.get("FREEZER_LABEL_WORKERS", str(os.cpu_count() or 1)))
+CHUNK_SIZE = int(os.environ.get("FREEZER_LABEL_CHUNK", "500"))
+# Label stock in points (1/72 inch); the default is 2 x 1 inch.
+LABEL_WIDTH = float(os.environ.get("FREEZER_LABEL_WIDTH_PT", "144"))
+LABEL_HEIGHT = float(os.environ.get("FREEZER_LABEL_HEIGHT_PT", "72"))
+# ZPL labels are laid out in printer dots (203 dpi).
+ZPL_DOTS_PER_POINT = 203 / 72
+
+FORMATS = {"pdf": "application/pdf", "zpl": "application/zpl"}
+
+# Code 128 bar/space widths for symbol values 0-106 (106 is the stop symbol).
+CODE128_PATTERNS = (
+    "212222", "222122", "222221", "121223", "121322", "131222", "122213", "122312", "132212", "221213",
+    "221312", "231212", "112232", "122132", "122231", "113222", "123122", "123221", "223211", "221132",
+    "221231", "213212", "223112", "312131", "311222", "321122", "321221", "312212", "322112", "322211",
+    "212123", "212321", "232121", "111323", "131123", "131321", "112313", "132113", "132311", "211313",
+    "231113", "231311", "112133", "112331", "132131", "113123", "113321", "133121", "313121", "211331",
+    "231131", "213113", "213311", "213131", "311123", "311321", "331121", "312113", "312311", "332111",
+    "314111", "221411", "431111", "111224", "111422", "121124", "121421", "141122", "141221", "112214",
+    "112412", "122114", "122411", "142112", "142211", "241211", "221114", "413111", "241112", "134111",
+    "111242", "121142", "121241", "114212", "124112", "124211", "411212", "421112", "421211", "212141",
+    "214121", "412121", "111143", "111341", "131141", "114113", "114311", "411113", "411311", "113141",
+    "114131", "311141", "411131", "211412", "211214", "211232", "2331112",
+)
+START_B, START_C, CODE_B, CODE_C, STOP = 104, 105, 100, 99, 106
+QUIET_ZONE = 10
+
+
+@lru_cache(maxsize=65536)
+def code128_widths(text: str) -> tuple[int, ...]:
+    """Alternating bar and space widths, in modules, for ``text``.
+
+    Uses code set B, packing long digit runs in pairs with code set C.
+    Characters outside printable ASCII are encoded as ``?``.
+    """
+    text = "".join(char if 32 <= ord(char) < 127 else "?" for char in text)
+    lead = _digit_run(text, 0)
+    code_c = lead % 2 == 0 and (lead >= 4 or lead == len(text) > 0)
+    values = [START_C if code_c else START_B]
+    index = 0
+    while index < len(text):
+        run = _digit_run(text, index)
+        if code_c:
+            if run >= 2:
+                values.append(int(text[index : index + 2]))
+                index += 2
+                continue
+            values.append(CODE_B)
+            code_c = False
+        # Switching to C costs a symbol (two mid-text, to switch back), so
+        # only runs long enough to save one are packed in pairs.
+        if run >= 6 or (run >= 4 and index + run == len(text)):
+            if run % 2:
+                values.append(ord(text[index]) - 32)
+                index += 1
+            values.append(CODE_C)
+            code_c = True
+            continue
+        values.append(ord(text[index]) - 32)
+        index += 1
+    checksum = (values[0] + sum(position * value for position, value in enumerate(values[1:], start=1))) % 103
+    values.extend((checksum, STOP))
+    return tuple(int(width) for value in values for width in CODE128_PATTERNS[value])
+
+
+def _digit_run(text: str, start: int) -> int:
+    end = start
+    while end < len(text) and text[end].isdigit():
+        end += 1
+    return end - start
+
+
+def label_rows(
+    db: Session,
+    sample_ids: Optional[list[int]] = None,
+    **filters,
+) -> list[dict]:
+    """Sample id, type name and location path for each label, in one query.
+
+    Storage paths are built from one pass over the storage tree rather than
+    walking parents per sample.
+    """
+    sample = models.Sample
+    position = models.StoragePosition
+    stmt = (
+        select(
+            sample.sample_id,
+            models.SampleType.name,
+            models.StorageNode.path,
+            position.label,
+        )
+        .outerjoin(models.SampleType, models.SampleType.id == sample.sample_type_id)
+        .outerjoin(models.SampleLocation, models.SampleLocation.sample_id == sample.id)
+        .outerjoin(position, position.id == models.SampleLocation.position_id)
+        .outerjoin(models.StorageNode, models.StorageNode.id == position.box_id)
+        .order_by(sample.sample_id)
+    )
+    if sample_ids is not None:
+        stmt = stmt.where(sample.id.in_(sample_ids))
+    stmt = crud._filter_samples(stmt, db=db, **filters)
+    names = dict(db.execute(select(models.StorageNode.id, models.StorageNode.name)).all())
+    rows = []
+    for sample_id, type_name, path, label in db.execute(stmt):
+        location = ""
+        if label is not None:
+            location = "/".join(
+                [names.get(int(node_id), "?") for node_id in (path or "").strip("/").split("/") if node_id]
+                + [label]
+            )
+        rows.append({"sample_id": sample_id, "sample_type": type_name or "", "location": location})
+    return rows
+
+
+def render(
+    rows: list[dict],
+    format: str,
+    workers: int = WORKERS,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Iterator[bytes]:
+    """Yield printer-ready output for ``rows`` as it is rendered.
+
+    Chunks of ``CHUNK_SIZE`` labels are rendered in worker processes and
+    written in order, so output starts flowing after the first chunk.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown label format '{format}'")
+    chunks = [(format, start, rows[start : start + CHUNK_SIZE]) for start in range(0, len(rows), CHUNK_SIZE)]
+    if workers > 1 and len(chunks) > 1:
+        try:
+            yield from _write(format, rows, chunks, _pool(workers).map(render_chunk, chunks), progress)
+        except BrokenProcessPool:
+            # Start a fresh pool next time rather than failing every request.
+            stop_pool()
+            raise
+    else:
+        yield from _write(format, rows, chunks, map(render_chunk, chunks), progress)
+
+
+def _write(format: str, rows: list[dict], chunks: list, parts, progress) -> Iterator[bytes]:
+    if format == "zpl":
+        done = 0
+        for (_, _, chunk), part in zip(chunks, parts):
+            yield part[0]
+            done += len(chunk)
+            if progress is not None:
+                progress(done, len(rows))
+        return
+    yield from _pdf_document(len(rows), chunks, parts, progress)
+
+
+def _pdf_document(count: int, chunks: list, parts, progress) -> Iterator[bytes]:
+    # Objects 1-4 are fixed; label n uses objects 5 + 2n (page) and 6 + 2n
+    # (content). The page tree comes last, once every page has been written.
+    offsets: dict[int, int] = {}
+    written = 0
+
+    def emit(number: Optional[int], data: bytes) -> bytes:
+        nonlocal written
+        if number is not None:
+            offsets[number] = written
+        written += len(data)
+        return data
+
+    yield emit(None, b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    yield emit(1, b"1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n")
+    yield emit(3, b"3 0 obj\n<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>\nendobj\n")
+    yield emit(4, b"4 0 obj\n<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold >>\nendobj\n")
+    done = 0
+    for (_, start, chunk), objects in zip(chunks, parts):
+        for number, data in enumerate(objects, start=5 + 2 * start):
+            yield emit(number, data)
+        done += len(chunk)
+        if progress is not None:
+            progress(done, count)
+    kids = " ".join(f"{5 + 2 * index} 0 R" for index in range(count))
+    yield emit(2, f"2 0 obj\n<< /Type /Pages /Kids [{kids}] /Count {count} >>\nendobj\n".encode())
+    size = 5 + 2 * count
+    xref = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+    xref.extend(f"{offsets[number]:010d} 00000 n \n" for number in range(1, size))
+    xref.append(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{written}\n%%EOF\n")
+    yield "".join(xref).encode()
+
+
+def render_chunk(chunk: tuple) -> list[bytes]:
+    """Render one chunk of labels; runs in a worker process.
+
+    ZPL comes back as one piece, PDF as a page and a content object per label.
+    """
+    format, start, rows = chunk
+    if format == "zpl":
+        return [b"".join(_zpl_label(row) for row in rows)]
+    objects = []
+    for offset, row in enumerate(rows):
+        page_number = 5 + 2 * (start + offset)
+        stream = zlib.compress(_pdf_content(row))
+        objects.append(
+            (
+                f"{page_number} 0 obj\n<< /Type /Page /Parent 2 0 R "
+                f"/MediaBox [0 0 {LABEL_WIDTH:g} {LABEL_HEIGHT:g}] "
+                f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> "
+                f"/Contents {page_number + 1} 0 R >>\nendobj\n"
+            ).encode()
+        )
+        objects.append(
+            f"{page_number + 1} 0 obj\n<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n".encode()
+            + stream
+            + b"\nendstream\nendobj\n"
+        )
+    return objects
+
+
+def _zpl_label(row: dict) -> bytes:
+    def dots(points: float) -> int:
+        return round(points * ZPL_DOTS_PER_POINT)
+
+    left = dots(6)
+    # Widest module (in dots) that still fits the barcode on the label.
+    module = max(1, min(3, (dots(LABEL_WIDTH) - 2 * left) // sum(code128_widths(row["sample_id"]))))
+    return (
+        f"^XA^PW{dots(LABEL_WIDTH)}^LL{dots(LABEL_HEIGHT)}^CI28"
+        f"^FO{left},{dots(4)}^BY{module}^BCN,{dots(28)},N,N,N^FH^FD{_zpl_text(row['sample_id'])}^FS"
+        f"^FO{left},{dots(36)}^A0N,{dots(10)},{dots(10)}^FH^FD{_zpl_text(row['sample_id'])}^FS"
+        f"^FO{left},{dots(49)}^A0N,{dots(8)},{dots(8)}^FH^FD{_zpl_text(row['sample_type'])}^FS"
+        f"^FO{left},{dots(59)}^A0N,{dots(7)},{dots(7)}^FH^FD{_zpl_text(row['location'])}^FS"
+        "^XZ\n"
+    ).encode()
+
+
+def _zpl_text(value: str) -> str:
+    # ^FH makes "_" an escape prefix, so the control characters and the
+    # prefix itself are written as hex.
+    return value.replace("_", "_5F").replace("^", "_5E").replace("~", "_7E")
+
+
+def _pdf_content(row: dict) -> bytes:
+    margin = 6
+    barcode = _pdf_barcode(row["sample_id"], margin, LABEL_HEIGHT - 34, LABEL_WIDTH - 2 * margin, 28)
+    lines = [
+        ("F2", 8, LABEL_HEIGHT - 43, row["sample_id"]),
+        ("F1", 6.5, LABEL_HEIGHT - 53, row["sample_type"]),
+        ("F1", 5.5, LABEL_HEIGHT - 62, row["location"]),
+    ]
+    text = b"".join(
+        b"BT /%s %g Tf %g %g Td (%s) Tj ET\n" % (font.encode(), size, margin, y, _pdf_text(value))
+        for font, size, y, value in lines
+        if value
+    )
+    return barcode + text
+
+
+@lru_cache(maxsize=65536)
+def _pdf_barcode(value: str, x: float, y: float, width: float, height: float) -> bytes:
+    """Filled rectangles for one barcode, cached by its content and placement."""
+    widths = code128_widths(value)
+    module = width / (sum(widths) + 2 * QUIET_ZONE)
+    position = x + QUIET_ZONE * module
+    bars = []
+    for index, span in enumerate(widths):
+        if index % 2 == 0:
+            bars.append(b"%.3f %.3f %.3f %.3f re" % (position, y, span * module, height))
+        position += span * module
+    return b"0 g\n" + b"\n".join(bars) + b"\nf\n"
+
+
+def _pdf_text(value: str) -> bytes:
+    encoded = value.encode("latin-1", "replace")
+    return encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+_pool_lock = threading.Lock()
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _pool(workers: int) -> ProcessPoolExecutor:
+    global _executor
+    with _pool_lock:
+        if _executor is None:
+            # Spawned rather than forked: the server process runs other threads.
+            context = multiprocessing.get_context("spawn")
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        return _executor
+
+
+def stop_pool() -> None:
+    global _executor
+    with _pool_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
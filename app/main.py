@@ -1,15 +1,18 @@
 from __future__ import annotations
 
 from fastapi import FastAPI
-from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
 
-from app.routes import auth, events, samples, storage
+from app import admission, crud, expiry, jobs, labels, reporting, telemetry, templating, writer
+from app.routes import auth, events, jobs as job_routes, monitoring, reports, samples, storage
 
 app = FastAPI(title="Freezer Sample Tracker")
 
 app.add_middleware(SessionMiddleware, secret_key="dev-secret-key")
+# Added last so it runs first and sheds load before any other work.
+app.add_middleware(admission.AdmissionMiddleware)
 
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
@@ -17,6 +20,80 @@ app.include_router(auth.router)
 app.include_router(samples.router)
 app.include_router(storage.router)
 app.include_router(events.router)
+app.include_router(monitoring.router)
+app.include_router(job_routes.router)
+app.include_router(reports.router)
+
+
+@app.on_event("startup")
+async def start_writer():
+    writer.start_coordinator()
+
+
+@app.on_event("startup")
+async def start_telemetry():
+    telemetry.start_buffer()
+
+
+@app.on_event("startup")
+async def start_jobs():
+    jobs.start_runner()
+
+
+@app.on_event("startup")
+async def start_expiry_sweeper():
+    expiry.start_sweeper()
+
+
+@app.on_event("startup")
+async def start_report_refresher():
+    reporting.start_refresher()
+
+
+@app.on_event("startup")
+async def warm_templates():
+    if templating.PRECOMPILE:
+        templating.precompile_templates()
+
+
+@app.on_event("shutdown")
+async def stop_writer():
+    writer.stop_coordinator()
+
+
+@app.on_event("shutdown")
+async def stop_telemetry():
+    telemetry.stop_buffer()
+
+
+@app.on_event("shutdown")
+async def stop_jobs():
+    jobs.stop_runner()
+
+
+@app.on_event("shutdown")
+async def stop_expiry_sweeper():
+    expiry.stop_sweeper()
+
+
+@app.on_event("shutdown")
+async def stop_report_refresher():
+    reporting.stop_refresher()
+
+
+@app.on_event("shutdown")
+async def stop_label_pool():
+    labels.stop_pool()
+
+
+@app.exception_handler(crud.StorageError)
+async def storage_error(request, exc: crud.StorageError):
+    return JSONResponse({"detail": str(exc)}, status_code=409)
+
+
+@app.exception_handler(crud.SampleError)
+async def sample_error(request, exc: crud.SampleError):
+    return JSONResponse({"detail": str(exc)}, status_code=400)
 
 
 @app.get("/")
@@ -1,15 +1,20 @@
 from __future__ import annotations
 
+import hashlib
 import json
-from datetime import datetime
+from datetime import date, datetime, timezone
 from enum import Enum
 from typing import Optional
 
 from sqlalchemy import (
+    Boolean,
     CheckConstraint,
+    Date,
     DateTime,
     Enum as SqlEnum,
+    Float,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
@@ -29,6 +34,61 @@ class StorageNodeType(str, Enum):
     box = "box"
 
 
+class LabelScheme(str, Enum):
+    alpha_numeric = "alpha_numeric"
+    numeric = "numeric"
+
+
+def row_label(row: int) -> str:
+    label = ""
+    while row > 0:
+        row, remainder = divmod(row - 1, 26)
+        label = chr(65 + remainder) + label
+    return label
+
+
+def position_label(row: int, col: int, cols: int, scheme: LabelScheme) -> str:
+    if scheme == LabelScheme.numeric:
+        return str((row - 1) * cols + col)
+    return f"{row_label(row)}{col}"
+
+
+GENESIS_HASH = "0" * 64
+
+EVENT_HASH_FIELDS = (
+    "id",
+    "event_type",
+    "user_id",
+    "sample_id",
+    "from_position_id",
+    "to_position_id",
+    "payload_json",
+    "created_at",
+)
+
+
+def event_hash(prev_hash: str, row: dict) -> str:
+    """Chain hash of one event row, given the previous event's hash.
+
+    ``row`` may come from the table or from an archive segment, so enum and
+    datetime fields are normalised to the forms segments store.
+    """
+    values = []
+    for field in EVENT_HASH_FIELDS:
+        value = row[field]
+        if isinstance(value, Enum):
+            value = value.value
+        elif field == "created_at":
+            if isinstance(value, str):
+                value = datetime.fromisoformat(value)
+            if value.tzinfo is not None:
+                value = value.astimezone(timezone.utc).replace(tzinfo=None)
+            value = value.isoformat()
+        values.append(value)
+    data = json.dumps(values, separators=(",", ":")).encode()
+    return hashlib.sha256(prev_hash.encode() + data).hexdigest()
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -48,9 +108,14 @@ class SampleType(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(100), unique=True, nullable=False)
     description: Mapped[Optional[str]] = mapped_column(String(255))
+    attribute_schema_json: Mapped[Optional[str]] = mapped_column(Text)
 
     samples: Mapped[list[Sample]] = relationship("Sample", back_populates="sample_type")
 
+    @property
+    def attribute_schema(self) -> list[dict]:
+        return json.loads(self.attribute_schema_json) if self.attribute_schema_json else []
+
 
 class Sample(Base):
     __tablename__ = "samples"
@@ -65,6 +130,12 @@ class Sample(Base):
         ForeignKey("sample_types.id")
     )
     notes: Mapped[Optional[str]] = mapped_column(Text)
+    parent_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("samples.id"), index=True
+    )
+    expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    retain_until: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    attributes_json: Mapped[Optional[str]] = mapped_column(Text)
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=datetime.utcnow
     )
@@ -79,6 +150,64 @@ class Sample(Base):
         "SampleLocation", back_populates="sample", uselist=False
     )
     events: Mapped[list[Event]] = relationship("Event", back_populates="sample")
+    parent: Mapped[Optional[Sample]] = relationship(
+        "Sample", remote_side=[id], back_populates="children"
+    )
+    children: Mapped[list[Sample]] = relationship("Sample", back_populates="parent")
+
+    @property
+    def attributes(self) -> dict:
+        return json.loads(self.attributes_json) if self.attributes_json else {}
+
+    # The expiry sweeper seeks on (status, due date), so rows it has already
+    # swept fall out of its range instead of being rescanned.
+    __table_args__ = (
+        Index("ix_samples_status_expires_at", "status", "expires_at"),
+        Index("ix_samples_status_retain_until", "status", "retain_until"),
+    )
+
+
+class SampleAttribute(Base):
+    # Copies of the attributes a sample type marks "indexed", one row per
+    # value, so attribute filters can seek instead of parsing JSON.
+    __tablename__ = "sample_attributes"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    sample_id: Mapped[int] = mapped_column(ForeignKey("samples.id"), nullable=False)
+    name: Mapped[str] = mapped_column(String(50), nullable=False)
+    num_value: Mapped[Optional[float]] = mapped_column(Float)
+    text_value: Mapped[Optional[str]] = mapped_column(String(255))
+
+    __table_args__ = (
+        UniqueConstraint("sample_id", "name", name="uq_sample_attribute"),
+        Index("ix_sample_attributes_num", "name", "num_value"),
+        Index("ix_sample_attributes_text", "name", "text_value"),
+    )
+
+
+class BoxLayout(Base):
+    __tablename__ = "box_layouts"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(100), unique=True, nullable=False)
+    rows: Mapped[int] = mapped_column(Integer, nullable=False)
+    cols: Mapped[int] = mapped_column(Integer, nullable=False)
+    label_scheme: Mapped[LabelScheme] = mapped_column(
+        SqlEnum(LabelScheme), default=LabelScheme.alpha_numeric
+    )
+
+    boxes: Mapped[list[StorageNode]] = relationship("StorageNode", back_populates="layout")
+
+    __table_args__ = (
+        CheckConstraint("rows > 0 AND cols > 0", name="ck_layout_dimensions"),
+    )
+
+    @property
+    def capacity(self) -> int:
+        return self.rows * self.cols
+
+    def label(self, row: int, col: int) -> str:
+        return position_label(row, col, self.cols, self.label_scheme)
 
 
 class StorageNode(Base):
@@ -90,6 +219,11 @@ class StorageNode(Base):
     parent_id: Mapped[Optional[int]] = mapped_column(
         ForeignKey("storage_nodes.id")
     )
+    layout_id: Mapped[Optional[int]] = mapped_column(ForeignKey("box_layouts.id"))
+    # Derived ancestry, kept in sync by crud: "/<root id>/.../<own id>/" and the
+    # id of the nearest freezer at or above this node.
+    path: Mapped[Optional[str]] = mapped_column(String(255), index=True)
+    freezer_id: Mapped[Optional[int]] = mapped_column(Integer, index=True)
 
     parent: Mapped[Optional[StorageNode]] = relationship(
         "StorageNode", remote_side=[id], back_populates="children"
@@ -100,6 +234,7 @@ class StorageNode(Base):
     positions: Mapped[list[StoragePosition]] = relationship(
         "StoragePosition", back_populates="box"
     )
+    layout: Mapped[Optional[BoxLayout]] = relationship("BoxLayout", back_populates="boxes")
 
     def path_names(self) -> list[str]:
         current = self
@@ -140,12 +275,204 @@ class SampleLocation(Base):
     placed_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=datetime.utcnow
     )
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
 
     sample: Mapped[Sample] = relationship("Sample", back_populates="location")
     position: Mapped[StoragePosition] = relationship(
         "StoragePosition", back_populates="location"
     )
 
+    __mapper_args__ = {"version_id_col": version}
+
+
+class VolumeTransaction(Base):
+    __tablename__ = "volume_transactions"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    sample_id: Mapped[int] = mapped_column(ForeignKey("samples.id"), index=True)
+    delta: Mapped[float] = mapped_column(Float, nullable=False)
+    volume_after: Mapped[float] = mapped_column(Float, nullable=False)
+    volume_units: Mapped[Optional[str]] = mapped_column(String(20))
+    reason: Mapped[str] = mapped_column(String(50), nullable=False)
+    note: Mapped[Optional[str]] = mapped_column(Text)
+    user_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id"))
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=datetime.utcnow
+    )
+
+
+class VolumeRollup(Base):
+    # Remaining volume per sample type, freezer and unit. sample_type_id 0 means
+    # untyped and freezer_id 0 means not stored in a freezer, so every bucket
+    # has a concrete key to upsert on.
+    __tablename__ = "volume_rollups"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    sample_type_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    freezer_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    volume_units: Mapped[str] = mapped_column(String(20), nullable=False, default="")
+    total_volume: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    sample_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "sample_type_id", "freezer_id", "volume_units", name="uq_volume_rollup_key"
+        ),
+    )
+
+
+class DailyActivity(Base):
+    # Events per UTC day, freezer, box, user and type. Zero ids mean "none",
+    # as in VolumeRollup.
+    __tablename__ = "daily_activity"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    day: Mapped[date] = mapped_column(Date, nullable=False)
+    freezer_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    box_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    user_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    event_type: Mapped[str] = mapped_column(String(30), nullable=False)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "day", "freezer_id", "box_id", "user_id", "event_type", name="uq_daily_activity_key"
+        ),
+    )
+
+
+class DailyOccupancy(Base):
+    # End-of-day occupied positions for a freezer or box (node_id), written
+    # only on days something changed; readers carry the last value forward.
+    __tablename__ = "daily_occupancy"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    node_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    day: Mapped[date] = mapped_column(Date, nullable=False)
+    occupied: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    placed: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    removed: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("node_id", "day", name="uq_daily_occupancy_node_day"),
+    )
+
+
+class IdSequence(Base):
+    __tablename__ = "id_sequences"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(50), unique=True, nullable=False)
+    prefix: Mapped[str] = mapped_column(String(20), nullable=False, default="")
+    format: Mapped[str] = mapped_column(String(100), nullable=False, default="{prefix}{n:06d}")
+    next_value: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=datetime.utcnow
+    )
+
+    def render(self, value: int) -> str:
+        return self.format.format(prefix=self.prefix, n=value)
+
+
+class ChangeLog(Base):
+    # Compacted change feed: one row per entity, re-stamped with a fresh seq
+    # on every change, so reading "seq > token" yields each changed entity once.
+    __tablename__ = "change_log"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    entity: Mapped[str] = mapped_column(String(20), nullable=False)
+    entity_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    seq: Mapped[int] = mapped_column(Integer, nullable=False, unique=True)
+    changed_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=datetime.utcnow
+    )
+
+    __table_args__ = (
+        UniqueConstraint("entity", "entity_id", name="uq_change_log_entity"),
+    )
+
+
+class TemperatureReading(Base):
+    __tablename__ = "temperature_readings"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    freezer_id: Mapped[int] = mapped_column(ForeignKey("storage_nodes.id"), nullable=False)
+    recorded_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    temperature: Mapped[float] = mapped_column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_temperature_readings_freezer_time", "freezer_id", "recorded_at"),
+    )
+
+
+class TemperatureRollup(Base):
+    # One row per freezer, bucket width (seconds) and bucket start. Sum and
+    # count are kept instead of the mean so buckets can be merged on upsert.
+    __tablename__ = "temperature_rollups"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    freezer_id: Mapped[int] = mapped_column(ForeignKey("storage_nodes.id"), nullable=False)
+    resolution: Mapped[int] = mapped_column(Integer, nullable=False)
+    bucket_start: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    min_temperature: Mapped[float] = mapped_column(Float, nullable=False)
+    max_temperature: Mapped[float] = mapped_column(Float, nullable=False)
+    sum_temperature: Mapped[float] = mapped_column(Float, nullable=False)
+    reading_count: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "freezer_id", "resolution", "bucket_start", name="uq_temperature_rollup_bucket"
+        ),
+    )
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+    cancelled = "cancelled"
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(50), nullable=False)
+    status: Mapped[JobStatus] = mapped_column(
+        SqlEnum(JobStatus), default=JobStatus.queued, index=True
+    )
+    params_json: Mapped[Optional[str]] = mapped_column(Text)
+    progress: Mapped[int] = mapped_column(Integer, default=0)
+    total: Mapped[Optional[int]] = mapped_column(Integer)
+    message: Mapped[Optional[str]] = mapped_column(String(255))
+    result_json: Mapped[Optional[str]] = mapped_column(Text)
+    result_path: Mapped[Optional[str]] = mapped_column(String(500))
+    error: Mapped[Optional[str]] = mapped_column(Text)
+    cancel_requested: Mapped[bool] = mapped_column(Boolean, default=False)
+    user_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id"))
+    # "<host>:<pid>:<token>" of the process that queued or runs the job; the
+    # owner refreshes heartbeat_at while the job is unfinished.
+    owner: Mapped[Optional[str]] = mapped_column(String(100))
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=datetime.utcnow
+    )
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+
+    @property
+    def params(self) -> dict:
+        return json.loads(self.params_json) if self.params_json else {}
+
+    @property
+    def result(self):
+        return json.loads(self.result_json) if self.result_json else None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in {JobStatus.succeeded, JobStatus.failed, JobStatus.cancelled}
+
 
 class EventType(str, Enum):
     create_sample = "create_sample"
@@ -154,6 +481,8 @@ class EventType(str, Enum):
     move_sample = "move_sample"
     status_change = "status_change"
     create_storage = "create_storage"
+    volume_change = "volume_change"
+    relocate_storage = "relocate_storage"
 
 
 class Event(Base):
@@ -173,6 +502,8 @@ class Event(Base):
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=datetime.utcnow
     )
+    prev_hash: Mapped[Optional[str]] = mapped_column(String(64))
+    hash: Mapped[Optional[str]] = mapped_column(String(64))
 
     user: Mapped[Optional[User]] = relationship("User", back_populates="events")
     sample: Mapped[Optional[Sample]] = relationship("Sample", back_populates="events")
@@ -185,3 +516,44 @@ class Event(Base):
 
     def set_payload(self, payload: dict) -> None:
         self.payload_json = json.dumps(payload)
+
+
+class EventChainHead(Base):
+    """Single row holding the newest chained event; writers lock it to append."""
+
+    __tablename__ = "event_chain_head"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    event_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    hash: Mapped[str] = mapped_column(String(64), nullable=False, default=GENESIS_HASH)
+
+
+class AuditCheckpoint(Base):
+    __tablename__ = "audit_checkpoints"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    event_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+    hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    events_verified: Mapped[int] = mapped_column(Integer, nullable=False)
+    full: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    signature: Mapped[str] = mapped_column(String(64), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=datetime.utcnow
+    )
+
+
+class EventSegment(Base):
+    __tablename__ = "event_segments"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    path: Mapped[str] = mapped_column(String(500), nullable=False, unique=True)
+    codec: Mapped[str] = mapped_column(String(10), nullable=False)
+    event_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    min_event_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+    max_event_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+    min_created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    max_created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    sha256: Mapped[str] = mapped_column(String(64), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=datetime.utcnow
+    )
@@ -0,0 +1,532 @@
+from __future__ import annotations
+
+import bisect
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app import crud, models
+
+GROUP_COLUMNS = {
+    "sample_type": models.Sample.sample_type_id,
+    "status": models.Sample.status,
+}
+
+CHUNK_SIZE = 500
+
+
+@dataclass
+class PlannedMove:
+    sample_id: int
+    from_position_id: int
+    from_box_id: int
+    to_box_id: int
+    to_row: int
+    to_col: int
+    to_position_id: Optional[int] = None
+
+
+@dataclass
+class ConsolidationPlan:
+    node_id: int
+    group_by: Optional[str]
+    boxes_considered: int = 0
+    boxes_freed: list[int] = field(default_factory=list)
+    mixed_boxes: list[int] = field(default_factory=list)
+    moves: list[PlannedMove] = field(default_factory=list)
+
+    def as_moves(self) -> list[dict]:
+        return _as_moves(self.moves)
+
+
+@dataclass
+class EvacuationPlan:
+    node_id: int
+    samples: int = 0
+    source_boxes: int = 0
+    boxes_kept_together: int = 0
+    boxes_split: list[int] = field(default_factory=list)
+    destination_boxes: list[int] = field(default_factory=list)
+    destination_freezers: list[int] = field(default_factory=list)
+    unplaced: list[int] = field(default_factory=list)
+    moves: list[PlannedMove] = field(default_factory=list)
+
+    def as_moves(self) -> list[dict]:
+        return _as_moves(self.moves)
+
+
+@dataclass
+class FreeCell:
+    box_id: int
+    row: int
+    col: int
+    position_id: Optional[int] = None
+
+
+@dataclass
+class _BoxUsage:
+    box_id: int
+    capacity: int = 0
+    occupied: int = 0
+    groups: set = field(default_factory=set)
+
+
+def plan_consolidation(
+    db: Session, node_id: int, group_by: Optional[str] = "sample_type"
+) -> ConsolidationPlan:
+    if group_by is not None and group_by not in GROUP_COLUMNS:
+        raise crud.StorageError(f"Unknown grouping '{group_by}'")
+    plan = ConsolidationPlan(node_id=node_id, group_by=group_by)
+    usage = _box_usage(db, node_id, group_by)
+    plan.boxes_considered = len(usage)
+
+    # Boxes holding more than one group are left alone: emptying them would
+    # mix groups elsewhere, and filling them would make the mix worse.
+    by_group: dict = defaultdict(list)
+    for box in usage.values():
+        if len(box.groups) > 1:
+            plan.mixed_boxes.append(box.box_id)
+        elif box.groups:
+            by_group[next(iter(box.groups))].append(box)
+
+    assignments = []
+    for boxes in by_group.values():
+        targets, sources = _split_targets(boxes)
+        if sources:
+            assignments.append((targets, sources))
+            plan.boxes_freed.extend(box.box_id for box in sources)
+
+    for targets, sources in assignments:
+        free = free_cells(db, [box.box_id for box in targets])
+        occupants = _occupants(db, [box.box_id for box in sources])
+        for occupant, cell in zip(occupants, free):
+            sample_id, from_position_id, from_box_id = occupant
+            plan.moves.append(
+                PlannedMove(
+                    sample_id=sample_id,
+                    from_position_id=from_position_id,
+                    from_box_id=from_box_id,
+                    to_box_id=cell.box_id,
+                    to_row=cell.row,
+                    to_col=cell.col,
+                    to_position_id=cell.position_id,
+                )
+            )
+    plan.boxes_freed.sort()
+    plan.mixed_boxes.sort()
+    return plan
+
+
+def plan_evacuation(
+    db: Session, node_id: int, freezer_ids: Optional[list[int]] = None
+) -> EvacuationPlan:
+    """Plan moving every sample under ``node_id`` into other freezers.
+
+    Each source box goes whole into one destination box where one has room,
+    largest boxes first. Boxes already used are tried first, then other
+    boxes in freezers already in use, and only then another freezer. A box
+    that fits nowhere is split over the roomiest boxes. Samples keep their
+    order within a box. ``freezer_ids`` limits the destinations.
+    """
+    node = db.get(models.StorageNode, node_id)
+    if node is None:
+        raise crud.StorageError("Storage node not found")
+    plan = EvacuationPlan(node_id=node_id)
+    groups: dict[int, list] = defaultdict(list)
+    for row in _evacuees(db, node):
+        groups[row.box_id].append(row)
+    plan.samples = sum(len(rows) for rows in groups.values())
+    plan.source_boxes = len(groups)
+
+    packer = _Packer(_destinations(db, node, freezer_ids))
+    allocations = []
+    for box_id, rows in sorted(groups.items(), key=lambda item: (-len(item[1]), item[0])):
+        parts = packer.place(len(rows))
+        placed = sum(count for _, count in parts)
+        if len(parts) == 1 and placed == len(rows):
+            plan.boxes_kept_together += 1
+        elif parts:
+            plan.boxes_split.append(box_id)
+        start = 0
+        for to_box_id, count in parts:
+            allocations.append((rows[start : start + count], to_box_id))
+            start += count
+        plan.unplaced.extend(row.sample_id for row in rows[start:])
+
+    cells: dict[int, list[FreeCell]] = defaultdict(list)
+    for cell in free_cells(db, packer.used):
+        cells[cell.box_id].append(cell)
+    for rows, to_box_id in allocations:
+        free = cells[to_box_id]
+        taken, cells[to_box_id] = free[: len(rows)], free[len(rows) :]
+        for row, cell in zip(rows, taken):
+            plan.moves.append(
+                PlannedMove(
+                    sample_id=row.sample_id,
+                    from_position_id=row.position_id,
+                    from_box_id=row.box_id,
+                    to_box_id=cell.box_id,
+                    to_row=cell.row,
+                    to_col=cell.col,
+                    to_position_id=cell.position_id,
+                )
+            )
+        # Counts and cells can only disagree if the box changed meanwhile.
+        plan.unplaced.extend(row.sample_id for row in rows[len(taken) :])
+    plan.destination_boxes = sorted({move.to_box_id for move in plan.moves})
+    plan.destination_freezers = sorted(
+        {packer.freezers[box_id] for box_id in plan.destination_boxes}
+    )
+    plan.boxes_split.sort()
+    return plan
+
+
+def pick_list(db: Session, plan: EvacuationPlan) -> list[dict]:
+    """One printable row per move, in picking order: source box by box."""
+    node = db.get(models.StorageNode, plan.node_id)
+    evacuees = {row.sample_id: row for row in _evacuees(db, node)}
+    box_ids = sorted(
+        {move.to_box_id for move in plan.moves} | {row.box_id for row in evacuees.values()}
+    )
+    nodes: dict[int, tuple[str, Optional[int]]] = {}
+    layouts: dict[int, models.BoxLayout] = {}
+    labels: dict[int, str] = {}
+    for chunk in _chunks(box_ids):
+        for row in db.execute(
+            select(models.StorageNode.id, models.StorageNode.name, models.StorageNode.freezer_id)
+            .where(models.StorageNode.id.in_(chunk))
+        ):
+            nodes[row.id] = (row.name, row.freezer_id)
+        layouts.update(
+            db.execute(
+                select(models.StorageNode.id, models.BoxLayout)
+                .join(models.BoxLayout, models.BoxLayout.id == models.StorageNode.layout_id)
+                .where(models.StorageNode.id.in_(chunk))
+            ).all()
+        )
+        labels.update(
+            db.execute(
+                select(models.StoragePosition.id, models.StoragePosition.label)
+                .where(models.StoragePosition.box_id.in_(chunk))
+            ).all()
+        )
+    freezer_ids = sorted({freezer_id for _, freezer_id in nodes.values() if freezer_id})
+    freezers = dict(
+        db.execute(
+            select(models.StorageNode.id, models.StorageNode.name)
+            .where(models.StorageNode.id.in_(freezer_ids))
+        ).all()
+    )
+
+    def where(box_id: int, label: str) -> dict:
+        name, freezer_id = nodes[box_id]
+        return {
+            "freezer": freezers.get(freezer_id),
+            "box": name,
+            "box_id": box_id,
+            "position": label,
+        }
+
+    rows = []
+    for step, move in enumerate(plan.moves, start=1):
+        source = evacuees[move.sample_id]
+        layout = layouts.get(move.to_box_id)
+        if move.to_position_id is not None:
+            to_label = labels[move.to_position_id]
+        else:
+            to_label = layout.label(move.to_row, move.to_col)
+        rows.append(
+            {
+                "step": step,
+                "sample_id": move.sample_id,
+                "sample": source.code,
+                "pick": where(source.box_id, source.label),
+                "put": where(move.to_box_id, to_label),
+            }
+        )
+    return rows
+
+
+@dataclass
+class _Destination:
+    box_id: int
+    freezer_id: int
+    free: int
+
+
+class _Packer:
+    """Hands out room in destination boxes, opening freezers one at a time."""
+
+    def __init__(self, destinations: list[_Destination]) -> None:
+        self.closed: dict[int, list[_Destination]] = defaultdict(list)
+        for destination in destinations:
+            if destination.free > 0:
+                self.closed[destination.freezer_id].append(destination)
+        self.freezers = {destination.box_id: destination.freezer_id for destination in destinations}
+        self.boxes: dict[int, _Destination] = {}
+        # Open boxes as sorted (free, box_id) keys for best-fit lookups.
+        self.open: list[tuple[int, int]] = []
+        self.used: list[int] = []
+
+    def place(self, need: int) -> list[tuple[int, int]]:
+        """Split ``need`` samples into ``(box_id, count)`` parts."""
+        parts = []
+        while need:
+            box = self._fit(need)
+            if box is None and self._open_freezer(need):
+                continue
+            if box is None and self.open:
+                box = self.boxes[self.open[-1][1]]
+            if box is None:
+                if self._open_freezer(1):
+                    continue
+                break
+            count = min(need, box.free)
+            self._take(box, count)
+            parts.append((box.box_id, count))
+            need -= count
+        return parts
+
+    def _fit(self, need: int) -> Optional[_Destination]:
+        used = [self.boxes[box_id] for box_id in self.used if self.boxes[box_id].free >= need]
+        if used:
+            return min(used, key=lambda box: (box.free, box.box_id))
+        index = bisect.bisect_left(self.open, (need, 0))
+        return self.boxes[self.open[index][1]] if index < len(self.open) else None
+
+    def _open_freezer(self, need: int) -> bool:
+        candidates = [
+            (sum(box.free for box in boxes), -freezer_id)
+            for freezer_id, boxes in self.closed.items()
+            if max(box.free for box in boxes) >= need
+        ]
+        if not candidates:
+            return False
+        freezer_id = -max(candidates)[1]
+        for box in self.closed.pop(freezer_id):
+            self.boxes[box.box_id] = box
+            bisect.insort(self.open, (box.free, box.box_id))
+        return True
+
+    def _take(self, box: _Destination, count: int) -> None:
+        self.open.pop(bisect.bisect_left(self.open, (box.free, box.box_id)))
+        box.free -= count
+        if box.free:
+            bisect.insort(self.open, (box.free, box.box_id))
+        if box.box_id not in self.used:
+            self.used.append(box.box_id)
+
+
+def _evacuees(db: Session, node: models.StorageNode) -> list:
+    position = models.StoragePosition
+    location = models.SampleLocation
+    box = models.StorageNode
+    return db.execute(
+        select(
+            location.sample_id,
+            location.position_id,
+            position.box_id,
+            position.label,
+            models.Sample.sample_id.label("code"),
+        )
+        .join(position, position.id == location.position_id)
+        .join(box, box.id == position.box_id)
+        .join(models.Sample, models.Sample.id == location.sample_id)
+        .where(box.path.startswith(node.path))
+        .order_by(position.box_id, position.row, position.col)
+    ).all()
+
+
+def _destinations(
+    db: Session, node: models.StorageNode, freezer_ids: Optional[list[int]]
+) -> list[_Destination]:
+    box = models.StorageNode
+    position = models.StoragePosition
+    conditions = [
+        box.node_type == models.StorageNodeType.box,
+        box.freezer_id.is_not(None),
+        ~box.path.startswith(node.path),
+    ]
+    if node.freezer_id is not None:
+        # A failing shelf takes the rest of its freezer down with it.
+        conditions.append(box.freezer_id != node.freezer_id)
+    if freezer_ids:
+        conditions.append(box.freezer_id.in_(freezer_ids))
+    boxes = db.execute(
+        select(box.id, box.freezer_id, models.BoxLayout.rows * models.BoxLayout.cols)
+        .outerjoin(models.BoxLayout, models.BoxLayout.id == box.layout_id)
+        .where(*conditions)
+    ).all()
+    positions = dict(
+        db.execute(
+            select(position.box_id, func.count(position.id))
+            .join(box, box.id == position.box_id)
+            .where(*conditions)
+            .group_by(position.box_id)
+        ).all()
+    )
+    occupied = dict(
+        db.execute(
+            select(position.box_id, func.count(models.SampleLocation.id))
+            .join(box, box.id == position.box_id)
+            .join(models.SampleLocation, models.SampleLocation.position_id == position.id)
+            .where(*conditions)
+            .group_by(position.box_id)
+        ).all()
+    )
+    return [
+        _Destination(
+            box_id=box_id,
+            freezer_id=freezer_id,
+            free=(capacity if capacity is not None else positions.get(box_id, 0))
+            - occupied.get(box_id, 0),
+        )
+        for box_id, freezer_id, capacity in boxes
+    ]
+
+
+def _split_targets(boxes: list[_BoxUsage]) -> tuple[list[_BoxUsage], list[_BoxUsage]]:
+    # Keep the fullest boxes and drain the rest: for uniform box sizes this
+    # frees the most boxes with the fewest moves.
+    ordered = sorted(boxes, key=lambda box: (-box.occupied, -box.capacity, box.box_id))
+    total = sum(box.occupied for box in ordered)
+    capacity = 0
+    for index, box in enumerate(ordered):
+        capacity += box.capacity
+        if capacity >= total:
+            return ordered[: index + 1], ordered[index + 1 :]
+    return ordered, []
+
+
+def _box_usage(
+    db: Session, node_id: int, group_by: Optional[str]
+) -> dict[int, _BoxUsage]:
+    tree = crud.subtree_cte(node_id)
+    position = models.StoragePosition
+    usage: dict[int, _BoxUsage] = {}
+    # Boxes with a layout have a fixed capacity whether or not their cells
+    # are materialized; older boxes are as large as their position rows.
+    layout_rows = db.execute(
+        select(tree.c.id, models.BoxLayout.rows * models.BoxLayout.cols)
+        .join(models.StorageNode, models.StorageNode.id == tree.c.id)
+        .join(models.BoxLayout, models.BoxLayout.id == models.StorageNode.layout_id)
+        .where(tree.c.node_type == models.StorageNodeType.box)
+    )
+    for box_id, capacity in layout_rows:
+        usage[box_id] = _BoxUsage(box_id=box_id, capacity=capacity)
+    capacity_rows = db.execute(
+        select(position.box_id, func.count(position.id))
+        .join(tree, tree.c.id == position.box_id)
+        .group_by(position.box_id)
+    )
+    for box_id, capacity in capacity_rows:
+        usage.setdefault(box_id, _BoxUsage(box_id=box_id, capacity=capacity))
+
+    group_column = GROUP_COLUMNS[group_by] if group_by else None
+    columns = [position.box_id, func.count(models.SampleLocation.id)]
+    if group_column is not None:
+        columns.insert(1, group_column)
+    stmt = (
+        select(*columns)
+        .join(tree, tree.c.id == position.box_id)
+        .join(models.SampleLocation, models.SampleLocation.position_id == position.id)
+        .join(models.Sample, models.Sample.id == models.SampleLocation.sample_id)
+        .group_by(*columns[:-1])
+    )
+    for row in db.execute(stmt):
+        box = usage[row[0]]
+        box.occupied += row[-1]
+        box.groups.add(row[1] if group_column is not None else None)
+    return usage
+
+
+def free_cells(db: Session, box_ids: list[int]) -> list[FreeCell]:
+    order = {box_id: index for index, box_id in enumerate(box_ids)}
+    position = models.StoragePosition
+    layouts: dict[int, tuple[int, int]] = {}
+    materialized: dict[tuple[int, int, int], tuple[Optional[int], bool]] = {}
+    for chunk in _chunks(box_ids):
+        layouts.update(
+            (row.id, (row.rows, row.cols))
+            for row in db.execute(
+                select(models.StorageNode.id, models.BoxLayout.rows, models.BoxLayout.cols)
+                .join(models.BoxLayout, models.BoxLayout.id == models.StorageNode.layout_id)
+                .where(models.StorageNode.id.in_(chunk))
+            )
+        )
+        rows = db.execute(
+            select(
+                position.id,
+                position.box_id,
+                position.row,
+                position.col,
+                models.SampleLocation.id.is_not(None).label("occupied"),
+            )
+            .outerjoin(
+                models.SampleLocation,
+                models.SampleLocation.position_id == position.id,
+            )
+            .where(position.box_id.in_(chunk))
+        )
+        for row in rows:
+            materialized[(row.box_id, row.row, row.col)] = (row.id, bool(row.occupied))
+
+    cells = [
+        (box_id, row, col)
+        for box_id, (rows, cols) in layouts.items()
+        for row in range(1, rows + 1)
+        for col in range(1, cols + 1)
+    ]
+    cells.extend(cell for cell in materialized if cell[0] not in layouts)
+    free = []
+    for cell in cells:
+        position_id, occupied = materialized.get(cell, (None, False))
+        if not occupied:
+            free.append(FreeCell(*cell, position_id=position_id))
+    free.sort(key=lambda cell: (order[cell.box_id], cell.row, cell.col))
+    return free
+
+
+def _occupants(db: Session, box_ids: list[int]) -> list[tuple[int, int, int]]:
+    order = {box_id: index for index, box_id in enumerate(box_ids)}
+    position = models.StoragePosition
+    location = models.SampleLocation
+    rows = []
+    for chunk in _chunks(box_ids):
+        rows.extend(
+            db.execute(
+                select(
+                    location.sample_id,
+                    location.position_id,
+                    position.box_id,
+                    position.row,
+                    position.col,
+                )
+                .join(position, position.id == location.position_id)
+                .where(position.box_id.in_(chunk))
+            ).all()
+        )
+    rows.sort(key=lambda row: (order[row.box_id], row.row, row.col))
+    return [(row.sample_id, row.position_id, row.box_id) for row in rows]
+
+
+def _as_moves(moves: list[PlannedMove]) -> list[dict]:
+    return [
+        {
+            "sample_id": move.sample_id,
+            "from_position_id": move.from_position_id,
+            "to_position_id": move.to_position_id,
+            "to_box_id": move.to_box_id,
+            "to_row": move.to_row,
+            "to_col": move.to_col,
+        }
+        for move in moves
+    ]
+
+
+def _chunks(items: list, size: int = CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
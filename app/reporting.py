@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app import archive, backup
+from app.db import engine as live_engine
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("FREEZER_REPORTING", "1").lower() in {"1", "true", "yes"}
+SNAPSHOT_PATH = os.environ.get("FREEZER_REPORT_DB", "freezer-report.db")
+REFRESH_SECONDS = float(os.environ.get("FREEZER_REPORT_REFRESH_SECONDS", "900"))
+PAGES_PER_STEP = 1024
+
+# Built inside the snapshot after the copy; the live database never has them.
+REPORT_TABLES = (
+    """
+    CREATE TABLE report_samples AS
+    SELECT s.id, s.sample_id, s.name, s.status, s.volume, s.volume_units,
+           s.sample_type_id, t.name AS sample_type, s.created_at, s.expires_at,
+           p.id AS position_id, p.label AS position_label,
+           box.id AS box_id, box.name AS box_name,
+           box.freezer_id, freezer.name AS freezer_name
+    FROM samples s
+    LEFT JOIN sample_types t ON t.id = s.sample_type_id
+    LEFT JOIN sample_locations l ON l.sample_id = s.id
+    LEFT JOIN storage_positions p ON p.id = l.position_id
+    LEFT JOIN storage_nodes box ON box.id = p.box_id
+    LEFT JOIN storage_nodes freezer ON freezer.id = box.freezer_id
+    """,
+    "CREATE INDEX ix_report_samples_freezer ON report_samples (freezer_id, sample_type_id)",
+    """
+    CREATE TABLE report_box_occupancy AS
+    SELECT box.id AS box_id, box.name AS box_name,
+           box.freezer_id, freezer.name AS freezer_name,
+           COALESCE(layout.rows * layout.cols, positions.total, 0) AS capacity,
+           COALESCE(positions.occupied, 0) AS occupied
+    FROM storage_nodes box
+    LEFT JOIN box_layouts layout ON layout.id = box.layout_id
+    LEFT JOIN storage_nodes freezer ON freezer.id = box.freezer_id
+    LEFT JOIN (
+        SELECT p.box_id, COUNT(*) AS total, COUNT(l.id) AS occupied
+        FROM storage_positions p
+        LEFT JOIN sample_locations l ON l.position_id = p.id
+        GROUP BY p.box_id
+    ) positions ON positions.box_id = box.id
+    WHERE box.node_type = 'box'
+    """,
+    """
+    CREATE TABLE report_event_counts (
+        user_id INTEGER, username TEXT, event_type TEXT, day TEXT, count INTEGER
+    )
+    """,
+    """
+    INSERT INTO report_event_counts
+    SELECT e.user_id, u.username, e.event_type, date(e.created_at), COUNT(*)
+    FROM events e LEFT JOIN users u ON u.id = e.user_id
+    GROUP BY e.user_id, e.event_type, date(e.created_at)
+    """,
+    "CREATE TABLE report_meta (key TEXT PRIMARY KEY, value TEXT)",
+)
+
+_refresh_lock = threading.Lock()
+_engine = create_engine(
+    f"sqlite:///file:{os.path.abspath(SNAPSHOT_PATH)}?mode=ro&uri=true",
+    # A refresh swaps the file; fresh connections pick up the new copy.
+    poolclass=NullPool,
+)
+ReportSession = sessionmaker(bind=_engine, autoflush=False)
+
+
+def refresh_snapshot(source: Optional[str] = None, path: str = SNAPSHOT_PATH) -> dict:
+    """Copy the live database with the online backup API and add report tables.
+
+    The copy goes in steps of ``PAGES_PER_STEP`` pages so writers only wait
+    for one step at a time. Report tables are built in the copy, which then
+    replaces the previous snapshot in one rename.
+    """
+    source = source or live_engine.url.database
+    with _refresh_lock:
+        began = time.perf_counter()
+        taken_at = datetime.utcnow()
+        temporary = f"{path}.{os.getpid()}.tmp"
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        snapshot = sqlite3.connect(temporary)
+        try:
+            backup.online_copy(source, snapshot, pages=PAGES_PER_STEP)
+            # Readers open the snapshot read-only, which a WAL database does not allow.
+            snapshot.execute("PRAGMA journal_mode=DELETE")
+            for statement in REPORT_TABLES:
+                snapshot.execute(statement)
+            _add_archived_event_counts(snapshot)
+            snapshot.executemany(
+                "INSERT INTO report_meta (key, value) VALUES (?, ?)",
+                [("taken_at", taken_at.isoformat()), ("source", os.path.abspath(source))],
+            )
+            snapshot.commit()
+        except Exception:
+            snapshot.close()
+            os.remove(temporary)
+            raise
+        snapshot.close()
+        os.replace(temporary, path)
+    return {"taken_at": taken_at, "seconds": round(time.perf_counter() - began, 3)}
+
+
+def _add_archived_event_counts(snapshot: sqlite3.Connection) -> None:
+    counts: Counter = Counter()
+    for (path,) in snapshot.execute("SELECT path FROM event_segments"):
+        reader = archive.SegmentReader(path)
+        try:
+            for row in reader.rows(newest_first=False):
+                counts[(row["user_id"], row["event_type"], row["created_at"][:10])] += 1
+        finally:
+            reader.close()
+    if not counts:
+        return
+    usernames = dict(snapshot.execute("SELECT id, username FROM users"))
+    # Stored event types are enum names, which match their values.
+    snapshot.executemany(
+        "INSERT INTO report_event_counts VALUES (?, ?, ?, ?, ?)",
+        [
+            (user_id, usernames.get(user_id), event_type, day, count)
+            for (user_id, event_type, day), count in counts.items()
+        ],
+    )
+
+
+def snapshot_info(db: Session, now: Optional[datetime] = None) -> dict:
+    taken_at = datetime.fromisoformat(
+        db.execute(text("SELECT value FROM report_meta WHERE key = 'taken_at'")).scalar_one()
+    )
+    age = (now or datetime.utcnow()) - taken_at
+    return {"taken_at": taken_at, "age_seconds": int(age.total_seconds())}
+
+
+def snapshot_age(path: str = SNAPSHOT_PATH) -> Optional[float]:
+    if not os.path.exists(path):
+        return None
+    return time.time() - os.path.getmtime(path)
+
+
+def get_report_db():
+    if not os.path.exists(SNAPSHOT_PATH):
+        refresh_snapshot()
+    db = ReportSession()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def occupancy(db: Session) -> list[dict]:
+    rows = db.execute(
+        text(
+            """
+            SELECT freezer_id, freezer_name, COUNT(*) AS boxes,
+                   SUM(capacity) AS capacity, SUM(occupied) AS occupied
+            FROM report_box_occupancy
+            GROUP BY freezer_id, freezer_name
+            ORDER BY freezer_name
+            """
+        )
+    ).mappings()
+    return [
+        {**row, "percent": round(100 * row["occupied"] / row["capacity"], 1) if row["capacity"] else None}
+        for row in rows
+    ]
+
+
+def sample_type_histogram(db: Session, freezer_id: Optional[int] = None) -> list[dict]:
+    query = """
+        SELECT sample_type_id, sample_type, status, volume_units,
+               COUNT(*) AS samples, SUM(volume) AS volume
+        FROM report_samples
+        {where}
+        GROUP BY sample_type_id, sample_type, status, volume_units
+        ORDER BY samples DESC
+    """
+    if freezer_id is None:
+        rows = db.execute(text(query.format(where="")))
+    else:
+        rows = db.execute(text(query.format(where="WHERE freezer_id = :freezer_id")), {"freezer_id": freezer_id})
+    return [dict(row) for row in rows.mappings()]
+
+
+def event_counts(db: Session, since: Optional[str] = None) -> list[dict]:
+    rows = db.execute(
+        text(
+            """
+            SELECT user_id, username, event_type, SUM(count) AS events
+            FROM report_event_counts
+            WHERE :since IS NULL OR day >= :since
+            GROUP BY user_id, username, event_type
+            ORDER BY events DESC
+            """
+        ),
+        {"since": since},
+    ).mappings()
+    return [dict(row) for row in rows]
+
+
+class SnapshotRefresher:
+    def __init__(self, interval: float = REFRESH_SECONDS) -> None:
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="report-snapshot", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stopping = True
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopping:
+            age = snapshot_age()
+            wait = self.interval if age is None else self.interval - age
+            if wait <= 0:
+                try:
+                    refresh_snapshot()
+                except Exception:
+                    logger.exception("Reporting snapshot refresh failed")
+                wait = self.interval
+            self._wake.wait(wait)
+
+
+_refresher: Optional[SnapshotRefresher] = None
+
+
+def start_refresher() -> Optional[SnapshotRefresher]:
+    global _refresher
+    if ENABLED and _refresher is None:
+        _refresher = SnapshotRefresher()
+        _refresher.start()
+    return _refresher
+
+
+def stop_refresher() -> None:
+    global _refresher
+    if _refresher is not None:
+        _refresher.stop()
+        _refresher = None
@@ -1,17 +1,15 @@
 from __future__ import annotations
 
 from fastapi import APIRouter, Depends, Form, Request
-from fastapi.responses import RedirectResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import JSONResponse, RedirectResponse
 from sqlalchemy.orm import Session
 
-from app import crud, models
+from app import crud, jobs, models
 from app.db import get_db
+from app.templating import templates
 
 router = APIRouter()
 
-templates = Jinja2Templates(directory="app/templates")
-
 
 def get_current_user(request: Request, db: Session) -> None | models.User:
     username = request.session.get("username")
@@ -45,5 +43,7 @@ async def seed(request: Request, db: Session = Depends(get_db)):
     user = crud.get_user_by_username(db, "admin")
     if not user:
         user = crud.create_user(db, username="admin", full_name="Admin")
-    crud.seed_storage(db, user)
-    return RedirectResponse("/storage", status_code=303)
+    job = jobs.submit_job(db, "seed_storage", {}, user)
+    if "application/json" in request.headers.get("accept", ""):
+        return JSONResponse({"job_id": job.id, "status": job.status.value}, status_code=202)
+    return RedirectResponse(f"/jobs/{job.id}", status_code=303)
@@ -1,33 +1,83 @@
 from __future__ import annotations
 
+from typing import Optional
+
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import JSONResponse
-from fastapi.templating import Jinja2Templates
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from app import crud
+from app import archive, audit, crud, jobs, models
 from app.db import get_db
+from app.responses import FastJSONResponse
+from app.routes.auth import get_current_user
+from app.templating import templates
 
 router = APIRouter()
 
-templates = Jinja2Templates(directory="app/templates")
-
 
 @router.get("/events")
-async def events_feed(request: Request, db: Session = Depends(get_db)):
-    events = crud.recent_events(db)
+def events_feed(request: Request, db: Session = Depends(get_db)):
     if "application/json" in request.headers.get("accept", ""):
-        return [
-            {
-                "id": event.id,
-                "event_type": event.event_type.value,
-                "sample_id": event.sample_id,
-                "from_position_id": event.from_position_id,
-                "to_position_id": event.to_position_id,
-                "created_at": event.created_at.isoformat(),
-            }
-            for event in events
-        ]
+        return FastJSONResponse(crud.recent_event_rows(db))
+    events = crud.recent_events(db)
     return templates.TemplateResponse(
         "events.html", {"request": request, "events": events}
     )
+
+
+@router.get("/changes")
+async def change_feed(since: int = 0, limit: int = 1000, db: Session = Depends(get_db)):
+    limit = max(1, min(limit, 10000))
+    return FastJSONResponse(crud.change_feed(db, since, limit))
+
+
+@router.post("/events/archive")
+async def archive_events(
+    request: Request,
+    before: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    user = get_current_user(request, db)
+    job = jobs.submit_job(db, "archive_events", {"before": before}, user)
+    return JSONResponse({"job_id": job.id, "status": job.status.value}, status_code=202)
+
+
+@router.get("/events/segments")
+async def event_segments(verify: bool = False, db: Session = Depends(get_db)):
+    if verify:
+        return archive.verify_segments(db)
+    segment = models.EventSegment
+    return FastJSONResponse(
+        [
+            dict(row._mapping)
+            for row in db.execute(
+                select(
+                    segment.id,
+                    segment.path,
+                    segment.codec,
+                    segment.event_count,
+                    segment.min_event_id,
+                    segment.max_event_id,
+                    segment.min_created_at,
+                    segment.max_created_at,
+                ).order_by(segment.min_event_id)
+            )
+        ]
+    )
+
+
+@router.post("/events/verify")
+async def verify_events(
+    request: Request,
+    full: bool = False,
+    db: Session = Depends(get_db),
+):
+    user = get_current_user(request, db)
+    job = jobs.submit_job(db, "verify_events", {"full": full}, user)
+    return JSONResponse({"job_id": job.id, "status": job.status.value}, status_code=202)
+
+
+@router.get("/events/checkpoints")
+async def audit_checkpoints(limit: int = 50, db: Session = Depends(get_db)):
+    return FastJSONResponse(audit.list_checkpoints(db, max(1, min(limit, 500))))
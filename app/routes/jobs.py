@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import asyncio
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, StreamingResponse
+from sqlalchemy.orm import Session
+
+from app import jobs, models, schemas
+from app.db import SessionLocal, get_db
+from app.routes.auth import get_current_user
+from app.templating import templates
+
+router = APIRouter()
+
+
+@router.get("/jobs")
+async def list_jobs(db: Session = Depends(get_db)):
+    return [schemas.JobRead.model_validate(job) for job in jobs.list_jobs(db)]
+
+
+@router.post("/jobs", status_code=202)
+async def submit_job(payload: schemas.JobCreate, request: Request, db: Session = Depends(get_db)):
+    user = get_current_user(request, db)
+    try:
+        params = jobs.user_params(payload.kind, payload.params)
+        job = jobs.submit_job(db, payload.kind, params, user)
+    except jobs.JobError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return schemas.JobRead.model_validate(job)
+
+
+@router.get("/jobs/{job_id}")
+async def job_detail(job_id: int, request: Request, db: Session = Depends(get_db)):
+    job = _get_job(db, job_id)
+    if "application/json" in request.headers.get("accept", ""):
+        return schemas.JobRead.model_validate(job)
+    template = "job_status.html" if request.headers.get("hx-request") else "job.html"
+    return templates.TemplateResponse(template, {"request": request, "job": job})
+
+
+@router.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: int, db: Session = Depends(get_db)):
+    _get_job(db, job_id)
+
+    async def events():
+        last = None
+        while True:
+            with SessionLocal() as session:
+                job = session.get(models.Job, job_id)
+                body = schemas.JobRead.model_validate(job).model_dump_json()
+                finished = job.finished
+            if body != last:
+                yield f"data: {body}\n\n"
+                last = body
+            if finished:
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@router.get("/jobs/{job_id}/result")
+def job_result(job_id: int, db: Session = Depends(get_db)):
+    job = _get_job(db, job_id)
+    if job.status != models.JobStatus.succeeded:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status.value}")
+    if job.result_path:
+        if not os.path.exists(job.result_path):
+            raise HTTPException(status_code=410, detail="Job output is no longer available")
+        return FileResponse(job.result_path, filename=os.path.basename(job.result_path))
+    return JSONResponse(job.result)
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int, request: Request, db: Session = Depends(get_db)):
+    job = jobs.cancel_job(db, _get_job(db, job_id))
+    if request.headers.get("content-type", "").startswith("application/json") or (
+        "application/json" in request.headers.get("accept", "")
+    ):
+        return schemas.JobRead.model_validate(job)
+    return RedirectResponse(f"/jobs/{job.id}", status_code=303)
+
+
+def _get_job(db: Session, job_id: int) -> models.Job:
+    job = db.get(models.Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
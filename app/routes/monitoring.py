@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import admission, backup, jobs, models, schemas, telemetry, trends
+from app.db import get_db
+from app.responses import FastJSONResponse
+from app.routes.auth import get_current_user
+
+router = APIRouter()
+
+
+@router.post("/telemetry/temperature", status_code=202)
+async def ingest_temperatures(payload: schemas.TemperatureBatch, db: Session = Depends(get_db)):
+    freezer_ids = {reading.freezer_id for reading in payload.readings}
+    known = set(
+        db.execute(
+            select(models.StorageNode.id).where(
+                models.StorageNode.id.in_(freezer_ids),
+                models.StorageNode.node_type == models.StorageNodeType.freezer,
+            )
+        ).scalars()
+    )
+    unknown = sorted(freezer_ids - known)
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown freezer ids: {unknown}")
+    try:
+        accepted = telemetry.ingest(
+            db,
+            [
+                (reading.freezer_id, reading.recorded_at, reading.temperature)
+                for reading in payload.readings
+            ],
+        )
+    except telemetry.TelemetryBufferFull as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "5"})
+    return {"accepted": accepted}
+
+
+@router.get("/freezers/{freezer_id}/temperature")
+async def temperature_series(
+    freezer_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resolution: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    freezer = db.get(models.StorageNode, freezer_id)
+    if not freezer or freezer.node_type != models.StorageNodeType.freezer:
+        raise HTTPException(status_code=404, detail="Freezer not found")
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(hours=24)
+    try:
+        series = telemetry.temperature_series(db, freezer_id, start, end, resolution)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return FastJSONResponse(series)
+
+
+@router.get("/storage/{node_id}/occupancy")
+def occupancy_trend(
+    node_id: int,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    db: Session = Depends(get_db),
+):
+    node = db.get(models.StorageNode, node_id)
+    if not node or node.node_type not in (models.StorageNodeType.freezer, models.StorageNodeType.box):
+        raise HTTPException(status_code=404, detail="Freezer or box not found")
+    start, end = _day_range(start, end)
+    return FastJSONResponse(
+        {"node_id": node_id, "points": trends.occupancy_trend(db, node_id, start, end)}
+    )
+
+
+@router.get("/activity")
+def activity_trend(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    freezer_id: Optional[int] = None,
+    box_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    event_type: Optional[list[str]] = Query(None),
+    db: Session = Depends(get_db),
+):
+    start, end = _day_range(start, end)
+    points = trends.activity_trend(db, start, end, freezer_id, box_id, user_id, event_type)
+    return FastJSONResponse({"points": points})
+
+
+@router.post("/activity/backfill")
+async def backfill_activity(request: Request, db: Session = Depends(get_db)):
+    user = get_current_user(request, db)
+    job = jobs.submit_job(db, "backfill_rollups", {}, user)
+    return JSONResponse({"job_id": job.id, "status": job.status.value}, status_code=202)
+
+
+@router.get("/admin/admission")
+async def admission_stats():
+    return admission.stats()
+
+
+@router.get("/admin/backups")
+async def list_backups():
+    return backup.load_manifest()
+
+
+@router.post("/admin/backups")
+async def start_backup(request: Request, kind: str = "auto", db: Session = Depends(get_db)):
+    if kind not in {"auto", "full", "incremental"}:
+        raise HTTPException(status_code=400, detail=f"Unknown backup kind '{kind}'")
+    user = get_current_user(request, db)
+    job = jobs.submit_job(db, "backup_database", {"kind": kind}, user)
+    return JSONResponse({"job_id": job.id, "status": job.status.value}, status_code=202)
+
+
+@router.post("/admin/backups/{backup_id}/verify")
+async def verify_backup(backup_id: str, request: Request, db: Session = Depends(get_db)):
+    if not any(entry["id"] == backup_id for entry in backup.load_manifest()["backups"]):
+        raise HTTPException(status_code=404, detail="Backup not found")
+    user = get_current_user(request, db)
+    job = jobs.submit_job(db, "verify_backup", {"backup_id": backup_id}, user)
+    return JSONResponse({"job_id": job.id, "status": job.status.value}, status_code=202)
+
+
+def _day_range(start: Optional[date], end: Optional[date]) -> tuple[date, date]:
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=90)
+    if start > end or (end - start).days > 3660:
+        raise HTTPException(status_code=400, detail="Use a range of at most ten years")
+    return start, end
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import JSONResponse, RedirectResponse
+from sqlalchemy.orm import Session
+
+from app import jobs, reporting
+from app.db import get_db
+from app.responses import FastJSONResponse
+from app.routes.auth import get_current_user
+from app.templating import templates
+
+router = APIRouter()
+
+
+def _report(db: Session, **data) -> FastJSONResponse:
+    snapshot = reporting.snapshot_info(db)
+    response = FastJSONResponse({"snapshot": snapshot, **data})
+    response.headers["X-Snapshot-Age"] = str(snapshot["age_seconds"])
+    return response
+
+
+@router.get("/reports")
+def reports(request: Request, db: Session = Depends(reporting.get_report_db)):
+    context = {
+        "occupancy": reporting.occupancy(db),
+        "sample_types": reporting.sample_type_histogram(db),
+        "events": reporting.event_counts(db),
+    }
+    if "application/json" in request.headers.get("accept", ""):
+        return _report(db, **context)
+    return templates.TemplateResponse(
+        "reports.html", {"request": request, "snapshot": reporting.snapshot_info(db), **context}
+    )
+
+
+@router.get("/reports/occupancy")
+def occupancy_report(db: Session = Depends(reporting.get_report_db)):
+    return _report(db, freezers=reporting.occupancy(db))
+
+
+@router.get("/reports/sample-types")
+def sample_type_report(
+    freezer_id: Optional[int] = None, db: Session = Depends(reporting.get_report_db)
+):
+    return _report(db, sample_types=reporting.sample_type_histogram(db, freezer_id))
+
+
+@router.get("/reports/events")
+def event_report(since: Optional[str] = None, db: Session = Depends(reporting.get_report_db)):
+    return _report(db, events=reporting.event_counts(db, since))
+
+
+@router.get("/reports/snapshot")
+async def snapshot_status(db: Session = Depends(reporting.get_report_db)):
+    return _report(db)
+
+
+@router.post("/reports/refresh")
+async def refresh_reports(request: Request, db: Session = Depends(get_db)):
+    user = get_current_user(request, db)
+    job = jobs.submit_job(db, "refresh_report_snapshot", {}, user)
+    if "application/json" in request.headers.get("accept", ""):
+        return JSONResponse({"job_id": job.id, "status": job.status.value}, status_code=202)
+    return RedirectResponse(f"/jobs/{job.id}", status_code=303)
@@ -1,25 +1,26 @@
 from __future__ import annotations
 
 from collections import defaultdict
+from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import JSONResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from app import crud, models, schemas
+from app import crud, expiry, jobs, labels, models, schemas, writer
 from app.db import get_db
+from app.responses import FastJSONResponse
 from app.routes.auth import get_current_user
+from app.routes.storage import resolve_position
+from app.templating import templates
 
 router = APIRouter()
 
-templates = Jinja2Templates(directory="app/templates")
-
 
 @router.get("/dashboard")
-async def dashboard(request: Request, db: Session = Depends(get_db)):
+def dashboard(request: Request, db: Session = Depends(get_db)):
     sample_count = db.execute(select(models.Sample)).scalars().all()
     status_counts = defaultdict(int)
     for sample in sample_count:
@@ -46,40 +47,70 @@ async def dashboard(request: Request, db: Session = Depends(get_db)):
 
 
 @router.get("/samples", response_model=None)
-async def list_samples(
+def list_samples(
     request: Request,
     q: Optional[str] = None,
     status: Optional[str] = None,
-    sample_type_id: Optional[int] = None,
+    sample_type_id: Optional[str] = None,
+    freezer_id: Optional[str] = None,
+    placed: Optional[str] = None,
+    attr: list[str] = Query([]),
     sort: str = "sample_id",
+    facets: bool = False,
     db: Session = Depends(get_db),
 ):
-    samples = crud.list_samples(db, q, status, sample_type_id, sort)
-    sample_types = db.execute(select(models.SampleType)).scalars().all()
+    filters = _sample_filters(q, status, sample_type_id, freezer_id, placed, attr)
     if "application/json" in request.headers.get("accept", ""):
-        return [schemas.SampleRead.model_validate(sample) for sample in samples]
+        rows = crud.list_sample_rows(db, sort=sort, **filters)
+        if facets:
+            counts = crud.sample_facets(db, **filters)
+            return FastJSONResponse({"results": rows, "facets": _facet_payload(db, counts)})
+        return FastJSONResponse(rows)
+    samples = crud.list_samples(db, sort=sort, **filters)
+    sample_types = db.execute(select(models.SampleType)).scalars().all()
+    freezers = _freezers(db)
     return templates.TemplateResponse(
         "samples_list.html",
         {
             "request": request,
             "samples": samples,
             "sample_types": sample_types,
+            "freezers": freezers,
+            "facets": crud.sample_facets(db, **filters),
             "filters": {
                 "q": q or "",
                 "status": status or "",
-                "sample_type_id": sample_type_id,
+                "sample_type_id": filters["sample_type_id"],
+                "freezer_id": filters["freezer_id"],
+                "placed": placed or "",
+                "attr": "; ".join(attr),
                 "sort": sort,
             },
         },
     )
 
 
+@router.get("/samples/facets")
+def sample_facets(
+    q: Optional[str] = None,
+    status: Optional[str] = None,
+    sample_type_id: Optional[str] = None,
+    freezer_id: Optional[str] = None,
+    placed: Optional[str] = None,
+    attr: list[str] = Query([]),
+    db: Session = Depends(get_db),
+):
+    filters = _sample_filters(q, status, sample_type_id, freezer_id, placed, attr)
+    return FastJSONResponse(_facet_payload(db, crud.sample_facets(db, **filters)))
+
+
 @router.get("/samples/new")
 async def new_sample(request: Request, db: Session = Depends(get_db)):
     sample_types = db.execute(select(models.SampleType)).scalars().all()
+    id_sequences = db.execute(select(models.IdSequence).order_by(models.IdSequence.name)).scalars().all()
     return templates.TemplateResponse(
         "samples_form.html",
-        {"request": request, "sample": None, "sample_types": sample_types},
+        {"request": request, "sample": None, "sample_types": sample_types, "id_sequences": id_sequences},
     )
 
 
@@ -89,19 +120,23 @@ async def create_sample(request: Request, db: Session = Depends(get_db)):
     if request.headers.get("content-type", "").startswith("application/json"):
         payload = await request.json()
         data = schemas.SampleCreate(**payload).model_dump()
-        sample = crud.create_sample(db, data, user)
+        sample = await writer.execute(db, crud.create_sample, data, user)
         return schemas.SampleRead.model_validate(sample)
     form = await request.form()
     data = {
-        "sample_id": form.get("sample_id"),
+        "sample_id": form.get("sample_id") or None,
+        "id_sequence": form.get("id_sequence") or None,
         "name": form.get("name"),
         "status": form.get("status", "active"),
         "volume": float(form.get("volume")) if form.get("volume") else None,
         "volume_units": form.get("volume_units"),
         "sample_type_id": int(form.get("sample_type_id")) if form.get("sample_type_id") else None,
         "notes": form.get("notes"),
+        "expires_at": _form_date(form.get("expires_at")),
+        "retain_until": _form_date(form.get("retain_until")),
+        "attributes": _form_attributes(form.get("attributes")),
     }
-    sample = crud.create_sample(db, data, user)
+    sample = await writer.execute(db, crud.create_sample, data, user)
     return RedirectResponse(f"/samples/{sample.id}", status_code=303)
 
 
@@ -115,15 +150,7 @@ async def sample_detail(sample_id: int, request: Request, db: Session = Depends(
         location_path = crud.storage_path_for_position(sample.location.position)
     if "application/json" in request.headers.get("accept", ""):
         return schemas.SampleRead.model_validate(sample)
-    events = (
-        db.execute(
-            select(models.Event)
-            .where(models.Event.sample_id == sample.id)
-            .order_by(models.Event.created_at.desc())
-        )
-        .scalars()
-        .all()
-    )
+    events = crud.sample_events(db, sample.id)
     return templates.TemplateResponse(
         "samples_detail.html",
         {
@@ -131,6 +158,7 @@ async def sample_detail(sample_id: int, request: Request, db: Session = Depends(
             "sample": sample,
             "location_path": location_path,
             "events": events,
+            "volume_history": crud.volume_history(db, sample.id),
         },
     )
 
@@ -165,8 +193,15 @@ async def update_sample(
         "volume_units": form.get("volume_units"),
         "sample_type_id": int(form.get("sample_type_id")) if form.get("sample_type_id") else None,
         "notes": form.get("notes"),
+        "expires_at": _form_date(form.get("expires_at")),
+        "retain_until": _form_date(form.get("retain_until")),
+        # The form shows every attribute, so lines left out are removed.
+        "attributes": {
+            **{name: None for name in sample.attributes},
+            **_form_attributes(form.get("attributes")),
+        },
     }
-    crud.update_sample(db, sample, data, user)
+    await writer.execute(db, crud.update_sample, sample, data, user)
     return RedirectResponse(f"/samples/{sample.id}", status_code=303)
 
 
@@ -181,7 +216,9 @@ async def update_sample_api(
     if not sample:
         raise HTTPException(status_code=404, detail="Sample not found")
     user = get_current_user(request, db)
-    updated = crud.update_sample(db, sample, payload.model_dump(exclude_unset=True), user)
+    updated = await writer.execute(
+        db, crud.update_sample, sample, payload.model_dump(exclude_unset=True), user
+    )
     return schemas.SampleRead.model_validate(updated)
 
 
@@ -194,15 +231,19 @@ async def place_sample(
     sample = db.get(models.Sample, sample_id)
     if request.headers.get("content-type", "").startswith("application/json"):
         payload = await request.json()
-        position_id = payload.get("position_id")
     else:
-        form = await request.form()
-        position_id = form.get("position_id")
-    position = db.get(models.StoragePosition, int(position_id) if position_id else None)
+        payload = await request.form()
+    position = await resolve_position(
+        db,
+        payload.get("position_id"),
+        payload.get("box_id"),
+        payload.get("row"),
+        payload.get("col"),
+    )
     if not sample or not position:
         raise HTTPException(status_code=404, detail="Sample or position not found")
     user = get_current_user(request, db)
-    crud.place_or_move_sample(db, sample, position, user)
+    await writer.execute(db, crud.place_or_move_sample, sample, position, user)
     if request.headers.get("content-type", "").startswith("application/json"):
         return JSONResponse({"status": "ok"})
     return RedirectResponse(f"/samples/{sample.id}", status_code=303)
@@ -225,12 +266,66 @@ async def move_sample(
     if not sample or not position:
         raise HTTPException(status_code=404, detail="Sample or position not found")
     user = get_current_user(request, db)
-    crud.move_sample(db, sample, position, user)
+    await writer.execute(db, crud.move_sample, sample, position, user)
     if request.headers.get("content-type", "").startswith("application/json"):
         return JSONResponse({"status": "ok"})
     return RedirectResponse(f"/samples/{sample.id}", status_code=303)
 
 
+@router.post("/samples/{sample_id}/volume")
+async def change_volume(
+    sample_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    sample = db.get(models.Sample, sample_id)
+    if not sample:
+        raise HTTPException(status_code=404, detail="Sample not found")
+    user = get_current_user(request, db)
+    is_json = request.headers.get("content-type", "").startswith("application/json")
+    if is_json:
+        payload = schemas.VolumeChangeRequest(**(await request.json()))
+    else:
+        form = await request.form()
+        payload = schemas.VolumeChangeRequest(
+            delta=-float(form.get("amount") or 0),
+            note=form.get("note") or None,
+        )
+    transaction = await writer.execute(
+        db,
+        crud.record_volume_change,
+        sample,
+        payload.delta,
+        payload.reason,
+        user,
+        payload.note,
+    )
+    if is_json:
+        return schemas.VolumeTransactionRead.model_validate(transaction)
+    return RedirectResponse(f"/samples/{sample.id}", status_code=303)
+
+
+@router.get("/samples/{sample_id}/volume")
+async def volume_history(sample_id: int, db: Session = Depends(get_db)):
+    if not db.get(models.Sample, sample_id):
+        raise HTTPException(status_code=404, detail="Sample not found")
+    return [
+        schemas.VolumeTransactionRead.model_validate(entry)
+        for entry in crud.volume_history(db, sample_id)
+    ]
+
+
+@router.get("/volumes")
+def volume_rollups(
+    sample_type_id: Optional[int] = None,
+    freezer_id: Optional[int] = None,
+    volume_units: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    rollups = crud.volume_rollups(db, sample_type_id, freezer_id, volume_units)
+    return [schemas.VolumeRollupRead.model_validate(rollup) for rollup in rollups]
+
+
 def _freezer_for_position(position: models.StoragePosition) -> str:
     node = position.box
     while node.parent is not None:
@@ -240,3 +335,210 @@ def _freezer_for_position(position: models.StoragePosition) -> str:
     if node.node_type == models.StorageNodeType.freezer:
         return node.name
     return "Unknown"
+
+
+@router.post("/samples/{sample_id}/aliquots")
+async def create_aliquots(
+    sample_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    parent = db.get(models.Sample, sample_id)
+    if not parent:
+        raise HTTPException(status_code=404, detail="Sample not found")
+    is_json = request.headers.get("content-type", "").startswith("application/json")
+    if is_json:
+        payload = schemas.AliquotCreate(**(await request.json()))
+    else:
+        form = await request.form()
+        payload = schemas.AliquotCreate(
+            count=int(form.get("count") or 0),
+            volume=float(form.get("volume")) if form.get("volume") else None,
+            volume_units=form.get("volume_units") or None,
+        )
+    user = get_current_user(request, db)
+    data = payload.model_dump(exclude={"count"})
+    ids = await writer.execute(db, crud.create_aliquots, parent, payload.count, data, user)
+    if is_json:
+        return JSONResponse({"parent_id": parent.id, "ids": ids})
+    return RedirectResponse(f"/samples/{parent.id}", status_code=303)
+
+
+@router.get("/sample-types")
+async def list_sample_types(db: Session = Depends(get_db)):
+    sample_types = db.execute(select(models.SampleType).order_by(models.SampleType.name)).scalars()
+    return [schemas.SampleTypeRead.model_validate(sample_type) for sample_type in sample_types]
+
+
+@router.post("/sample-types", status_code=201)
+async def create_sample_type(payload: schemas.SampleTypeCreate, db: Session = Depends(get_db)):
+    sample_type = await writer.execute(
+        db,
+        crud.create_sample_type,
+        payload.name,
+        payload.description,
+        [field.model_dump() for field in payload.attribute_schema],
+    )
+    return schemas.SampleTypeRead.model_validate(sample_type)
+
+
+@router.put("/sample-types/{sample_type_id}/attributes")
+async def set_attribute_schema(
+    sample_type_id: int,
+    payload: schemas.AttributeSchemaUpdate,
+    db: Session = Depends(get_db),
+):
+    sample_type = db.get(models.SampleType, sample_type_id)
+    if not sample_type:
+        raise HTTPException(status_code=404, detail="Sample type not found")
+    return await writer.execute(
+        db,
+        crud.set_attribute_schema,
+        sample_type,
+        [field.model_dump() for field in payload.attribute_schema],
+    )
+
+
+@router.get("/id-sequences")
+async def list_id_sequences(db: Session = Depends(get_db)):
+    sequences = db.execute(select(models.IdSequence).order_by(models.IdSequence.name)).scalars()
+    return [schemas.IdSequenceRead.model_validate(sequence) for sequence in sequences]
+
+
+@router.post("/id-sequences", status_code=201)
+async def create_id_sequence(payload: schemas.IdSequenceCreate, db: Session = Depends(get_db)):
+    sequence = await writer.execute(db, crud.create_id_sequence, **payload.model_dump())
+    return schemas.IdSequenceRead.model_validate(sequence)
+
+
+@router.post("/id-sequences/{name}/allocate")
+async def allocate_ids(name: str, payload: schemas.IdAllocationRequest, db: Session = Depends(get_db)):
+    ids = await writer.execute(db, crud.allocate_ids, name, payload.count)
+    return {"sequence": name, "count": len(ids), "first": ids[0], "last": ids[-1], "ids": ids}
+
+
+@router.get("/expirations")
+def upcoming_expirations(
+    days: int = 30,
+    freezer_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    return FastJSONResponse(
+        {"days": days, "freezers": expiry.upcoming(db, days=days, freezer_id=freezer_id)}
+    )
+
+
+@router.post("/expirations/sweep", status_code=202)
+async def sweep_expirations(request: Request, db: Session = Depends(get_db)):
+    user = get_current_user(request, db)
+    job = jobs.submit_job(db, "expiry_sweep", {}, user)
+    return {"job_id": job.id}
+
+
+@router.post("/labels")
+def print_labels(payload: schemas.LabelRequest, request: Request, db: Session = Depends(get_db)):
+    """Barcode labels for a sample selection, streamed as PDF or ZPL."""
+    if payload.format not in labels.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(labels.FORMATS)}")
+    selection = payload.model_dump(exclude={"format", "background"}, exclude_none=True)
+    if not selection:
+        raise HTTPException(status_code=400, detail="Select samples by id or filter")
+    if payload.background:
+        user = get_current_user(request, db)
+        job = jobs.submit_job(db, "render_labels", {"format": payload.format, **selection}, user)
+        return JSONResponse({"job_id": job.id, "status": job.status.value}, status_code=202)
+    rows = labels.label_rows(db, **selection)
+    return StreamingResponse(
+        labels.render(rows, payload.format),
+        media_type=labels.FORMATS[payload.format],
+        headers={
+            "Content-Disposition": f'attachment; filename="labels.{payload.format}"',
+            "X-Label-Count": str(len(rows)),
+        },
+    )
+
+
+@router.get("/samples/{sample_id}/lineage")
+async def sample_lineage(
+    sample_id: int,
+    direction: str = "descendants",
+    max_depth: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    if not db.get(models.Sample, sample_id):
+        raise HTTPException(status_code=404, detail="Sample not found")
+    if direction == "ancestors":
+        rows = crud.sample_ancestors(db, sample_id)
+    elif direction == "descendants":
+        rows = crud.sample_descendants(db, sample_id, max_depth)
+    else:
+        raise HTTPException(status_code=400, detail="direction must be ancestors or descendants")
+    return FastJSONResponse({"sample_id": sample_id, "direction": direction, "samples": rows})
+
+
+def _form_date(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _sample_filters(q, status, sample_type_id, freezer_id, placed, attr=()) -> dict:
+    # Filter forms submit empty strings for "All", so parse leniently.
+    return {
+        "query": q or None,
+        "status": status or None,
+        "sample_type_id": _optional_int("sample_type_id", sample_type_id),
+        "freezer_id": _optional_int("freezer_id", freezer_id),
+        "placed": {"placed": True, "unplaced": False}.get(placed or ""),
+        # The list form sends its attribute filters as one "a>1; b=x" field.
+        "attributes": [part.strip() for value in attr for part in value.split(";") if part.strip()] or None,
+    }
+
+
+def _optional_int(name: str, value) -> Optional[int]:
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an integer")
+
+
+def _form_attributes(value: Optional[str]) -> dict:
+    attributes = {}
+    for line in (value or "").splitlines():
+        if line.strip():
+            name, _, text = line.partition("=")
+            attributes[name.strip()] = text.strip()
+    return attributes
+
+
+def _freezers(db: Session) -> list[models.StorageNode]:
+    return list(
+        db.execute(
+            select(models.StorageNode)
+            .where(models.StorageNode.node_type == models.StorageNodeType.freezer)
+            .order_by(models.StorageNode.name)
+        ).scalars()
+    )
+
+
+def _facet_payload(db: Session, counts: dict) -> dict:
+    type_names = dict(db.execute(select(models.SampleType.id, models.SampleType.name)).all())
+    freezer_names = {freezer.id: freezer.name for freezer in _freezers(db)}
+    return {
+        "total": counts["total"],
+        "status": [
+            {"value": value, "count": count} for value, count in counts["status"].items()
+        ],
+        "sample_type": [
+            {"value": value, "label": type_names.get(value), "count": count}
+            for value, count in counts["sample_type"].items()
+        ],
+        "freezer": [
+            {"value": value, "label": freezer_names.get(value), "count": count}
+            for value, count in counts["freezer"].items()
+        ],
+        "placed": [
+            {"value": "placed" if value else "unplaced", "count": count}
+            for value, count in counts["placed"].items()
+        ],
+    }
@@ -1,18 +1,39 @@
 from __future__ import annotations
 
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import JSONResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
+import hashlib
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, RedirectResponse, Response
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from app import crud, models
+from app import crud, jobs, models, schemas, writer
 from app.db import get_db
+from app.responses import FastJSONResponse
 from app.routes.auth import get_current_user
+from app.templating import templates
 
 router = APIRouter()
 
-templates = Jinja2Templates(directory="app/templates")
+# Plans with more moves than this run as an ``apply_moves`` job instead.
+INLINE_MOVES = int(os.environ.get("FREEZER_INLINE_MOVES", "2000"))
+
+
+def _apply_moves(
+    db: Session, moves: list[dict], user, batch_size: int, background: bool
+) -> Optional[JSONResponse]:
+    """Queue large or background plans as a job; return None to apply inline.
+
+    Inline plans are applied as one batch, so a 409 means nothing was moved.
+    """
+    if not background and len(moves) <= INLINE_MOVES:
+        return None
+    job = jobs.submit_job(
+        db, "apply_moves", {"moves": moves, "batch_size": batch_size}, user
+    )
+    return JSONResponse({"job_id": job.id, "status": job.status.value}, status_code=202)
 
 
 @router.get("/storage")
@@ -57,8 +78,9 @@ async def create_storage_node(
         parent_id = form.get("parent_id")
     parent_id = int(parent_id) if parent_id else None
     user = get_current_user(request, db)
-    node = crud.create_storage_node(
+    node = await writer.execute(
         db,
+        crud.create_storage_node,
         name=name,
         node_type=models.StorageNodeType(node_type),
         parent_id=parent_id,
@@ -79,52 +101,104 @@ async def create_box(
         box_id = payload.get("box_id")
         rows = payload.get("rows")
         cols = payload.get("cols")
+        label_scheme = payload.get("label_scheme")
+        materialize = bool(payload.get("materialize", True))
+        background = bool(payload.get("background"))
     else:
         form = await request.form()
         box_id = form.get("box_id")
         rows = form.get("rows")
         cols = form.get("cols")
+        label_scheme = form.get("label_scheme")
+        materialize = not form.get("lazy")
+        background = False
     box_id = int(box_id)
     rows = int(rows)
     cols = int(cols)
+    label_scheme = models.LabelScheme(label_scheme or models.LabelScheme.alpha_numeric)
     user = get_current_user(request, db)
-    crud.create_box_positions(db, box_id, rows, cols, user)
+    if background:
+        params = {
+            "box_id": box_id,
+            "rows": rows,
+            "cols": cols,
+            "materialize": materialize,
+            "label_scheme": label_scheme.value,
+        }
+        job = jobs.submit_job(db, "create_box_positions", params, user)
+        return JSONResponse({"job_id": job.id, "status": job.status.value}, status_code=202)
+    await writer.execute(
+        db,
+        crud.create_box_positions,
+        box_id,
+        rows,
+        cols,
+        user,
+        materialize=materialize,
+        label_scheme=label_scheme,
+    )
     if request.headers.get("content-type", "").startswith("application/json"):
         return JSONResponse({"status": "ok"})
     return RedirectResponse(f"/boxes/{box_id}", status_code=303)
 
 
+@router.get("/layouts")
+async def list_layouts(db: Session = Depends(get_db)):
+    layouts = db.execute(select(models.BoxLayout).order_by(models.BoxLayout.name)).scalars()
+    return [schemas.BoxLayoutRead.model_validate(layout) for layout in layouts]
+
+
+@router.post("/layouts")
+async def create_layout(payload: schemas.BoxLayoutCreate, db: Session = Depends(get_db)):
+    layout = await writer.execute(
+        db,
+        crud.create_box_layout,
+        payload.name,
+        payload.rows,
+        payload.cols,
+        models.LabelScheme(payload.label_scheme),
+    )
+    return schemas.BoxLayoutRead.model_validate(layout)
+
+
+@router.post("/boxes/{box_id}/layout")
+async def assign_layout(
+    box_id: int,
+    payload: schemas.AssignLayoutRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    layout = db.get(models.BoxLayout, payload.layout_id)
+    if not layout:
+        raise HTTPException(status_code=404, detail="Layout not found")
+    user = get_current_user(request, db)
+    created = await writer.execute(
+        db, crud.assign_box_layout, box_id, layout, user, payload.materialize
+    )
+    return JSONResponse({"status": "ok", "positions": created})
+
+
 @router.get("/boxes/{box_id}")
 async def box_view(
     box_id: int,
     request: Request,
+    format: Optional[str] = None,
     db: Session = Depends(get_db),
 ):
     box = db.get(models.StorageNode, box_id)
     if not box or box.node_type != models.StorageNodeType.box:
         raise HTTPException(status_code=404, detail="Box not found")
-    positions = (
-        db.execute(
-            select(models.StoragePosition)
-            .where(models.StoragePosition.box_id == box_id)
-            .order_by(models.StoragePosition.row, models.StoragePosition.col)
-        )
-        .scalars()
-        .all()
-    )
-    samples = db.execute(select(models.Sample)).scalars().all()
+    if format == "grid":
+        known = _if_none_match(request)
+        grids = crud.box_grids(db, box_ids=[box.id], known_etags=known)
+        etag = grids["boxes"][0]["etag"]
+        if etag in known:
+            return Response(status_code=304, headers={"ETag": etag})
+        return FastJSONResponse(grids, headers={"ETag": etag})
     if "application/json" in request.headers.get("accept", ""):
-        return [
-            {
-                "id": position.id,
-                "label": position.label,
-                "row": position.row,
-                "col": position.col,
-                "occupied": position.location is not None,
-                "sample_id": position.location.sample_id if position.location else None,
-            }
-            for position in positions
-        ]
+        return FastJSONResponse(crud.box_cell_rows(db, box))
+    positions = crud.box_cells(db, box)
+    samples = db.execute(select(models.Sample)).scalars().all()
     return templates.TemplateResponse(
         "box.html",
         {
@@ -136,6 +210,33 @@ async def box_view(
     )
 
 
+@router.get("/storage/{node_id}/grids")
+def storage_grids(node_id: int, request: Request, db: Session = Depends(get_db)):
+    """Compact grids for every box in a freezer, rack or shelf.
+
+    ``If-None-Match`` may list per-box ETags from an earlier response; those
+    boxes come back marked ``unchanged`` without a grid.
+    """
+    node = db.get(models.StorageNode, node_id)
+    if not node:
+        raise HTTPException(status_code=404, detail="Storage node not found")
+    known = _if_none_match(request)
+    grids = crud.box_grids(db, under=node, known_etags=known)
+    etag = '"{}"'.format(
+        hashlib.blake2b(
+            " ".join(box["etag"] for box in grids["boxes"]).encode(), digest_size=8
+        ).hexdigest()
+    )
+    if etag in known:
+        return Response(status_code=304, headers={"ETag": etag})
+    return FastJSONResponse(grids, headers={"ETag": etag})
+
+
+def _if_none_match(request: Request) -> frozenset:
+    header = request.headers.get("if-none-match", "")
+    return frozenset(tag.strip().removeprefix("W/") for tag in header.split(",") if tag.strip())
+
+
 @router.post("/boxes/{box_id}/place")
 async def place_from_box(
     box_id: int,
@@ -144,18 +245,197 @@ async def place_from_box(
 ):
     if request.headers.get("content-type", "").startswith("application/json"):
         payload = await request.json()
-        sample_id = payload.get("sample_id")
-        position_id = payload.get("position_id")
     else:
-        form = await request.form()
-        sample_id = form.get("sample_id")
-        position_id = form.get("position_id")
+        payload = await request.form()
+    sample_id = payload.get("sample_id")
     sample = db.get(models.Sample, int(sample_id) if sample_id else None)
-    position = db.get(models.StoragePosition, int(position_id) if position_id else None)
+    position = await resolve_position(
+        db,
+        payload.get("position_id"),
+        box_id,
+        payload.get("row"),
+        payload.get("col"),
+    )
     if not sample or not position:
         raise HTTPException(status_code=404, detail="Sample or position not found")
     user = get_current_user(request, db)
-    crud.place_or_move_sample(db, sample, position, user)
+    await writer.execute(db, crud.place_or_move_sample, sample, position, user)
     if request.headers.get("content-type", "").startswith("application/json"):
         return JSONResponse({"status": "ok"})
     return RedirectResponse(f"/boxes/{box_id}", status_code=303)
+
+
+async def resolve_position(
+    db: Session,
+    position_id,
+    box_id=None,
+    row=None,
+    col=None,
+) -> Optional[models.StoragePosition]:
+    if position_id:
+        return db.get(models.StoragePosition, int(position_id))
+    if box_id and row and col:
+        return await writer.execute(
+            db, crud.ensure_position, int(box_id), int(row), int(col)
+        )
+    return None
+
+
+@router.post("/storage/{node_id}/relocate")
+async def relocate_node(
+    node_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    is_json = request.headers.get("content-type", "").startswith("application/json")
+    if is_json:
+        payload = schemas.RelocateRequest(**(await request.json()))
+    else:
+        form = await request.form()
+        payload = schemas.RelocateRequest(
+            parent_id=int(form.get("parent_id")) if form.get("parent_id") else None,
+            sample_events=bool(form.get("sample_events")),
+        )
+    node = db.get(models.StorageNode, node_id)
+    parent = db.get(models.StorageNode, payload.parent_id) if payload.parent_id else None
+    if not node or (payload.parent_id and not parent):
+        raise HTTPException(status_code=404, detail="Storage node not found")
+    user = get_current_user(request, db)
+    summary = await writer.execute(
+        db, crud.relocate_storage_node, node, parent, user, payload.sample_events
+    )
+    if is_json:
+        return JSONResponse(summary)
+    return RedirectResponse(f"/storage#node-{node_id}", status_code=303)
+
+
+@router.get("/storage/{node_id}/consolidation")
+def consolidation_plan(
+    node_id: int,
+    group_by: Optional[str] = "sample_type",
+    db: Session = Depends(get_db),
+):
+    from app import planning
+
+    node = db.get(models.StorageNode, node_id)
+    if not node:
+        raise HTTPException(status_code=404, detail="Storage node not found")
+    try:
+        plan = planning.plan_consolidation(db, node_id, group_by or None)
+    except crud.StorageError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return {
+        "node_id": plan.node_id,
+        "group_by": plan.group_by,
+        "boxes_considered": plan.boxes_considered,
+        "boxes_freed": plan.boxes_freed,
+        "mixed_boxes": plan.mixed_boxes,
+        "moves": [vars(move) for move in plan.moves],
+    }
+
+
+@router.post("/storage/{node_id}/consolidate")
+def consolidate(
+    node_id: int,
+    payload: schemas.ConsolidationRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    from app import planning
+
+    node = db.get(models.StorageNode, node_id)
+    if not node:
+        raise HTTPException(status_code=404, detail="Storage node not found")
+    user = get_current_user(request, db)
+    try:
+        plan = planning.plan_consolidation(db, node_id, payload.group_by)
+    except crud.StorageError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    moves = plan.as_moves()
+    queued = _apply_moves(db, moves, user, payload.batch_size, payload.background)
+    if queued is not None:
+        return queued
+    try:
+        moved = writer.run(db, crud.apply_moves, moves, user, max(len(moves), 1))
+    except (crud.StorageError, crud.SampleError) as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    return JSONResponse({"moved": moved, "boxes_freed": plan.boxes_freed})
+
+
+@router.get("/storage/{node_id}/evacuation")
+def evacuation_plan(
+    node_id: int,
+    request: Request,
+    freezer_ids: list[int] = Query([]),
+    db: Session = Depends(get_db),
+):
+    """Pick/put list for emptying a failing freezer; printable as HTML."""
+    from app import planning
+
+    node = db.get(models.StorageNode, node_id)
+    if not node:
+        raise HTTPException(status_code=404, detail="Storage node not found")
+    plan = planning.plan_evacuation(db, node_id, freezer_ids or None)
+    summary = {
+        "node_id": plan.node_id,
+        "samples": plan.samples,
+        "source_boxes": plan.source_boxes,
+        "boxes_kept_together": plan.boxes_kept_together,
+        "boxes_split": plan.boxes_split,
+        "destination_boxes": plan.destination_boxes,
+        "destination_freezers": plan.destination_freezers,
+        "unplaced": plan.unplaced,
+    }
+    rows = planning.pick_list(db, plan)
+    if "application/json" in request.headers.get("accept", ""):
+        return FastJSONResponse({**summary, "moves": rows})
+    return templates.TemplateResponse(
+        "evacuation.html", {"request": request, "node": node, "plan": summary, "rows": rows}
+    )
+
+
+@router.post("/storage/{node_id}/evacuate")
+def evacuate(
+    node_id: int,
+    payload: schemas.EvacuationRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    from app import planning
+
+    node = db.get(models.StorageNode, node_id)
+    if not node:
+        raise HTTPException(status_code=404, detail="Storage node not found")
+    user = get_current_user(request, db)
+    if payload.background:
+        params = {
+            "node_id": node_id,
+            "freezer_ids": payload.freezer_ids,
+            "batch_size": payload.batch_size,
+        }
+        job = jobs.submit_job(db, "evacuate_storage", params, user)
+        return JSONResponse({"job_id": job.id, "status": job.status.value}, status_code=202)
+    try:
+        plan = planning.plan_evacuation(db, node_id, payload.freezer_ids)
+        moved = crud.apply_moves(db, plan.as_moves(), user, payload.batch_size)
+    except (crud.StorageError, crud.SampleError) as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    return JSONResponse({"moved": moved, "unplaced": plan.unplaced})
+
+
+@router.post("/storage/moves")
+def bulk_move(
+    payload: schemas.BulkMoveRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    user = get_current_user(request, db)
+    moves = [move.model_dump() for move in payload.moves]
+    queued = _apply_moves(db, moves, user, payload.batch_size, payload.background)
+    if queued is not None:
+        return queued
+    try:
+        moved = writer.run(db, crud.apply_moves, moves, user, max(len(moves), 1))
+    except (crud.StorageError, crud.SampleError) as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    return JSONResponse({"moved": moved})
@@ -1,9 +1,9 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Optional
+from typing import Any, Literal, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 
 class UserBase(BaseModel):
@@ -23,15 +23,29 @@ class UserRead(UserBase):
         from_attributes = True
 
 
+class AttributeField(BaseModel):
+    name: str
+    type: str
+    required: bool = False
+    indexed: bool = False
+    unit: Optional[str] = None
+    choices: Optional[list[str]] = None
+
+
 class SampleTypeBase(BaseModel):
     name: str
     description: Optional[str] = None
+    attribute_schema: list[AttributeField] = []
 
 
 class SampleTypeCreate(SampleTypeBase):
     pass
 
 
+class AttributeSchemaUpdate(BaseModel):
+    attribute_schema: list[AttributeField]
+
+
 class SampleTypeRead(SampleTypeBase):
     id: int
 
@@ -47,10 +61,30 @@ class SampleBase(BaseModel):
     volume_units: Optional[str] = None
     sample_type_id: Optional[int] = None
     notes: Optional[str] = None
+    parent_id: Optional[int] = None
+    expires_at: Optional[datetime] = None
+    retain_until: Optional[datetime] = None
+    attributes: dict[str, Any] = {}
 
 
 class SampleCreate(SampleBase):
-    pass
+    sample_id: Optional[str] = None
+    id_sequence: Optional[str] = None
+
+
+class AliquotCreate(BaseModel):
+    count: int = Field(..., ge=1, le=10000)
+    sample_ids: Optional[list[str]] = None
+    id_sequence: Optional[str] = None
+    name: Optional[str] = None
+    status: Optional[str] = None
+    volume: Optional[float] = None
+    volume_units: Optional[str] = None
+    sample_type_id: Optional[int] = None
+    notes: Optional[str] = None
+    expires_at: Optional[datetime] = None
+    retain_until: Optional[datetime] = None
+    attributes: Optional[dict[str, Any]] = None
 
 
 class SampleUpdate(BaseModel):
@@ -60,6 +94,9 @@ class SampleUpdate(BaseModel):
     volume_units: Optional[str] = None
     sample_type_id: Optional[int] = None
     notes: Optional[str] = None
+    expires_at: Optional[datetime] = None
+    retain_until: Optional[datetime] = None
+    attributes: Optional[dict[str, Any]] = None
 
 
 class SampleRead(SampleBase):
@@ -71,6 +108,104 @@ class SampleRead(SampleBase):
         from_attributes = True
 
 
+class IdSequenceCreate(BaseModel):
+    name: str
+    prefix: str = ""
+    format: str = "{prefix}{n:06d}"
+    start: int = Field(1, ge=0)
+
+
+class IdSequenceRead(BaseModel):
+    id: int
+    name: str
+    prefix: str
+    format: str
+    next_value: int
+
+    class Config:
+        from_attributes = True
+
+
+class IdAllocationRequest(BaseModel):
+    count: int = Field(1, ge=1, le=100000)
+
+
+class LabelRequest(BaseModel):
+    format: str = "pdf"
+    sample_ids: Optional[list[int]] = Field(None, max_length=100000)
+    query: Optional[str] = None
+    status: Optional[str] = None
+    sample_type_id: Optional[int] = None
+    freezer_id: Optional[int] = None
+    placed: Optional[bool] = None
+    attributes: Optional[list[str]] = None
+    background: bool = False
+
+
+class VolumeChangeRequest(BaseModel):
+    delta: float
+    reason: str = "withdrawal"
+    note: Optional[str] = None
+
+
+class VolumeTransactionRead(BaseModel):
+    id: int
+    sample_id: int
+    delta: float
+    volume_after: float
+    volume_units: Optional[str] = None
+    reason: str
+    note: Optional[str] = None
+    user_id: Optional[int] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class VolumeRollupRead(BaseModel):
+    sample_type_id: int
+    freezer_id: int
+    volume_units: str
+    total_volume: float
+    sample_count: int
+
+    class Config:
+        from_attributes = True
+
+
+class TemperatureReadingIn(BaseModel):
+    freezer_id: int
+    recorded_at: datetime
+    temperature: float
+
+
+class TemperatureBatch(BaseModel):
+    readings: list[TemperatureReadingIn] = Field(..., max_length=50000)
+
+
+class JobCreate(BaseModel):
+    kind: str
+    params: dict = Field(default_factory=dict)
+
+
+class JobRead(BaseModel):
+    id: int
+    kind: str
+    status: str
+    progress: int
+    total: Optional[int] = None
+    message: Optional[str] = None
+    error: Optional[str] = None
+    cancel_requested: bool
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
 class StorageNodeBase(BaseModel):
     name: str
     node_type: str
@@ -99,6 +234,29 @@ class StoragePositionRead(BaseModel):
         from_attributes = True
 
 
+class BoxLayoutCreate(BaseModel):
+    name: str
+    rows: int = Field(..., ge=1)
+    cols: int = Field(..., ge=1)
+    label_scheme: str = "alpha_numeric"
+
+
+class BoxLayoutRead(BaseModel):
+    id: int
+    name: str
+    rows: int
+    cols: int
+    label_scheme: str
+
+    class Config:
+        from_attributes = True
+
+
+class AssignLayoutRequest(BaseModel):
+    layout_id: int
+    materialize: bool = False
+
+
 class PlaceSampleRequest(BaseModel):
     position_id: int = Field(..., description="Storage position id")
 
@@ -107,6 +265,45 @@ class MoveSampleRequest(BaseModel):
     to_position_id: int
 
 
+class BulkMoveItem(BaseModel):
+    sample_id: int
+    to_position_id: Optional[int] = None
+    to_box_id: Optional[int] = None
+    to_row: Optional[int] = None
+    to_col: Optional[int] = None
+    from_position_id: Optional[int] = None
+
+    @model_validator(mode="after")
+    def check_destination(self) -> "BulkMoveItem":
+        cell = (self.to_box_id, self.to_row, self.to_col)
+        if self.to_position_id is None and None in cell:
+            raise ValueError("Give to_position_id or to_box_id, to_row and to_col")
+        return self
+
+
+class BulkMoveRequest(BaseModel):
+    moves: list[BulkMoveItem]
+    batch_size: int = Field(500, ge=1, le=5000)
+    background: bool = False
+
+
+class RelocateRequest(BaseModel):
+    parent_id: Optional[int] = None
+    sample_events: bool = False
+
+
+class ConsolidationRequest(BaseModel):
+    group_by: Optional[str] = "sample_type"
+    batch_size: int = Field(500, ge=1, le=5000)
+    background: bool = False
+
+
+class EvacuationRequest(BaseModel):
+    freezer_ids: Optional[list[int]] = None
+    batch_size: int = Field(500, ge=1, le=5000)
+    background: bool = False
+
+
 class EventRead(BaseModel):
     id: int
     event_type: str
@@ -119,3 +316,62 @@ class EventRead(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class JobParams(BaseModel):
+    class Config:
+        extra = "forbid"
+
+
+class SeedStorageParams(JobParams):
+    pass
+
+
+class BoxPositionsParams(JobParams):
+    box_id: int
+    rows: int = Field(..., ge=1)
+    cols: int = Field(..., ge=1)
+    materialize: bool = True
+    label_scheme: str = "alpha_numeric"
+
+
+class ApplyMovesParams(JobParams):
+    moves: list[BulkMoveItem]
+    batch_size: int = Field(500, ge=1, le=5000)
+
+
+class SampleUpdateParams(SampleUpdate):
+    class Config:
+        extra = "forbid"
+
+
+class UpdateSamplesParams(JobParams):
+    sample_ids: list[int]
+    data: SampleUpdateParams
+
+
+class ExportSamplesParams(JobParams):
+    query: Optional[str] = None
+    status: Optional[str] = None
+    sample_type_id: Optional[int] = None
+    sort: str = "sample_id"
+    freezer_id: Optional[int] = None
+    placed: Optional[bool] = None
+    attributes: Optional[list[str]] = None
+
+
+class RenderLabelsParams(JobParams):
+    format: Literal["pdf", "zpl"] = "pdf"
+    sample_ids: Optional[list[int]] = Field(None, max_length=100000)
+    query: Optional[str] = None
+    status: Optional[str] = None
+    sample_type_id: Optional[int] = None
+    freezer_id: Optional[int] = None
+    placed: Optional[bool] = None
+    attributes: Optional[list[str]] = None
+
+    @model_validator(mode="after")
+    def check_selection(self) -> "RenderLabelsParams":
+        if not self.model_dump(exclude={"format"}, exclude_none=True):
+            raise ValueError("Select samples by id or filter")
+        return self
@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import create_engine, delete, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, sessionmaker
+
+from app import models
+from app.db import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("FREEZER_TELEMETRY_BUFFER", "1").lower() in {"1", "true", "yes"}
+FLUSH_MS = float(os.environ.get("FREEZER_TELEMETRY_FLUSH_MS", "1000"))
+MAX_BUFFER = int(os.environ.get("FREEZER_TELEMETRY_MAX_BUFFER", "5000"))
+MAX_PENDING = int(os.environ.get("FREEZER_TELEMETRY_MAX_PENDING", str(MAX_BUFFER * 20)))
+RAW_RETENTION = timedelta(days=int(os.environ.get("FREEZER_TELEMETRY_RAW_DAYS", "7")))
+MINUTE_RETENTION = timedelta(days=int(os.environ.get("FREEZER_TELEMETRY_MINUTE_DAYS", "90")))
+PRUNE_INTERVAL = 3600
+
+MINUTE = 60
+HOUR = 3600
+RESOLUTIONS = {"minute": MINUTE, "hour": HOUR}
+
+_EPOCH = datetime(1970, 1, 1)
+
+Reading = tuple[int, datetime, float]
+
+
+class TelemetryBufferFull(Exception):
+    pass
+
+
+class TelemetryBuffer:
+    """Collects readings in memory and writes them in bulk from one thread.
+
+    A flush happens every ``flush_ms`` or as soon as ``max_buffer`` readings
+    are pending, whichever comes first. A failed flush puts its batch back to
+    be retried, and ``add`` refuses readings beyond ``max_pending``. Raw rows
+    older than the retention window are pruned at most once per
+    ``PRUNE_INTERVAL``.
+    """
+
+    def __init__(
+        self,
+        url: str = DATABASE_URL,
+        flush_ms: float = FLUSH_MS,
+        max_buffer: int = MAX_BUFFER,
+        max_pending: int = MAX_PENDING,
+    ) -> None:
+        self.engine = create_engine(
+            url, connect_args={"check_same_thread": False, "timeout": 30}
+        )
+        self._sessions = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.interval = flush_ms / 1000
+        self.max_buffer = max_buffer
+        self.max_pending = max_pending
+        self.flushes = 0
+        self.readings = 0
+        self._pending: list[Reading] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._last_prune = 0.0
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(
+                target=self._run, name="telemetry-buffer", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stopping = True
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self.engine.dispose()
+
+    def add(self, readings: list[Reading]) -> None:
+        with self._lock:
+            if len(self._pending) + len(readings) > self.max_pending:
+                raise TelemetryBufferFull(
+                    f"{len(self._pending)} readings are waiting to be written"
+                )
+            self._pending.extend(readings)
+            full = len(self._pending) >= self.max_buffer
+        if full:
+            self._wake.set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            prune_due = time.monotonic() - self._last_prune >= PRUNE_INTERVAL
+            if not batch and not prune_due:
+                return 0
+            try:
+                with self._sessions() as session:
+                    if batch:
+                        write_readings(session, batch)
+                    if prune_due:
+                        prune(session)
+                        self._last_prune = time.monotonic()
+                    session.commit()
+            except Exception:
+                with self._lock:
+                    self._pending[:0] = batch
+                raise
+            if batch:
+                self.flushes += 1
+                self.readings += len(batch)
+            return len(batch)
+
+    def _run(self) -> None:
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Telemetry flush failed; the batch will be retried")
+
+
+_buffer: Optional[TelemetryBuffer] = None
+
+
+def start_buffer() -> Optional[TelemetryBuffer]:
+    global _buffer
+    if ENABLED and _buffer is None:
+        _buffer = TelemetryBuffer()
+        _buffer.start()
+    return _buffer
+
+
+def stop_buffer() -> None:
+    global _buffer
+    if _buffer is not None:
+        _buffer.stop()
+        _buffer = None
+
+
+def ingest(db: Session, readings: list[Reading]) -> int:
+    readings = [
+        (freezer_id, _naive_utc(recorded_at), temperature)
+        for freezer_id, recorded_at, temperature in readings
+    ]
+    if _buffer is None:
+        write_readings(db, readings)
+        db.commit()
+    else:
+        _buffer.add(readings)
+    return len(readings)
+
+
+def write_readings(db: Session, readings: list[Reading]) -> None:
+    if not readings:
+        return
+    db.execute(
+        insert(models.TemperatureReading),
+        [
+            {"freezer_id": freezer_id, "recorded_at": recorded_at, "temperature": temperature}
+            for freezer_id, recorded_at, temperature in readings
+        ],
+    )
+    # Fold the batch into per-bucket aggregates first so each bucket costs
+    # one upsert no matter how many readings landed in it.
+    buckets: dict[tuple[int, int, datetime], list] = {}
+    for freezer_id, recorded_at, temperature in readings:
+        for width in RESOLUTIONS.values():
+            key = (freezer_id, width, bucket_start(recorded_at, width))
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [temperature, temperature, temperature, 1]
+            else:
+                bucket[0] = min(bucket[0], temperature)
+                bucket[1] = max(bucket[1], temperature)
+                bucket[2] += temperature
+                bucket[3] += 1
+    table = models.TemperatureRollup.__table__
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["freezer_id", "resolution", "bucket_start"],
+        set_={
+            "min_temperature": func.min(table.c.min_temperature, stmt.excluded.min_temperature),
+            "max_temperature": func.max(table.c.max_temperature, stmt.excluded.max_temperature),
+            "sum_temperature": table.c.sum_temperature + stmt.excluded.sum_temperature,
+            "reading_count": table.c.reading_count + stmt.excluded.reading_count,
+        },
+    )
+    db.execute(
+        stmt,
+        [
+            {
+                "freezer_id": freezer_id,
+                "resolution": width,
+                "bucket_start": start,
+                "min_temperature": low,
+                "max_temperature": high,
+                "sum_temperature": total,
+                "reading_count": count,
+            }
+            for (freezer_id, width, start), (low, high, total, count) in buckets.items()
+        ],
+    )
+
+
+def prune(db: Session, now: Optional[datetime] = None) -> None:
+    now = now or datetime.utcnow()
+    db.execute(
+        delete(models.TemperatureReading).where(
+            models.TemperatureReading.recorded_at < now - RAW_RETENTION
+        )
+    )
+    db.execute(
+        delete(models.TemperatureRollup).where(
+            models.TemperatureRollup.resolution == MINUTE,
+            models.TemperatureRollup.bucket_start < now - MINUTE_RETENTION,
+        )
+    )
+
+
+def pick_resolution(start: datetime, end: datetime, now: Optional[datetime] = None) -> str:
+    now = now or datetime.utcnow()
+    span = end - start
+    if span <= timedelta(hours=6) and start >= now - RAW_RETENTION:
+        return "raw"
+    if span <= timedelta(days=7) and start >= now - MINUTE_RETENTION:
+        return "minute"
+    return "hour"
+
+
+def temperature_series(
+    db: Session,
+    freezer_id: int,
+    start: datetime,
+    end: datetime,
+    resolution: Optional[str] = None,
+) -> dict:
+    start, end = _naive_utc(start), _naive_utc(end)
+    resolution = resolution or pick_resolution(start, end)
+    if resolution == "raw":
+        reading = models.TemperatureReading
+        rows = db.execute(
+            select(reading.recorded_at, reading.temperature)
+            .where(
+                reading.freezer_id == freezer_id,
+                reading.recorded_at >= start,
+                reading.recorded_at < end,
+            )
+            .order_by(reading.recorded_at)
+        )
+        points = [
+            {"t": recorded_at, "min": value, "mean": value, "max": value, "count": 1}
+            for recorded_at, value in rows
+        ]
+    elif resolution in RESOLUTIONS:
+        rollup = models.TemperatureRollup
+        width = RESOLUTIONS[resolution]
+        rows = db.execute(
+            select(
+                rollup.bucket_start,
+                rollup.min_temperature,
+                rollup.sum_temperature / rollup.reading_count,
+                rollup.max_temperature,
+                rollup.reading_count,
+            )
+            .where(
+                rollup.freezer_id == freezer_id,
+                rollup.resolution == width,
+                rollup.bucket_start >= bucket_start(start, width),
+                rollup.bucket_start < end,
+            )
+            .order_by(rollup.bucket_start)
+        )
+        points = [
+            {"t": t, "min": low, "mean": mean, "max": high, "count": count}
+            for t, low, mean, high, count in rows
+        ]
+    else:
+        raise ValueError(f"Unknown resolution '{resolution}'")
+    return {"freezer_id": freezer_id, "resolution": resolution, "points": points}
+
+
+def bucket_start(moment: datetime, width: int) -> datetime:
+    seconds = int((moment - _EPOCH).total_seconds())
+    return _EPOCH + timedelta(seconds=seconds - seconds % width)
+
+
+def _naive_utc(moment: datetime) -> datetime:
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
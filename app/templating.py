@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import os
+import tempfile
+from pathlib import Path
+
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+TEMPLATE_DIR = Path(__file__).parent / "templates"
+CACHE_DIR = Path(
+    os.environ.get(
+        "FREEZER_TEMPLATE_CACHE",
+        Path(tempfile.gettempdir()) / "freezer-template-cache",
+    )
+)
+PRECOMPILE = os.environ.get("FREEZER_PRECOMPILE_TEMPLATES", "1").lower() not in {"0", "false", "no"}
+
+
+def _environment() -> Environment:
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    return Environment(
+        loader=FileSystemLoader(TEMPLATE_DIR),
+        autoescape=True,
+        bytecode_cache=FileSystemBytecodeCache(str(CACHE_DIR)),
+    )
+
+
+templates = Jinja2Templates(env=_environment())
+
+
+def precompile_templates() -> int:
+    names = templates.env.list_templates(extensions=["html"])
+    for name in names:
+        templates.env.get_template(name)
+    return len(names)
@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import json
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterator, Optional
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from app import archive, crud, models
+
+BACKFILL_BATCH = 5000
+
+
+def backfill_rollups(
+    db: Session,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None,
+) -> dict:
+    """Rebuild the daily rollups by replaying every live and archived event.
+
+    Events are replayed newest first, starting from today's storage tree and
+    undoing each relocation as it is passed, so every placement is counted
+    against the freezer its box was in at the time. Rollups only hold
+    per-day deltas until the end, so replay order does not matter for them.
+    The replay runs in memory; the write lock is only taken to replace the
+    tables' contents, together with anything logged in the meantime.
+    """
+    head = db.scalar(select(func.max(models.Event.id))) or 0
+    total = db.scalar(select(func.count(models.Event.id))) + sum(
+        db.execute(select(models.EventSegment.event_count)).scalars()
+    )
+    tree = _StorageTree(db)
+    activity: Counter = Counter()
+    changes: dict = defaultdict(lambda: [0, 0])
+
+    def fold(batch: list[dict]) -> None:
+        if not batch:
+            return
+        part_activity, part_changes = crud.fold_activity(batch, tree.position_nodes(batch))
+        activity.update(part_activity)
+        for key, (added, taken) in part_changes.items():
+            changes[key][0] += added
+            changes[key][1] += taken
+
+    done = 0
+    batch: list[dict] = []
+    for row in _events_newest_first(db, head):
+        if _is_relocation(row):
+            fold(batch)
+            fold([row])
+            batch = []
+            tree.undo(json.loads(row["payload_json"]))
+        else:
+            batch.append(row)
+            if len(batch) >= BACKFILL_BATCH:
+                fold(batch)
+                batch = []
+        done += 1
+        if progress is not None and done % BACKFILL_BATCH == 0:
+            progress(done, total)
+    fold(batch)
+
+    # The first delete takes the write lock, so no event can be logged
+    # between folding in the late ones below and the commit.
+    db.execute(delete(models.DailyActivity))
+    db.execute(delete(models.DailyOccupancy))
+    late = [
+        dict(row)
+        for row in db.execute(
+            select(models.Event.__table__).where(models.Event.id > head).order_by(models.Event.id)
+        ).mappings()
+    ]
+    if late:
+        late_activity, late_changes = crud.fold_activity(late, crud.position_nodes(db, _positions(late)))
+        activity.update(late_activity)
+        for key, (added, taken) in late_changes.items():
+            changes[key][0] += added
+            changes[key][1] += taken
+    occupancy_rows = []
+    running: dict[int, int] = defaultdict(int)
+    for (node_id, day), (added, taken) in sorted(changes.items(), key=lambda item: item[0][1]):
+        running[node_id] += added - taken
+        occupancy_rows.append(
+            {"node_id": node_id, "day": day, "occupied": running[node_id], "placed": added, "removed": taken}
+        )
+    if activity:
+        db.execute(
+            insert(models.DailyActivity),
+            [
+                {
+                    "day": day,
+                    "freezer_id": freezer_id,
+                    "box_id": box_id,
+                    "user_id": user_id,
+                    "event_type": event_type,
+                    "count": count,
+                }
+                for (day, freezer_id, box_id, user_id, event_type), count in activity.items()
+            ],
+        )
+    if occupancy_rows:
+        db.execute(insert(models.DailyOccupancy), occupancy_rows)
+    db.commit()
+    if progress is not None:
+        progress(done + len(late), total)
+    return {"events": done + len(late), "activity_rows": len(activity), "occupancy_rows": len(occupancy_rows)}
+
+
+class _StorageTree:
+    """Parent links of every storage node, rewound through relocations."""
+
+    def __init__(self, db: Session) -> None:
+        self._db = db
+        self.parents: dict[int, Optional[int]] = {}
+        self.freezers: set[int] = set()
+        for node_id, parent_id, node_type in db.execute(
+            select(models.StorageNode.id, models.StorageNode.parent_id, models.StorageNode.node_type)
+        ):
+            self.parents[node_id] = parent_id
+            if node_type == models.StorageNodeType.freezer:
+                self.freezers.add(node_id)
+        self._boxes: dict[int, int] = {}
+        self._freezer_of: dict[int, Optional[int]] = {}
+
+    def undo(self, summary: dict) -> None:
+        self.parents[summary["node_id"]] = summary.get("from_parent_id")
+        self._freezer_of.clear()
+
+    def freezer_of(self, node_id: Optional[int]) -> Optional[int]:
+        if node_id not in self._freezer_of:
+            current, seen = node_id, set()
+            while current is not None and current not in self.freezers and current not in seen:
+                seen.add(current)
+                current = self.parents.get(current)
+            self._freezer_of[node_id] = current
+        return self._freezer_of[node_id]
+
+    def position_nodes(self, rows: list[dict]) -> dict[int, tuple[int, Optional[int]]]:
+        missing = [position_id for position_id in _positions(rows) if position_id not in self._boxes]
+        if missing:
+            self._boxes.update(
+                self._db.execute(
+                    select(models.StoragePosition.id, models.StoragePosition.box_id).where(
+                        models.StoragePosition.id.in_(missing)
+                    )
+                ).all()
+            )
+        return {
+            position_id: (self._boxes[position_id], self.freezer_of(self._boxes[position_id]))
+            for position_id in _positions(rows)
+            if position_id in self._boxes
+        }
+
+
+def _positions(rows: list[dict]) -> set[int]:
+    return {
+        row[key] for row in rows for key in ("from_position_id", "to_position_id") if row.get(key)
+    }
+
+
+def _is_relocation(row: dict) -> bool:
+    return (
+        models.EventType(row["event_type"]) == models.EventType.relocate_storage
+        and row.get("sample_id") is None
+        and bool(row.get("payload_json"))
+    )
+
+
+def _events_newest_first(db: Session, head: int) -> Iterator[dict]:
+    upper = head + 1
+    while True:
+        rows = [
+            dict(row)
+            for row in db.execute(
+                select(models.Event.__table__)
+                .where(models.Event.id < upper)
+                .order_by(models.Event.id.desc())
+                .limit(BACKFILL_BATCH)
+            ).mappings()
+        ]
+        if not rows:
+            break
+        upper = rows[-1]["id"]
+        yield from rows
+    for path in db.execute(
+        select(models.EventSegment.path).order_by(models.EventSegment.max_event_id.desc())
+    ).scalars():
+        reader = archive.SegmentReader(path)
+        try:
+            for row in reader.rows(newest_first=True):
+                row["created_at"] = datetime.fromisoformat(row["created_at"])
+                yield row
+        finally:
+            reader.close()
+
+
+def occupancy_trend(db: Session, node_id: int, start: date, end: date) -> list[dict]:
+    """One point per day from ``start`` to ``end`` for a freezer or box.
+
+    Reads at most one row per day plus the last row before ``start``; days
+    without changes repeat the previous value.
+    """
+    table = models.DailyOccupancy
+    seed = db.execute(
+        select(table.occupied)
+        .where(table.node_id == node_id, table.day < start)
+        .order_by(table.day.desc())
+        .limit(1)
+    ).scalar() or 0
+    changes = {
+        row.day: row
+        for row in db.execute(
+            select(table.day, table.occupied, table.placed, table.removed)
+            .where(table.node_id == node_id, table.day >= start, table.day <= end)
+        )
+    }
+    points = []
+    occupied = seed
+    day = start
+    while day <= end:
+        row = changes.get(day)
+        if row is not None:
+            occupied = row.occupied
+        points.append(
+            {
+                "day": day,
+                "occupied": occupied,
+                "placed": row.placed if row else 0,
+                "removed": row.removed if row else 0,
+            }
+        )
+        day += timedelta(days=1)
+    return points
+
+
+def activity_trend(
+    db: Session,
+    start: date,
+    end: date,
+    freezer_id: Optional[int] = None,
+    box_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    event_types: Optional[list[str]] = None,
+) -> list[dict]:
+    table = models.DailyActivity
+    query = (
+        select(table.day, table.event_type, func.sum(table.count))
+        .where(table.day >= start, table.day <= end)
+        .group_by(table.day, table.event_type)
+    )
+    if freezer_id is not None:
+        query = query.where(table.freezer_id == freezer_id)
+    if box_id is not None:
+        query = query.where(table.box_id == box_id)
+    if user_id is not None:
+        query = query.where(table.user_id == user_id)
+    if event_types:
+        query = query.where(table.event_type.in_(event_types))
+    counts: dict[date, dict[str, int]] = defaultdict(dict)
+    for day, event_type, count in db.execute(query):
+        counts[day][event_type] = count
+    points = []
+    day = start
+    while day <= end:
+        points.append({"day": day, "counts": counts.get(day, {})})
+        day += timedelta(days=1)
+    return points
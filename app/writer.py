@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.db import DATABASE_URL
+
+ENABLED = os.environ.get("FREEZER_WRITE_COORDINATOR", "").lower() in {"1", "true", "yes"}
+WINDOW_MS = float(os.environ.get("FREEZER_GROUP_COMMIT_MS", "5"))
+MAX_BATCH = int(os.environ.get("FREEZER_GROUP_COMMIT_MAX", "256"))
+
+
+@dataclass
+class _Job:
+    fn: Callable[..., Any]
+    args: tuple
+    kwargs: dict
+    future: Future = field(default_factory=Future)
+
+
+class WriteCoordinator:
+    """Funnels mutations through one thread and commits them in groups.
+
+    Jobs arriving within ``window_ms`` of the first job in a batch share one
+    transaction. Each job runs inside its own SAVEPOINT, so a failing job only
+    rolls back its own changes and reports its own exception.
+    """
+
+    def __init__(
+        self,
+        url: str = DATABASE_URL,
+        window_ms: float = WINDOW_MS,
+        max_batch: int = MAX_BATCH,
+    ) -> None:
+        self.engine = create_engine(
+            url, connect_args={"check_same_thread": False, "timeout": 30}
+        )
+        event.listen(self.engine, "connect", _manual_transactions)
+        event.listen(self.engine, "begin", _begin_immediate)
+        self._sessions = sessionmaker(
+            bind=self.engine,
+            autoflush=False,
+            expire_on_commit=False,
+            info={"group_commit": True},
+        )
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.batches = 0
+        self.jobs = 0
+        self._queue: queue.Queue[Optional[_Job]] = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="write-coordinator", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self.engine.dispose()
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        job = _Job(fn=fn, args=args, kwargs=kwargs)
+        self._queue.put(job)
+        return job.future
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            batch = [job]
+            deadline = time.monotonic() + self.window
+            stopping = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+            self._commit_batch(batch)
+            if stopping:
+                return
+
+    def _commit_batch(self, batch: list[_Job]) -> None:
+        session = self._sessions()
+        outcomes = []
+        try:
+            for job in batch:
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    with session.begin_nested():
+                        args = [_attach(session, arg) for arg in job.args]
+                        kwargs = {
+                            key: _attach(session, value)
+                            for key, value in job.kwargs.items()
+                        }
+                        outcomes.append((job, job.fn(session, *args, **kwargs), None))
+                except Exception as exc:
+                    outcomes.append((job, None, exc))
+            session.commit()
+        except Exception as exc:
+            session.rollback()
+            for job, _, _ in outcomes:
+                job.future.set_exception(exc)
+            return
+        finally:
+            session.close()
+        self.batches += 1
+        self.jobs += len(outcomes)
+        for job, result, error in outcomes:
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+
+_coordinator: Optional[WriteCoordinator] = None
+
+
+def start_coordinator() -> Optional[WriteCoordinator]:
+    global _coordinator
+    if ENABLED and _coordinator is None:
+        _coordinator = WriteCoordinator()
+        _coordinator.start()
+    return _coordinator
+
+
+def stop_coordinator() -> None:
+    global _coordinator
+    if _coordinator is not None:
+        _coordinator.stop()
+        _coordinator = None
+
+
+async def execute(db: Session, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    if _coordinator is None:
+        return fn(db, *args, **kwargs)
+    return await asyncio.wrap_future(_coordinator.submit(fn, *args, **kwargs))
+
+
+def run(db: Session, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Blocking ``execute`` for plain ``def`` routes running in the threadpool."""
+    if _coordinator is None:
+        return fn(db, *args, **kwargs)
+    return _coordinator.submit(fn, *args, **kwargs).result()
+
+
+def _attach(session: Session, value: Any) -> Any:
+    state = inspect(value, raiseerr=False)
+    if state is None or not hasattr(state, "mapper") or state.key is None:
+        return value
+    return session.merge(value, load=False)
+
+
+def _manual_transactions(dbapi_connection, connection_record) -> None:
+    # Let SQLAlchemy emit BEGIN itself so SAVEPOINTs behave under pysqlite.
+    dbapi_connection.isolation_level = None
+
+
+def _begin_immediate(connection) -> None:
+    connection.exec_driver_sql("BEGIN IMMEDIATE")
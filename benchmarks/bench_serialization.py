@@ -0,0 +1,84 @@
+"""Compare the ORM + Pydantic list path with Core rows + FastJSONResponse.
+
+Usage: python -m benchmarks.bench_serialization [--rows 100000]
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import crud, models, schemas
+from app.responses import FastJSONResponse, orjson
+
+
+def build_session(rows: int):
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    models.Base.metadata.create_all(engine)
+    now = datetime.utcnow()
+    with engine.begin() as connection:
+        connection.execute(
+            insert(models.Sample),
+            [
+                {
+                    "sample_id": f"S{index:07d}",
+                    "name": f"Sample {index}",
+                    "status": "active",
+                    "volume": 1.5,
+                    "volume_units": "mL",
+                    "notes": None,
+                    "created_at": now,
+                    "updated_at": now,
+                }
+                for index in range(rows)
+            ],
+        )
+    return sessionmaker(bind=engine)
+
+
+def orm_path(db) -> bytes:
+    samples = crud.list_samples(db)
+    payload = [schemas.SampleRead.model_validate(sample) for sample in samples]
+    return JSONResponse(jsonable_encoder(payload)).body
+
+
+def core_path(db) -> bytes:
+    return FastJSONResponse(crud.list_sample_rows(db)).body
+
+
+def measure(name: str, fn, sessions, rows: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        db = sessions()
+        start = time.perf_counter()
+        fn(db)
+        best = min(best, time.perf_counter() - start)
+        db.close()
+    print(f"{name:<28} {best:8.3f}s  {rows / best:12,.0f} rows/s")
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    sessions = build_session(args.rows)
+    print(f"{args.rows:,} samples, encoder: {'orjson' if orjson else 'json'}")
+    orm = measure("ORM + model_validate", orm_path, sessions, args.rows, args.repeat)
+    core = measure("Core rows + FastJSONResponse", core_path, sessions, args.rows, args.repeat)
+    print(f"speedup: {orm / core:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
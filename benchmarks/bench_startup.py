@@ -0,0 +1,76 @@
+"""Measure import time and time-to-first-response for ``app.main:app``.
+
+Each run happens in a fresh interpreter. The first run uses an empty
+template bytecode cache; later runs reuse it, as a redeployed worker would.
+
+Usage: python -m benchmarks.bench_startup [--runs 5]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app.main.app) as client:
+    ready = time.perf_counter()
+    response = client.get("/login")
+    first = time.perf_counter()
+print(json.dumps({
+    "status": response.status_code,
+    "import": imported - start,
+    "startup": ready - imported,
+    "first_response": first - ready,
+    "total": first - start,
+}))
+"""
+
+
+def run_probe(cache_dir: str, precompile: bool) -> dict:
+    env = dict(
+        os.environ,
+        FREEZER_TEMPLATE_CACHE=cache_dir,
+        FREEZER_PRECOMPILE_TEMPLATES="1" if precompile else "0",
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        check=True,
+        capture_output=True,
+        text=True,
+        env=env,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    for precompile in (False, True):
+        cache_dir = tempfile.mkdtemp(prefix="freezer-bench-")
+        try:
+            print(f"precompile={'on' if precompile else 'off'}")
+            for run in range(args.runs):
+                timing = run_probe(cache_dir, precompile)
+                label = "cold cache" if run == 0 else "warm cache"
+                print(
+                    f"  {label:<10} import {timing['import'] * 1000:7.1f} ms"
+                    f"  startup {timing['startup'] * 1000:7.1f} ms"
+                    f"  first response {timing['first_response'] * 1000:7.1f} ms"
+                    f"  total {timing['total'] * 1000:7.1f} ms"
+                )
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
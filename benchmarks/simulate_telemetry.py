@@ -0,0 +1,130 @@
+"""Generate freezer temperature readings and measure ingest and chart queries.
+
+By default readings are written straight into a scratch SQLite database via
+the same bulk path the ingestion buffer uses. With --url they are POSTed in
+batches to a running server's /telemetry/temperature endpoint instead.
+
+Usage: python -m benchmarks.simulate_telemetry [--freezers 10] [--days 30]
+       python -m benchmarks.simulate_telemetry --url http://localhost:8000 --freezer-ids 1 2
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Iterator
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app import models, telemetry
+
+
+def simulate_readings(
+    freezer_ids: list[int], start: datetime, count: int, interval: int, seed: int = 0
+) -> Iterator[tuple[int, datetime, float]]:
+    rng = random.Random(seed)
+    temperatures = {freezer_id: -80.0 for freezer_id in freezer_ids}
+    for step in range(count):
+        moment = start + timedelta(seconds=step * interval)
+        for freezer_id in freezer_ids:
+            # Drift back toward setpoint, with the occasional door opening.
+            value = temperatures[freezer_id]
+            value += (-80.0 - value) * 0.05 + rng.gauss(0, 0.2)
+            if rng.random() < 0.0005:
+                value += rng.uniform(5, 15)
+            temperatures[freezer_id] = value
+            yield freezer_id, moment, round(value, 2)
+
+
+def batches(readings, size: int):
+    batch = []
+    for reading in readings:
+        batch.append(reading)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run_local(args) -> None:
+    path = os.path.join(tempfile.mkdtemp(), "telemetry.db")
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(engine)
+    freezer_ids = list(range(1, args.freezers + 1))
+    with engine.begin() as connection:
+        connection.execute(
+            insert(models.StorageNode),
+            [
+                {"id": freezer_id, "name": f"Freezer {freezer_id}", "node_type": "freezer"}
+                for freezer_id in freezer_ids
+            ],
+        )
+    sessions = sessionmaker(bind=engine)
+    steps = args.days * 86400 // args.interval
+    end = datetime.utcnow().replace(microsecond=0)
+    start = end - timedelta(days=args.days)
+    total = 0
+    began = time.perf_counter()
+    for batch in batches(simulate_readings(freezer_ids, start, steps, args.interval), args.batch):
+        with sessions() as db:
+            telemetry.write_readings(db, batch)
+            db.commit()
+        total += len(batch)
+    elapsed = time.perf_counter() - began
+    print(f"ingested {total:,} readings in {elapsed:.2f}s ({total / elapsed:,.0f}/s)")
+    with sessions() as db:
+        for label, window in (("6 hours", timedelta(hours=6)), ("7 days", timedelta(days=7)), ("full span", end - start)):
+            began = time.perf_counter()
+            series = telemetry.temperature_series(db, 1, end - window, end)
+            print(
+                f"{label:<10} {series['resolution']:<7} {len(series['points']):>7,} points"
+                f"  {time.perf_counter() - began:.3f}s"
+            )
+
+
+def run_remote(args) -> None:
+    import httpx
+
+    steps = args.days * 86400 // args.interval
+    start = datetime.utcnow() - timedelta(days=args.days)
+    total = 0
+    began = time.perf_counter()
+    with httpx.Client(base_url=args.url) as client:
+        for batch in batches(simulate_readings(args.freezer_ids, start, steps, args.interval), args.batch):
+            response = client.post(
+                "/telemetry/temperature",
+                json={
+                    "readings": [
+                        {"freezer_id": freezer_id, "recorded_at": moment.isoformat(), "temperature": value}
+                        for freezer_id, moment, value in batch
+                    ]
+                },
+            )
+            response.raise_for_status()
+            total += len(batch)
+    elapsed = time.perf_counter() - began
+    print(f"posted {total:,} readings in {elapsed:.2f}s ({total / elapsed:,.0f}/s)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--freezers", type=int, default=10)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--interval", type=int, default=10, help="seconds between readings")
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--url", help="POST to a running server instead of a scratch DB")
+    parser.add_argument("--freezer-ids", type=int, nargs="+", default=[1])
+    args = parser.parse_args()
+    if args.url:
+        run_remote(args)
+    else:
+        run_local(args)
+
+
+if __name__ == "__main__":
+    main()